@@ -0,0 +1,344 @@
+"""
+Throughput and latency of the hotel API, with a regression check
+
+Seeds --hotels hotels through POST /hotels/bulk, spread over countries,
+states, cities and areas with a Zipf skew like real listings have. Then it
+measures:
+
+  get_hit:<filter>   repeated GET /hotels pages, served from the caches
+  get_miss:<filter>  the same pages right after a Redis FLUSHDB, from Postgres
+  post               POST /hotels
+  put                PUT /hotels on the hotels just created
+  delete             DELETE /hotel on the same hotels
+
+<filter> is country, state, city, area (the most popular value of each level)
+or all. Every result has the request count, throughput and p50/p95/p99
+latency, and the report is printed as JSON (or written to --output).
+
+The app runs in process through its lifespan, against REDIS_URL (or fakeredis
+with --fakeredis) and a scratch schema of the Postgres database configured in
+.env. The schema is dropped at the end, the tables of the database itself are
+not touched. Use --base-url to load a running server instead, the hotels are
+then seeded into its database and left there.
+
+Misses are measured after a FLUSHDB of the whole Redis database, so against a
+real Redis the run refuses to measure them unless --flush-redis says REDIS_URL
+(or --redis-url) is reserved for benchmarks. --miss-requests 0 skips them.
+
+With --baseline the run is compared to an earlier report and exits with
+status 1 when a p95 latency grew, or a throughput dropped, by more than
+--threshold (a fraction).
+
+    uv run python benchmarks/load_test.py --hotels 20000 --output run.json
+    uv run python benchmarks/load_test.py --baseline run.json --threshold 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import AsyncExitStack
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Rows per level, each state belongs to one country, each city to one state...
+COUNTRIES = 5
+STATES_PER_COUNTRY = 8
+CITIES_PER_STATE = 10
+AREAS_PER_CITY = 12
+ZIPF_EXPONENT = 1.1
+SEED_BATCH = 5000
+SCHEMA = "bench_load"
+
+
+def zipf_weights(count: int):
+    return [1 / rank**ZIPF_EXPONENT for rank in range(1, count + 1)]
+
+
+def sample_hotels(count: int, run: str, rng: random.Random):
+    """Hotels whose locations follow a Zipf skew at every level"""
+    levels = (
+        ("country", COUNTRIES),
+        ("state", STATES_PER_COUNTRY),
+        ("city", CITIES_PER_STATE),
+        ("area", AREAS_PER_CITY),
+    )
+    weights = {field: zipf_weights(size) for field, size in levels}
+    for i in range(count):
+        location, path = {}, run
+        for field, size in levels:
+            path = f"{path}-{rng.choices(range(size), weights[field])[0]}"
+            location[field] = f"{field} {path}"
+        yield {
+            "name": f"Hotel {run} {i}",
+            "description": "A comfortable stay close to the city centre",
+            "streetaddress": f"{rng.randrange(1, 500)} Main Road",
+            "latitude": round(rng.uniform(8, 35), 6),
+            "longitude": round(rng.uniform(68, 97), 6),
+            **location,
+        }
+
+
+def hottest_filters(hotels):
+    """The most popular value of every level, the filters worth caching"""
+    filters = {"all": {}}
+    for field in ("country", "state", "city", "area"):
+        value, _ = Counter(hotel[field] for hotel in hotels).most_common(1)[0]
+        filters[field] = {field: value}
+    return filters
+
+
+# <---------------Functions to time requests and summarise them---------------->
+def percentile(values, p: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarise(latencies, errors: int, elapsed: float) -> dict:
+    count = len(latencies)
+    latencies = sorted(latencies) or [0.0]
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def timed(send, count: int, concurrency: int, before=None) -> dict:
+    """
+    Send count requests, at most concurrency at a time
+
+    Args:
+        send: Called with the request number, returns the response
+        before: Awaited before every request, outside the timing
+    """
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            if before is not None:
+                await before()
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return summarise(latencies, errors, time.perf_counter() - start)
+
+
+# <---------------Benchmark phases---------------->
+async def seed(client, hotels) -> dict:
+    start = time.perf_counter()
+    for offset in range(0, len(hotels), SEED_BATCH):
+        response = await client.post(
+            "/hotels/bulk", json=hotels[offset : offset + SEED_BATCH]
+        )
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return {"hotels": len(hotels), "hotels_per_second": round(len(hotels) / elapsed)}
+
+
+async def run_reads(client, redis, filters, args) -> dict:
+    results = {}
+    for name, params in filters.items():
+        params = {**params, "limit": args.page_size}
+
+        await client.get("/hotels", params=params)  # warm every cache layer
+        results[f"get_hit:{name}"] = await timed(
+            lambda i: client.get("/hotels", params=params),
+            args.requests,
+            args.concurrency,
+        )
+
+        if not args.miss_requests:
+            continue
+        # One at a time, a concurrent request would find the page refilled
+        results[f"get_miss:{name}"] = await timed(
+            lambda i: client.get("/hotels", params=params),
+            args.miss_requests,
+            1,
+            before=redis.flushdb,
+        )
+    return results
+
+
+async def run_writes(client, run: str, rng: random.Random, args) -> dict:
+    new_hotels = list(sample_hotels(args.writes, f"{run}w", rng))
+    ids = [None] * args.writes
+
+    async def post(i: int):
+        response = await client.post("/hotels", json=new_hotels[i])
+        if response.status_code < 400:
+            ids[i] = response.json()["id"]
+        return response
+
+    results = {"post": await timed(post, args.writes, args.concurrency)}
+    ids = [id for id in ids if id is not None]
+
+    results["put"] = await timed(
+        lambda i: client.put(
+            "/hotels", json={"id": ids[i], "description": f"Renovated {i}"}
+        ),
+        len(ids),
+        args.concurrency,
+    )
+    results["delete"] = await timed(
+        lambda i: client.delete("/hotel", params={"id": ids[i]}),
+        len(ids),
+        args.concurrency,
+    )
+    return results
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:6]
+    hotels = list(sample_hotels(args.hotels, run_id, rng))
+
+    async with AsyncExitStack() as stack:
+        if args.base_url:
+            from redis.asyncio import Redis
+
+            redis = Redis.from_url(args.redis_url or os.getenv("REDIS_URL"))
+            stack.push_async_callback(redis.aclose)
+            transport, base_url = None, args.base_url
+        else:
+            redis = await start_app(stack, args.fakeredis)
+            from main import app
+
+            transport, base_url = httpx.ASGITransport(app=app), "http://bench"
+
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60)
+        )
+
+        report = {
+            "config": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("output", "baseline", "threshold")
+            },
+            "seed": await seed(client, hotels),
+            "results": {},
+        }
+        report["results"].update(
+            await run_reads(client, redis, hottest_filters(hotels), args)
+        )
+        report["results"].update(await run_writes(client, run_id, rng, args))
+        return report
+
+
+async def start_app(stack: AsyncExitStack, fakeredis: bool):
+    """
+    Run the app's lifespan in process, on a scratch schema dropped when the
+    stack closes, returning its Redis client
+    """
+    # Read when the engines are created, before the app is imported
+    os.environ["DATABASE_SEARCH_PATH"] = SCHEMA
+    from sqlalchemy import text
+
+    import configs.connect as connect
+    import configs.redis_pool as redis_pool
+
+    async with connect.engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    async def drop_schema():
+        # After the lifespan closed the pools, a fresh connection drops it
+        async with connect.engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await connect.engine.dispose()
+
+    stack.push_async_callback(drop_schema)
+
+    if fakeredis:
+        # Optional, only needed when no Redis server is around
+        from fakeredis import FakeAsyncRedis
+
+        import functions.func as func
+
+        redis_pool.redis = func.redis = FakeAsyncRedis()
+
+    from main import app
+
+    await stack.enter_async_context(app.router.lifespan_context(app))
+    return redis_pool.redis
+
+
+# <---------------Function to compare a run to a baseline---------------->
+def regressions(baseline: dict, report: dict, threshold: float):
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            yield f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms"
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+            yield (
+                f"{name}: throughput {previous['throughput_rps']}/s -> "
+                f"{current['throughput_rps']}/s"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hotels", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=500, help="per cached read")
+    parser.add_argument("--miss-requests", type=int, default=20)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-url", help="load a running server instead")
+    parser.add_argument("--redis-url", help="the server's Redis, with --base-url")
+    parser.add_argument("--fakeredis", action="store_true")
+    parser.add_argument(
+        "--flush-redis",
+        action="store_true",
+        help="allow FLUSHDB on a real Redis to measure misses",
+    )
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.miss_requests and not (args.fakeredis or args.flush_redis):
+        parser.error(
+            "measuring misses runs FLUSHDB on the Redis database, pass "
+            "--flush-redis if it is reserved for benchmarks or --miss-requests 0"
+        )
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed = list(regressions(json.load(f), report, args.threshold))
+        for message in failed:
+            print(f"regression: {message}", file=sys.stderr)
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
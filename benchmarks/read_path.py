@@ -0,0 +1,144 @@
+"""
+Compare the CPU cost of the ORM and Core read paths on a cache miss
+
+Generates hotels in a scratch schema, then reads them back the way a cache
+miss used to (ORM HotelRead objects, a dict built per hotel, then re-validated
+through the pydantic Hotel model before being stored) and the way get_hotel
+does now (a Core select returning RowMappings). Wall and CPU time are the
+best of --repeat runs for every row count. Prints a JSON report and drops the
+scratch schema at the end.
+
+    uv run python benchmarks/read_path.py --counts 10000 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from configs.connect import DATABASE_URL  # noqa: E402
+from interfaces.pydantic import Hotel  # noqa: E402
+from models.hotel import Base, HotelRead  # noqa: E402
+from queries.query import HOTEL_COLUMNS, reconcile_hotel_read  # noqa: E402
+
+SCHEMA = "bench_read_path"
+
+
+async def generate(engine, count: int):
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.run_sync(Base.metadata.create_all)
+
+        for table, column in (
+            ("Country", "country"),
+            ("State", "state"),
+            ("City", "city"),
+            ("Area", "area"),
+        ):
+            await conn.execute(
+                text(
+                    f'INSERT INTO "{table}" ({column}) '
+                    f"SELECT '{column} ' || i FROM generate_series(1, 100) i"
+                )
+            )
+
+        await conn.execute(
+            text(
+                "INSERT INTO hotels (name, description, streetaddress, latitude, "
+                "longitude, country_id, state_id, city_id, area_id) "
+                "SELECT 'Hotel ' || i, 'description', i || ' Main Road', "
+                "random() * 180 - 90, random() * 360 - 180, "
+                "i % 100 + 1, i % 100 + 1, i % 100 + 1, i % 100 + 1 "
+                f"FROM generate_series(1, {count}) i"
+            )
+        )
+
+    async with AsyncSession(engine) as db:
+        await reconcile_hotel_read(db)
+
+
+# The read path before the Core select, three objects per hotel
+async def orm_path(db: AsyncSession, count: int) -> list:
+    query = select(HotelRead).order_by(HotelRead.id).limit(count)
+    hotels = (await db.execute(query)).scalars().all()
+    rows = [
+        {
+            "id": hotel.id,
+            "name": hotel.name,
+            "description": hotel.description,
+            "streetaddress": hotel.streetaddress,
+            "latitude": hotel.latitude,
+            "longitude": hotel.longitude,
+            "country": hotel.country,
+            "state": hotel.state,
+            "city": hotel.city,
+            "area": hotel.area,
+        }
+        for hotel in hotels
+    ]
+    return [Hotel(**row).dict() for row in rows]
+
+
+async def core_path(db: AsyncSession, count: int) -> list:
+    query = select(*HOTEL_COLUMNS).order_by(HOTEL_COLUMNS[0]).limit(count)
+    return (await db.execute(query)).mappings().all()
+
+
+async def measure(engine, path, count: int, repeat: int) -> dict:
+    best = None
+    for _ in range(repeat):
+        # A fresh session each time, so the identity map starts empty
+        async with AsyncSession(engine) as db:
+            wall, cpu = time.perf_counter(), time.process_time()
+            rows = await path(db, count)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        assert len(rows) == count
+        if best is None or cpu < best["cpu_seconds"]:
+            best = {"wall_seconds": round(wall, 4), "cpu_seconds": round(cpu, 4)}
+    best["cpu_us_per_row"] = round(best["cpu_seconds"] / count * 1e6, 2)
+    return best
+
+
+async def run(url: str, counts: list, repeat: int) -> dict:
+    engine = create_async_engine(
+        url, connect_args={"server_settings": {"search_path": SCHEMA}}
+    )
+    try:
+        await generate(engine, max(counts))
+        report = {"repeat": repeat, "counts": {}}
+        for count in counts:
+            orm = await measure(engine, orm_path, count, repeat)
+            core = await measure(engine, core_path, count, repeat)
+            report["counts"][count] = {
+                "orm": orm,
+                "core": core,
+                "cpu_speedup": round(orm["cpu_seconds"] / core["cpu_seconds"], 2),
+            }
+        return report
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--url", default=DATABASE_URL)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.url, args.counts, args.repeat))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Per-hotel Redis memory usage of the legacy hash layout vs the packed layout
+
+Writes synthetic hotels under a scratch prefix, reports MEMORY USAGE per
+hotel for the hotel value itself and for the index sets, then cleans up.
+
+    uv run python benchmarks/redis_memory.py --count 10000 --url redis://localhost:6379/15
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from redis import Redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from functions.codec import encode_hotel  # noqa: E402
+
+PREFIX = "bench:memory"
+
+
+def sample_hotels(count: int):
+    """Hotels spread over a handful of countries, states, cities and areas"""
+    rng = random.Random(42)
+    for id in range(1, count + 1):
+        country = rng.randrange(1, 6)
+        state = country * 100 + rng.randrange(10)
+        city = state * 100 + rng.randrange(20)
+        area = city * 100 + rng.randrange(30)
+        yield (
+            {
+                "id": id,
+                "name": f"Hotel {id}",
+                "description": "A comfortable stay close to the city centre " * 2,
+                "streetaddress": f"{rng.randrange(1, 500)} Main Road",
+                "latitude": round(rng.uniform(8, 35), 6),
+                "longitude": round(rng.uniform(68, 97), 6),
+                "country": f"Country {country}",
+                "state": f"State {state}",
+                "city": f"City {city}",
+                "area": f"Area {area}",
+            },
+            (country, state, city, area),
+        )
+
+
+def write_legacy(client: Redis, hotels):
+    """Hash with field names and location names, sets keyed by name path"""
+    pipe = client.pipeline(transaction=False)
+    for hotel, _ in hotels:
+        key = f"{PREFIX}:legacy:loc:{hotel['id']}"
+        pipe.hset(key, mapping=hotel)
+        path = [hotel["country"], hotel["state"], hotel["city"], hotel["area"]]
+        for depth in range(len(path)):
+            pipe.zadd(
+                f"{PREFIX}:legacy:set:{':'.join(path[: depth + 1])}", {key: hotel["id"]}
+            )
+        pipe.zadd(f"{PREFIX}:legacy:set:ALL", {key: hotel["id"]})
+    pipe.execute()
+
+
+def write_packed(client: Redis, hotels):
+    """Packed value with location ids, sets keyed by location id"""
+    pipe = client.pipeline(transaction=False)
+    for hotel, ids in hotels:
+        pipe.set(f"{PREFIX}:packed:loc:{hotel['id']}", encode_hotel(hotel, ids))
+        for field, location_id in zip(("country", "state", "city", "area"), ids):
+            pipe.zadd(
+                f"{PREFIX}:packed:idx:{field}:{location_id}", {hotel["id"]: hotel["id"]}
+            )
+        pipe.zadd(f"{PREFIX}:packed:ALL", {hotel["id"]: hotel["id"]})
+    pipe.execute()
+
+
+def measure(client: Redis, layout: str, count: int):
+    values = sets = 0
+    for key in client.scan_iter(f"{PREFIX}:{layout}:*", count=1000):
+        usage = client.memory_usage(key, samples=0) or 0
+        if b":loc:" in key:
+            values += usage
+        else:
+            sets += usage
+    return {
+        "value_bytes_per_hotel": round(values / count, 1),
+        "index_bytes_per_hotel": round(sets / count, 1),
+        "total_bytes_per_hotel": round((values + sets) / count, 1),
+    }
+
+
+def cleanup(client: Redis):
+    keys = list(client.scan_iter(f"{PREFIX}:*", count=1000))
+    for start in range(0, len(keys), 1000):
+        client.delete(*keys[start : start + 1000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    client = Redis.from_url(args.url)
+    cleanup(client)
+    hotels = list(sample_hotels(args.count))
+    try:
+        write_legacy(client, hotels)
+        write_packed(client, hotels)
+        report = {
+            "count": args.count,
+            "legacy": measure(client, "legacy", args.count),
+            "packed": measure(client, "packed", args.count),
+        }
+    finally:
+        cleanup(client)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
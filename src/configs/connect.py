@@ -1,7 +1,13 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Any, Dict, Optional
+import asyncpg
+import itertools
 import os
+import time
 from dotenv import load_dotenv
+from fastapi import Request, Response
 
 load_dotenv()
 
@@ -15,6 +21,53 @@ database = os.getenv("DATABASE")
 # SQLAlchemy connection URL
 DATABASE_URL = f"postgresql+asyncpg://{username}:{password}@{host}:{port}/{database}"
 
+# Sessions of the API are tagged with this name, the change feed triggers
+# skip their writes since the API keeps Redis in sync itself
+APPLICATION_NAME = os.getenv("DATABASE_APPLICATION_NAME", "redis_hotel")
+# Schema(s) the tables live in, the server's default search_path when unset
+SEARCH_PATH = os.getenv("DATABASE_SEARCH_PATH")
+CONNECT_ARGS = {
+    "server_settings": {
+        "application_name": APPLICATION_NAME,
+        **({"search_path": SEARCH_PATH} if SEARCH_PATH else {}),
+    }
+}
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long sessions wait for a connection
+
+    The wait includes opening an overflow connection and the pre-ping, the
+    whole time between asking for a connection and being able to use it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        waited = time.perf_counter() - start
+
+        self.checkouts += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return connection
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
 
 engine = create_async_engine(
     DATABASE_URL,
@@ -23,6 +76,8 @@ engine = create_async_engine(
     pool_timeout=30,  # Timeout for acquiring a connection
     pool_pre_ping=True,  # Ensure connections are alive
     echo=False,  # Enable SQL logging for debugging
+    connect_args=CONNECT_ARGS,
+    poolclass=InstrumentedQueuePool,
 )
 
 
@@ -35,7 +90,105 @@ AsyncSessionLocal = sessionmaker(
 )
 
 
-# Dependency to provide async session
-async def get_db():
+# Comma separated SQLAlchemy URLs of the read replicas, each gets a pool of
+# READ_POOL_SIZE + READ_MAX_OVERFLOW connections. Without any, reads share the
+# pool of the primary engine above and no read-your-writes pin is set, so a
+# single database is not opened twice as many connections.
+READ_DATABASE_URLS = [
+    url.strip() for url in os.getenv("READ_DATABASE_URLS", "").split(",") if url.strip()
+]
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "20"))
+READ_MAX_OVERFLOW = int(os.getenv("READ_MAX_OVERFLOW", "10"))
+
+# Seconds a client keeps reading from the primary after it wrote, so it sees
+# its own write despite replica lag. 0 turns the pin off.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+PRIMARY_PIN_COOKIE = "db_primary_until"
+
+read_engines = [
+    create_async_engine(
+        url,
+        pool_size=READ_POOL_SIZE,
+        max_overflow=READ_MAX_OVERFLOW,
+        pool_timeout=30,
+        pool_pre_ping=True,
+        echo=False,
+        connect_args=CONNECT_ARGS,
+        poolclass=InstrumentedQueuePool,
+    )
+    for url in READ_DATABASE_URLS
+] or [engine]
+
+# Read sessions are bound to an engine when they are opened
+ReadSessionLocal = sessionmaker(
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autoflush=False,
+)
+
+_rotation = itertools.count()
+
+
+def pick_read_engine():
+    """The replica with the fewest checked out connections, round robin on ties"""
+    start = next(_rotation) % len(read_engines)
+    ordered = read_engines[start:] + read_engines[:start]
+    return min(ordered, key=lambda engine: engine.pool.checkedout())
+
+
+def db_pool_stats() -> Dict[str, Dict[str, Any]]:
+    pools = {"primary": engine.pool.stats()}
+    for i, read_engine in enumerate(read_engines):
+        if read_engine is not engine:
+            pools[f"read-{i}"] = read_engine.pool.stats()
+    return pools
+
+
+def read_session(bind: Optional[AsyncEngine] = None) -> AsyncSession:
+    """A read only session, on a replica unless bind names the engine to use"""
+    return ReadSessionLocal(bind=bind or pick_read_engine())
+
+
+# Dependency to provide async session, for requests that write
+async def get_db(response: Response):
+    if READ_DATABASE_URLS and READ_YOUR_WRITES_SECONDS > 0:
+        # Route this client's reads to the primary until replicas caught up
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE,
+            str(time.time() + READ_YOUR_WRITES_SECONDS),
+            max_age=int(READ_YOUR_WRITES_SECONDS) + 1,
+            httponly=True,
+        )
     async with AsyncSessionLocal() as db:
         yield db
+
+
+# Dependency to provide async session, for requests that only read
+async def get_read_db(request: Request):
+    try:
+        pinned = float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        pinned = False
+
+    async with AsyncSessionLocal() if pinned else read_session() as db:
+        yield db
+
+
+# Plain asyncpg connection outside the pools, a LISTEN holds its connection
+# for as long as it lives
+async def connect_listener() -> asyncpg.Connection:
+    return await asyncpg.connect(
+        user=username,
+        password=password or None,
+        host=host,
+        port=port,
+        database=database,
+        server_settings={"application_name": f"{APPLICATION_NAME}-listener"},
+    )
+
+
+async def dispose_engines():
+    await engine.dispose()
+    for read_engine in read_engines:
+        if read_engine is not engine:
+            await read_engine.dispose()
@@ -0,0 +1,119 @@
+import os
+import time
+from typing import Any, Dict, Optional, Union
+from dotenv import load_dotenv
+from redis.asyncio import BlockingConnectionPool, Redis, RedisCluster
+
+load_dotenv()
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD") or None
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_PROTOCOL = int(os.getenv("REDIS_PROTOCOL", "3"))  # RESP3, 2 for older servers
+
+# Cluster mode, REDIS_URL then names any node of the cluster
+REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "").lower() in ("1", "true", "yes")
+# Hotels are spread over this many hash tagged buckets, see functions/keys.py.
+# Changing it moves every key, so it is only read at startup.
+REDIS_BUCKETS = int(os.getenv("REDIS_BUCKETS", "16" if REDIS_CLUSTER else "1"))
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """
+    Blocking pool that records how long callers wait for a connection
+
+    A BlockingConnectionPool makes callers queue for up to REDIS_POOL_TIMEOUT
+    once every connection is checked out, instead of opening more and more of
+    them under load.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        waited = time.perf_counter() - start
+
+        self.checkouts += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return connection
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "idle": len(self._available_connections),
+            "checkouts": self.checkouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
+
+def create_pool(**overrides) -> InstrumentedConnectionPool:
+    options = dict(
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        password=REDIS_PASSWORD,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        retry_on_timeout=True,
+        protocol=REDIS_PROTOCOL,
+    )
+    options.update(overrides)
+    return InstrumentedConnectionPool.from_url(REDIS_URL, **options)
+
+
+def create_cluster() -> RedisCluster:
+    # The cluster client keeps one pool per node, each capped at max_connections
+    return RedisCluster.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        password=REDIS_PASSWORD,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        protocol=REDIS_PROTOCOL,
+    )
+
+
+# One pool per process, shared by every request and background task, which
+# import this client directly. Clients built on it never close the pool
+# themselves, only close_redis does.
+pool: Optional[InstrumentedConnectionPool] = None
+redis: Union[Redis, RedisCluster]
+if REDIS_CLUSTER:
+    redis = create_cluster()
+else:
+    pool = create_pool()
+    redis = Redis(connection_pool=pool)
+
+
+# <---------Functions to open and close the pool from the lifespan----------------->
+async def open_redis():
+    # Fail at startup rather than on the first request
+    await redis.ping()
+
+
+async def close_redis():
+    await redis.aclose()
+    if pool is not None:
+        await pool.disconnect()
+
+
+def pool_stats() -> Dict[str, Any]:
+    if pool is not None:
+        return pool.stats()
+    return {"cluster_nodes": len(redis.get_nodes())}
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ids of the changed rows by table, each with the locations (country, state,
+# city and area ids) the row was in before the changes, when it left them
+Changes = Dict[str, Dict[int, Set[Tuple[int, ...]]]]
+Connect = Callable[[], Awaitable[Any]]
+Handle = Callable[[Changes], Awaitable[Any]]
+
+
+class ChangeFeed:
+    """
+    Background task applying the NOTIFY events of the change feed triggers
+
+    Events are collected for max_delay seconds and coalesced per table, so a
+    burst of writes to the same rows is applied once. Ids are kept in a dict
+    rather than a queue, memory is bounded by the number of distinct rows
+    changed within one batch. Every location a row left within the batch is
+    kept, the row has to leave the index sets of all of them.
+
+    Every worker listens, but only the one holding the leader lock (a session
+    advisory lock on its listener connection) runs handle, the changes to the
+    shared database and Redis. The others run handle_local, the changes to
+    their in-process state. Followers try to take the lock before every batch,
+    so one of them takes over when the leader goes away.
+
+    Notifications sent while the leader is disconnected are lost, those
+    changes are only corrected by the Redis TTL.
+    """
+
+    def __init__(
+        self,
+        connect: Connect,
+        handle: Handle,
+        channel: str,
+        handle_local: Optional[Handle] = None,
+        max_delay: float = 0.1,
+        keepalive: float = 30.0,
+        retry_delay: float = 1.0,
+    ):
+        self._connect = connect
+        self._handle = handle
+        self._handle_local = handle_local
+        self.channel = channel
+        self.max_delay = max_delay
+        self.keepalive = keepalive
+        self.retry_delay = retry_delay
+        self._pending: Changes = defaultdict(dict)
+        self._ready = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.connected = False
+        self.leader = False
+        self.received = 0
+        self.batches = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "connected": self.connected,
+            "leader": self.leader,
+            "pending": sum(len(ids) for ids in self._pending.values()),
+            "received": self.received,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    # <---------------Functions to start and stop the listener---------------->
+    def start(self):
+        if not self.running:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+            rows = self._pending[event["table"]]
+            for id in event["ids"]:
+                rows.setdefault(id, set())
+            for id, *location in event.get("old", ()):
+                rows.setdefault(id, set()).add(tuple(location))
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed change notification %r", payload)
+            return
+        self.received += 1
+        self._ready.set()
+
+    # <---------------Listener loop, reconnecting after any error---------------->
+    async def _run(self):
+        while True:
+            connection = None
+            try:
+                connection = await self._connect()
+                await connection.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                await self._drain(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                logger.exception("Change feed listener failed, reconnecting")
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                self.connected = False
+                self.leader = False  # released with the connection
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+
+    async def _drain(self, connection):
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.keepalive)
+            except asyncio.TimeoutError:
+                # Idle, make sure the connection is still there to listen on
+                await connection.execute("SELECT 1")
+                continue
+
+            # Let the rest of a burst arrive before applying it
+            await asyncio.sleep(self.max_delay)
+            self._ready.clear()
+            changes, self._pending = self._pending, defaultdict(dict)
+
+            if not self.leader:
+                self.leader = await connection.fetchval(
+                    "SELECT pg_try_advisory_lock(hashtext($1))",
+                    f"{self.channel}:leader",
+                )
+            handle = self._handle if self.leader else self._handle_local
+            if handle is None:
+                continue
+            try:
+                await handle(dict(changes))
+                self.batches += 1
+            except Exception:
+                self.errors += 1
+                logger.exception(
+                    "Failed to apply changes to %s",
+                    {table: len(ids) for table, ids in changes.items()},
+                )
@@ -0,0 +1,93 @@
+import msgpack
+from models.hotel import Country, State, City, Area
+from queries.location_cache import location_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Hotels are cached as one msgpack array per hotel, without field names and
+# with location ids instead of names:
+#   [id, name, description, streetaddress, latitude, longitude,
+#    country_id, state_id, city_id, area_id]
+HOTEL_FIELDS = ("id", "name", "description", "streetaddress", "latitude", "longitude")
+# Value of a hotel key for a while after the hotel was deleted, see keys.py
+TOMBSTONE = b""
+LOCATION_MODELS = (
+    ("country", Country),
+    ("state", State),
+    ("city", City),
+    ("area", Area),
+)
+
+
+def location_ids(hotel: Dict[str, Any]) -> Optional[Tuple[int, ...]]:
+    """
+    Map a hotel's location names to ids through the location cache
+
+    Returns:
+        The (country, state, city, area) ids, or None if a name is not cached
+    """
+    ids = tuple(
+        location_cache.id_of(model, hotel[field]) for field, model in LOCATION_MODELS
+    )
+    return None if None in ids else ids
+
+
+def encode_hotel(hotel: Dict[str, Any], ids: Tuple[int, ...]) -> bytes:
+    return pack_hotel([hotel[field] for field in HOTEL_FIELDS] + list(ids))
+
+
+def pack_hotel(values: List[Any]) -> bytes:
+    return msgpack.packb(values)
+
+
+def unpack_hotel(blob: bytes) -> List[Any]:
+    return msgpack.unpackb(blob)
+
+
+def packed_location_ids(values: List[Any]) -> Tuple[int, ...]:
+    return tuple(values[len(HOTEL_FIELDS) :])
+
+
+def decode_hotel(values: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Rebuild the hotel dictionary from its packed values
+
+    Returns:
+        The hotel, or None if one of its location ids is not cached yet
+    """
+    hotel = dict(zip(HOTEL_FIELDS, values))
+    for (field, model), id in zip(LOCATION_MODELS, packed_location_ids(values)):
+        name = location_cache.name_of(model, id)
+        if name is None:
+            return None
+        hotel[field] = name
+    return hotel
+
+
+# Autocomplete entries are members of lexicographic sorted sets (all scored 0):
+#   normalized name \0 kind \0 id \0 display name
+# so a BYLEX range on the normalized prefix finds them, ordered by name.
+SUGGEST_SEPARATOR = "\x00"
+# Prefix of the "loading" and "complete" flag members of these sets. No UTF-8
+# encoded name starts with 0xff, so the flags sort after every prefix range.
+SUGGEST_FLAG = b"\xff"
+
+
+def normalize_name(name: str) -> str:
+    """Case fold and collapse whitespace, the form prefixes are matched on"""
+    return " ".join(name.casefold().split())
+
+
+def suggest_member(kind: str, id: int, name: str) -> bytes:
+    return SUGGEST_SEPARATOR.join((normalize_name(name), kind, str(id), name)).encode()
+
+
+def suggest_range(prefix: str) -> Tuple[bytes, bytes]:
+    """Inclusive BYLEX bounds of every member starting with the prefix"""
+    prefix = normalize_name(prefix).encode()
+    # No UTF-8 encoded name contains the byte 0xff, so it sorts after them all
+    return b"[" + prefix, b"[" + prefix + b"\xff"
+
+
+def decode_suggestion(member: bytes) -> Dict[str, Any]:
+    _, kind, id, name = member.decode().split(SUGGEST_SEPARATOR, 3)
+    return {"type": kind, "id": int(id), "name": name}
@@ -1,35 +1,213 @@
+import asyncio
+import contextvars
+import heapq
+import logging
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from functools import partial
+import orjson
 from redis.asyncio import Redis
-from queries.query import insert_hotel, get_hotel, update_hotels, delete_hotel
-from interfaces.pydantic import Hotel
-from typing import Dict, Any, Optional, List
+from configs.connect import AsyncSessionLocal, connect_listener, read_session
+from configs.redis_pool import create_pool, redis
+from queries.query import (
+    insert_hotel,
+    bulk_insert_hotels,
+    get_hotel,
+    get_nearby_hotel,
+    get_hotel_locations,
+    stream_hotel,
+    stream_hotel_ids,
+    stream_hotel_coordinates,
+    stream_names,
+    suggest_names,
+    update_hotels,
+    delete_hotel,
+    get_hotels_by_ids,
+)
+from models.hotel import Hotel, Country, State, City, Area
+from queries.change_feed import CHANGE_CHANNEL
+from queries.location_cache import LOCATION_MODELS, location_cache
+from functions import codec, keys, l1, responses, scripts
+from functions.change_feed import ChangeFeed, Changes
+from functions.writer import CacheWriter
+from utils import metrics
+from utils.metrics import execute_pipeline
+from utils.singleflight import SingleFlight
+from utils.stream import abatched
+from utils.timing import span
+from typing import (
+    AsyncIterator,
+    Dict,
+    Any,
+    Mapping,
+    Optional,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+)
 
+logger = logging.getLogger(__name__)
+
+# Writes made outside the API reach Redis through the change feed, so the TTL
+# only bounds how long a missed notification can leave a hotel stale
+REDIS_TTL = int(os.getenv("REDIS_TTL", str(60 * 60 * 24)))
+REDIS_TTL_JITTER = (
+    REDIS_TTL // 10
+)  # spread expiries so keys written together do not expire together
+REDIS_PIPELINE_CHUNK = 1000  # hotels queued per pipeline round trip
+BULK_BATCH_SIZE = 5000  # hotels inserted per multi-row INSERT transaction
+STREAM_BATCH_SIZE = 1000  # hotels per Redis page or server side cursor batch
+FILL_LOCK_MS = 5000  # how long one worker may hold the right to fill a key
+FILL_POLL_INTERVAL = 0.05  # seconds between checks while another worker fills
+FILL_RESULT_MS = 1000  # how long the workers waiting on a fill can pick up its result
+CACHE_WRITE_DELAY = 0.05  # seconds a queued cache write may wait for its batch to fill
+CACHE_WRITE_QUEUE = 100_000  # queued cache writes before writers are slowed down
+CHANGE_FEED_DELAY = (
+    0.1  # seconds change notifications are collected before applying them
+)
+INDEX_LOAD_SECONDS = 60  # how long loading an index set may take, and tombstones last
+INDEX_LOAD_CHUNK = 1000  # ids added to an index set per round trip
+
+# Cache misses for the same query in this worker share one fill
+fills_in_flight = SingleFlight()
+location_refreshes = SingleFlight()
+index_loads = SingleFlight()
+suggest_loads = SingleFlight()
+# Loads outlive the request that started them, referenced here until done
+background_tasks: Set[asyncio.Task] = set()
+
+# Redis is populated in the background, responses go out as soon as Postgres answers
+cache_writer = CacheWriter(
+    lambda hotels: store_location_data(hotels),
+    max_batch=REDIS_PIPELINE_CHUNK,
+    max_delay=CACHE_WRITE_DELAY,
+    maxsize=CACHE_WRITE_QUEUE,
+)
 
+# Applies the NOTIFY events of writes made outside the API, to Redis in one
+# worker and to the in-process caches in every other
+change_feed = ChangeFeed(
+    connect_listener,
+    lambda changes: apply_database_changes(changes),
+    channel=CHANGE_CHANNEL,
+    handle_local=lambda changes: apply_local_changes(changes),
+    max_delay=CHANGE_FEED_DELAY,
+)
 
-REDIS_HOST = "localhost"
-REDIS_PORT = 6379
-REDIS_DB = 0
-REDIS_PASSWORD = None
-REDIS_TTL = 60 * 60 * 24
 
-redis = Redis.from_url(
-    f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}",
-    password=REDIS_PASSWORD,
-    decode_responses=True,
-)
+# <---------Background task keeping the L1 cache coherent across workers----------------->
+async def run_invalidation_listener():
+    # Own pool, a subscription holds its connection for as long as it lives
+    # and waits for messages without a read timeout
+    subscriber_pool = create_pool(
+        max_connections=2, socket_timeout=None, decode_responses=True
+    )
+    subscriber = Redis(connection_pool=subscriber_pool)
+    try:
+        await l1.listen_for_invalidations(subscriber)
+    finally:
+        await subscriber.aclose()
+        await subscriber_pool.disconnect()
+
+
+# <---------Function to load the Lua scripts once at startup----------------->
+async def load_redis_scripts():
+    await scripts.load_scripts(redis)
+
+
+# <---------Function to evict cached listings after a write----------------->
+async def invalidate(hotels: List[Mapping[str, Any]]):
+    # Runs once Redis holds the write, so a listing rebuilt after it includes it.
+    # Versions first, a response cached in L1 after the eviction is then current
+    await responses.bump_versions(redis, hotels)  # outdate serialized responses
+    await l1.publish_invalidation(redis, hotels)  # evict cached listings on all workers
 
 
 # <---------Function to insert in DB----------------->
 async def add_hotel(hotel, db):
     data = await insert_hotel(db, hotel)  # insert query function call
-    await store_location_data(data)  # function call for redis storage
+    # Stored and outdating the cached listings before the response, so the
+    # client finds its hotel in the next listing it reads. Fills and bulk
+    # loads go through the write-behind queue instead. The hotel is committed
+    # by now, a Redis error is logged rather than failing the request.
+    try:
+        await store_location_data([data])
+        await invalidate([data])
+    except Exception:
+        logger.exception("Failed to cache new hotel %s", data["id"])
     return data
 
 
+# <---------Function to bulk insert in DB----------------->
+async def add_hotels_bulk(hotels, db):
+    """
+    Insert every hotel of a request in one transaction
+
+    A line failing validation halfway through an NDJSON stream rolls back the
+    batches before it too, so a request is either inserted whole or not at all.
+
+    Args:
+        hotels: A list or an async NDJSON stream, only one batch is held at a time
+        db: Database session, committed once every batch is in
+    """
+    inserted, first_id, last_id = 0, None, None
+    locations = set()
+    async for batch in abatched(hotels, BULK_BATCH_SIZE):
+        data = await bulk_insert_hotels(db, batch)  # bulk insert query function call
+        inserted += len(data)
+        if data:
+            first_id = data[0]["id"] if first_id is None else first_id
+            last_id = data[-1]["id"]
+        locations.update(l1.location_of(hotel) for hotel in data)
+    await db.commit()
+
+    if inserted:
+        await cache_inserted_hotels(first_id, last_id, locations)
+    return {"status": "success", "inserted": inserted}
+
+
+async def cache_inserted_hotels(first_id: int, last_id: int, locations: set):
+    """
+    Queue the hotels of a committed bulk insert for Redis, read back by id range
+
+    Only the ids are kept while inserting, so a large load never holds all its
+    rows. Hotels inserted concurrently by others fall in the range as well,
+    caching them too is harmless.
+    """
+    # Read from the primary, a replica may not have the commit yet
+    async with AsyncSessionLocal() as db:
+        rows = stream_hotel(
+            db, cursor=first_id - 1, until=last_id, batch_size=STREAM_BATCH_SIZE
+        )
+        async for batch in abatched(rows, STREAM_BATCH_SIZE):
+            await cache_writer.enqueue(batch)
+
+    # Listings are evicted once the writer stored every hotel queued above
+    written = [dict(zip(keys.LOCATION_FIELDS, location)) for location in locations]
+    await cache_writer.enqueue([], callback=partial(invalidate, written))
+
+
 # <---------Function to update data in DB----------------->
 async def update_hotel(hotel, db):
-    id, data = await update_hotels(db, hotel)  # update query Function call
+    data = await update_hotels(db, hotel)  # update query Function call
+    if data is None:
+        raise LookupError(f"Hotel with ID {hotel.id} does not exist")
 
-    return await update_simple_fields(id, data)  # function call to update data in redis
+    # Committed, a Redis error is logged rather than failing the request
+    try:
+        await cache_writer.flush_hotel(
+            hotel.id
+        )  # a queued copy has to reach redis first
+
+        await update_cached_hotel(data)  # the updated row replaces the cached copy
+        await invalidate([data])
+    except Exception:
+        logger.exception("Failed to update cached hotel %s", hotel.id)
+    return data
 
 
 # <---------Function to get data from DB----------------->
@@ -39,443 +217,1144 @@ async def get_hotels(
     state: Optional[str] = None,
     city: Optional[str] = None,
     area: Optional[str] = None,
-    hotel_id: Optional[str] = None,
+    hotel_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
 ):
-    redis_key = ""
-    if country:
-        redis_key = country
-        data = await retrieve_location_data(
-            redis_key
-        )  # function to get data from redis for particular country
-        if not data:  # if not present in redis
-            data = await get_hotel(
-                db=db, country=country
-            )  # get query function call for particular country
-            await store_location_data(data)  # function call to store in redis
-
-    elif state:
-        data = await retrieve_with_state(
-            state
-        )  # function to get data using reverse indexing for state
-
-        if not data:  # if not present in redis
-            data = await get_hotel(db=db, state=state)  # get query for particular state
-            await store_location_data(data)  # function call to store in redis
-
-    elif city:
-        data = await retrieve_with_city(
-            city
-        )  # function to get data using reverse indexing for city
-
-        if not data:  # if not present in redis
-            data = await get_hotel(db=db, city=city)  # get query for particular city
-            await store_location_data(data)  # function call to store in redis
-
-    elif area:
-        data = await retrieve_with_area(
-            area
-        )  # function to get data using reverse indexing for city
-
-        if not data:  # if not present in redis
-            data = await get_hotel(db=db, area=area)  # get query for particular area
-            await store_location_data(data)  # function call to store in redis
+    # Hot queries are answered from the in-process cache without a Redis hop
+    key = l1.cache_key(country, state, city, area, hotel_id, cursor, limit)
+    filter_type = metrics.filter_type(country, state, city, area, hotel_id)
+    data = l1.lookup(key)
+    if data is not None:
+        metrics.cache_lookup(filter_type, "l1", len(data))
+        return data
+    read_generation = l1.generation
+
+    # Every given filter must match, hotel_id included
+    filters = {
+        field: value
+        for field, value in (
+            ("country", country),
+            ("state", state),
+            ("city", city),
+            ("area", area),
+            ("hotel_id", hotel_id),
+        )
+        if value
+    }
+
+    # Ids the index sets hold without a cached hotel, checked after a fill
+    uncached = set()
+    with span("cache.read"):
+        data = await retrieve_with_filters(
+            cursor=cursor, limit=limit, uncached=uncached, **filters
+        )
+    if data is None:  # not in redis, or only partly
+        with span("cache.fill"):
+            data = await fills_in_flight.do(
+                key, partial(fill_on_miss, db.bind, key, filters, cursor, limit)
+            )
+        metrics.cache_lookup(filter_type, "db", len(data))
+        if not hotel_id:
+            schedule_index_loads(location_indexes(country, state, city, area))
+            check_stray_members(
+                location_indexes(country, state, city, area), uncached, data, limit
+            )
     else:
-        # if no filter is provided get all data
-        data = (
-            await retrieve_location_data()
-        )  # function call to get all data from redis
-
-        if not data:  # if not present in redis
-            data = await get_hotel(db=db)  # get query for all hotels
-
-            await store_location_data(data)  # function call to store in redis
+        metrics.cache_lookup(filter_type, "redis", len(data))
 
+    if location_indexes(country, state, city, area) is not None:
+        l1.store(key, data, read_generation)  # not for names of no location
     return data
 
 
-# <---------Function to Delete data from DB----------------->
-async def delete(id, db):
-    await delete_hotel(db, id)  # delete query function call
-    data = await delete_location_data(id)  # function call to delete data from redis
-    return data
-
+# <---------Function to get the ETag of a listing without reading it----------------->
+async def get_hotels_etag(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+) -> str:
+    # Only the version counters are read, never the index sets or Postgres
+    fields = responses.version_fields(country, state, city, area)
+    return responses.etag(await responses.current_version(redis, fields))
 
-# <----------Function to create sets and store hashkeys in sets--------------------->
-async def add_to_hierarchical_sets(pipe, hash_key: str, data: Hotel):
-    """Add the hash key to hierarchical sets"""
-    # Country set
-    country_set = data.country
-    await pipe.sadd(country_set, hash_key)
-    await pipe.expire(country_set, REDIS_TTL)
 
-    # Country:State set
-    state_set = f"{data.country}:{data.state}"
-    await pipe.sadd(state_set, hash_key)
-    await pipe.expire(state_set, REDIS_TTL)
+# <---------Function to get a serialized listing from the response cache or DB----------------->
+async def get_hotels_json(
+    db,
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    hotel_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Tuple[bytes, Optional[int], str]:
+    """
+    The JSON body of a /hotels listing, as cached in Redis when possible
 
-    # Country:State:City set
-    city_set = f"{data.country}:{data.state}:{data.city}"
-    await pipe.sadd(city_set, hash_key)
-    await pipe.expire(city_set, REDIS_TTL)
+    A hit costs one round trip and no decoding. On a miss the listing is
+    built by get_hotels and cached under the versions read before it.
 
-    # Country:State:City:Area set
-    area_set = f"{data.country}:{data.state}:{data.city}:{data.area}"
-    await pipe.sadd(area_set, hash_key)
-    await pipe.expire(area_set, REDIS_TTL)
+    Args:
+        Same as get_hotels
 
+    Returns:
+        The JSON encoded hotels, the cursor of the next page (None when this
+        is the last one) and the ETag of the versions it was built from
+    """
+    filters = l1.cache_key(country, state, city, area, hotel_id, cursor, limit)
+    filter_type = metrics.filter_type(country, state, city, area, hotel_id)
+
+    # Hot listings are answered from the in-process cache without a Redis hop,
+    # evicted with the listings of get_hotels on every write
+    l1_key = (*filters, "json")
+    response = l1.lookup(l1_key)
+    if response is not None:
+        metrics.CACHE_LOOKUPS.labels(filter_type, "response_l1").inc()
+        return response
+    read_generation = l1.generation
+
+    fields = responses.version_fields(country, state, city, area)
+    cached, version = await responses.lookup(redis, filters, fields)
+    if cached is not None:
+        metrics.CACHE_LOOKUPS.labels(filter_type, "response").inc()
+        response = (*cached, responses.etag(version))
+        l1.store(l1_key, response, read_generation)
+        return response
+
+    data = await get_hotels(
+        db,
+        country=country,
+        state=state,
+        city=city,
+        area=area,
+        hotel_id=hotel_id,
+        cursor=cursor,
+        limit=limit,
+    )
+
+    # A full page means there may be more, the last id is the next cursor
+    next_cursor = data[-1]["id"] if limit is not None and len(data) == limit else None
+    with span("encode"):
+        body = responses.encode(data)
+    response = (body, next_cursor, responses.etag(version))
+
+    # Names of no location (typos, probes) are not cached, every one of them
+    # would take a key. get_hotels resolved the names that exist.
+    if (
+        responses.cacheable(body)
+        and location_indexes(country, state, city, area) is not None
+    ):
+        await responses.store(redis, filters, version, body, next_cursor)
+        l1.store(l1_key, response, read_generation)
+    return response
+
+
+# <---------Function to stream data from redis or DB----------------->
+async def stream_hotels(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    hotel_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    bind=None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield every matching hotel while holding at most one batch in memory
 
-# <------------ Function to create reverse index for each filter attribute --------------->
-async def create_reverse_indices(pipe, data: Hotel):
-    """Create reverse indices for area, city, and state"""
-    # Area -> Country:State:City
-    area_reverse_key = f"reverse:area:{data.area}"
-    await pipe.set(area_reverse_key, f"{data.country}:{data.state}:{data.city}")
-    await pipe.expire(area_reverse_key, REDIS_TTL)
+    Pages are read from Redis while they are cached, the rest of the stream
+    comes from Postgres.
 
-    # City -> Country:State
-    city_reverse_key = f"reverse:city:{data.city}"
-    await pipe.set(city_reverse_key, f"{data.country}:{data.state}")
-    await pipe.expire(city_reverse_key, REDIS_TTL)
+    Args:
+        country, state, city, area: Location filters, same as get_hotels
+        hotel_id: Restrict the stream to this hotel
+        cursor: Only return hotels with an id greater than this one
+        limit: Maximum number of hotels to yield, None for all of them
+        bind: Engine of the request's session, the primary for pinned clients
+
+    Yields:
+        Hotel dictionaries ordered by id
+    """
+    location = {"country": country, "state": state, "city": city, "area": area}
+    if hotel_id:
+        # At most one hotel, read like a page of get_hotels
+        hotels = await retrieve_with_filters(
+            **location, hotel_id=hotel_id, cursor=cursor
+        )
+        if hotels is not None:
+            for hotel in hotels:
+                yield hotel
+            return
+    else:
+        indexes = location_indexes(**location)
+        if indexes is not None:
+            # Walk the sorted sets one bounded page at a time, until a page is
+            # missing from Redis or the limit is reached
+            while True:
+                size = min(limit, STREAM_BATCH_SIZE) if limit else STREAM_BATCH_SIZE
+                page = await retrieve_location_data(indexes, cursor=cursor, limit=size)
+                if page is None:
+                    break
+                for hotel in page:
+                    yield hotel
+                if limit:
+                    limit -= len(page)
+                    if not limit:
+                        return
+                if len(page) < size:
+                    return
+                cursor = page[-1]["id"]
+            schedule_index_loads(indexes)
+
+    # Postgres carries on after the last hotel yielded from Redis, if any.
+    # The response body outlives the request dependencies, so the stream owns
+    # its session, on the engine the request was routed to
+    async with read_session(bind) as db:
+        batch = []
+        async for hotel in stream_hotel(
+            db,
+            **location,
+            hotel_id=hotel_id,
+            cursor=cursor,
+            limit=limit,
+            batch_size=STREAM_BATCH_SIZE,
+        ):
+            yield hotel
+            batch.append(hotel)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                await cache_writer.enqueue(batch)  # fill redis as the rows go by
+                batch = []
+
+        if batch:
+            await cache_writer.enqueue(batch)
+
+
+def location_indexes(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+) -> Optional[List[str]]:
+    """
+    Resolve the filters to the Redis indexes whose intersection holds the
+    matching hotels
 
-    # State -> Country
-    state_reverse_key = f"reverse:state:{data.state}"
-    await pipe.set(state_reverse_key, data.country)
-    await pipe.expire(state_reverse_key, REDIS_TTL)
+    Returns:
+        The index names, or None when a location name is not known to this worker
+    """
+    indexes = []
+    for field, model, value in (
+        ("country", Country, country),
+        ("state", State, state),
+        ("city", City, city),
+        ("area", Area, area),
+    ):
+        if value:
+            location_id = location_cache.id_of(model, value)
+            if location_id is None:
+                return None
+            indexes.append(keys.index_name(field, location_id))
+    return indexes or [keys.ALL_INDEX]
+
+
+async def fill_on_miss(
+    bind,
+    key: tuple,
+    filters: Dict[str, Any],
+    cursor: Optional[int],
+    limit: Optional[int],
+) -> List[Dict[str, Any]]:
+    """
+    Load a missed query from Postgres and store it in Redis, once across workers
 
+    The worker that wins a short lived SET NX PX lock runs the query and
+    publishes its result under a key of its own for FILL_RESULT_MS, with the
+    versions it was read at; the others poll that key instead of running the
+    same query. The index sets can not answer them, they are only loaded in
+    the background.
 
-# <------------------Function to store data in redis----------------->
-async def store_location_data(data_list: List[Hotel]):
-    """
-    Store location data in Redis with appropriate indexing
+    Shared by every caller that missed the same query, so it reads through a
+    session of its own rather than the first caller's, which is closed when
+    that request ends.
 
     Args:
-        data_list: List of Hotel objects to store
+        bind: Engine of the caller's session, the primary for pinned clients
+        key: Normalized filter key of the query
+        filters: Filters passed to get_hotel, combined with AND
+        cursor: Only return hotels with an id greater than this one
+        limit: Maximum number of hotels to return, None for all of them
+
+    Returns:
+        A list of location data dictionaries
     """
+    lock_key = keys.fill_lock_key(key)
+    result_key = keys.fill_result_key(key)
+    token = uuid.uuid4().hex
+    fields = responses.version_fields(
+        *(filters.get(field) for field in keys.LOCATION_FIELDS)
+    )
+
+    # The versions are read before the query, a waiter only takes a result no
+    # write has outdated since
+    with span("redis.fill_lock"):
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.set(lock_key, token, nx=True, px=FILL_LOCK_MS)
+            pipe.hmget(keys.VERSIONS_KEY, fields)
+            locked, counters = await execute_pipeline(pipe, "fill_lock")
+    if not locked:
+        # Another worker is filling, wait for the result it publishes
+        with span("fill.wait"):
+            deadline = time.monotonic() + FILL_LOCK_MS / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(FILL_POLL_INTERVAL)
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.hmget(result_key, "version", "body")
+                    pipe.hmget(keys.VERSIONS_KEY, fields)
+                    pipe.exists(lock_key)
+                    (version, body), counters, held = await execute_pipeline(
+                        pipe, "fill_wait"
+                    )
+                if body is not None and version == responses.version_token(counters):
+                    return orjson.loads(body)
+                if not held:
+                    break  # released without a current result, query it here
+
+    async def release():
+        await scripts.RELEASE_LOCK(redis, [lock_key], [token])
 
-    all_keys_set = "ALL"
+    try:
+        async with read_session(bind) as db:
+            data = await get_hotel(db=db, **filters, cursor=cursor, limit=limit)
+        with span("redis.fill_result"):
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(
+                    result_key,
+                    mapping={
+                        "version": responses.version_token(counters),
+                        "body": responses.encode(data),
+                    },
+                )
+                pipe.pexpire(result_key, FILL_RESULT_MS)
+                await execute_pipeline(pipe, "fill_result")
+    except BaseException:
+        await release()
+        raise
+
+    # Released once the writer has stored the hotels, a miss after that finds
+    # them in Redis as soon as the index sets are loaded
+    with span("cache.enqueue"):
+        await cache_writer.enqueue(data, callback=release)
+    return data
 
-    # Use Redis pipeline for batched operations
-    async with redis.pipeline(transaction=False) as pipe:
-        for d in data_list:
-            # Use the ID from the data as the hash key identifier
-            data = Hotel(**d)
-            hash_key = f"loc:{data.id}"
 
-            # Store the location data as a hash
-            await pipe.hset(hash_key, mapping=data.dict())
-            await pipe.expire(hash_key, REDIS_TTL)
+# <---------Functions loading whole index sets in the background, see keys.py----------------->
+def schedule_index_loads(indexes: Optional[List[str]]):
+    """Start loading the index sets of a missed query, once per set in this worker"""
+    for index in indexes or ():
+        run_in_background(index_loads.do(index, partial(load_index, index)))
 
-            # Add to the ALL set
-            await pipe.sadd(all_keys_set, hash_key)
-            await pipe.expire(all_keys_set, REDIS_TTL)
 
-            # Add to country set
-            country_set = data.country
-            await pipe.sadd(country_set, hash_key)
-            await pipe.expire(country_set, REDIS_TTL)
+def run_in_background(coroutine):
+    # A fresh context, so the spans of the task are not part of the request
+    task = asyncio.create_task(coroutine, context=contextvars.Context())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
-            # Add to country:state set
-            state_set = f"{data.country}:{data.state}"
-            await pipe.sadd(state_set, hash_key)
-            await pipe.expire(state_set, REDIS_TTL)
 
-            # Add to country:state:city set
-            city_set = f"{data.country}:{data.state}:{data.city}"
-            await pipe.sadd(city_set, hash_key)
-            await pipe.expire(city_set, REDIS_TTL)
+async def load_index(index: str):
+    """
+    Fill the index set of every bucket with all the hotel ids of its location
 
-            # Add to country:state:city:area set
-            area_set = f"{data.country}:{data.state}:{data.city}:{data.area}"
-            await pipe.sadd(area_set, hash_key)
-            await pipe.expire(area_set, REDIS_TTL)
+    The set of all hotels comes with the GEO set of the bucket. A bucket whose
+    set exists is left to whoever created it. Errors are logged, a set left
+    loading expires and is loaded again by a later miss.
+    """
+    location = keys.index_location(index)
+    location_ids = {f"{location[0]}_id": location[1]} if location else {}
+
+    async def members(db):
+        if index == keys.ALL_INDEX:
+            async for row in stream_hotel_coordinates(db, INDEX_LOAD_CHUNK):
+                located = row["latitude"] is not None and row["longitude"] is not None
+                yield (
+                    row["id"],
+                    [
+                        row["id"],
+                        row["longitude"] if located else "",
+                        row["latitude"] if located else "",
+                    ],
+                )
+        else:
+            async for id in stream_hotel_ids(db, location_ids, INDEX_LOAD_CHUNK):
+                yield id, [id]
+
+    def set_keys(bucket: int) -> List[str]:
+        key = keys.index_key(index, bucket)
+        return [key, keys.geo_key(bucket)] if index == keys.ALL_INDEX else [key]
+
+    add = scripts.ALL_ADD if index == keys.ALL_INDEX else scripts.INDEX_ADD
+    try:
+        started = await asyncio.gather(
+            *(
+                scripts.INDEX_BEGIN(
+                    redis, set_keys(bucket), [INDEX_LOAD_SECONDS * 1000]
+                )
+                for bucket in keys.BUCKETS
+            )
+        )
+        loading = [bucket for bucket, begun in zip(keys.BUCKETS, started) if begun]
+        if not loading:
+            return
+
+        # From the primary, a lagging replica would miss recent hotels for a day
+        async with AsyncSessionLocal() as db:
+            async for batch in abatched(members(db), INDEX_LOAD_CHUNK):
+                by_bucket = defaultdict(list)
+                for id, args in batch:
+                    by_bucket[keys.bucket_of(id)].extend(args)
+                for bucket in loading:
+                    if not by_bucket[bucket]:
+                        continue
+                    added = await add(
+                        redis,
+                        set_keys(bucket),
+                        [keys.hotel_prefix(bucket), *by_bucket[bucket]],
+                    )
+                    if not added:
+                        logger.warning("Loading index set %s expired", index)
+                        return
+
+        for bucket in loading:
+            await scripts.INDEX_COMPLETE(redis, set_keys(bucket), [REDIS_TTL])
+    except Exception:
+        logger.exception("Failed to load index set %s", index)
+
+
+def check_stray_members(
+    indexes: Optional[List[str]],
+    uncached: Set[int],
+    data: Sequence[Mapping[str, Any]],
+    limit: Optional[int],
+):
+    """
+    Look into the ids an index set holds that Postgres did not return
+
+    They are in the range of the page but not in it, so they were deleted or
+    moved by a write Redis did not see; they would keep the page a miss.
+    """
+    found = {hotel["id"] for hotel in data}
+    last_id = data[-1]["id"] if limit is not None and len(data) == limit else None
+    strays = [
+        id for id in uncached if id not in found and (last_id is None or id < last_id)
+    ]
+    if indexes and strays:
+        run_in_background(remove_stray_members(indexes, strays))
 
-            # Create reverse indices
-            # Area -> Country:State:City
-            area_reverse_key = f"reverse:area:{data.area}"
-            await pipe.set(area_reverse_key, f"{data.country}:{data.state}:{data.city}")
-            await pipe.expire(area_reverse_key, REDIS_TTL)
 
-            # City -> Country:State
-            city_reverse_key = f"reverse:city:{data.city}"
-            await pipe.set(city_reverse_key, f"{data.country}:{data.state}")
-            await pipe.expire(city_reverse_key, REDIS_TTL)
+async def remove_stray_members(indexes: List[str], hotel_ids: List[int]):
+    """Remove hotels from the given index sets they no longer belong to"""
+    try:
+        # From the primary, a lagging replica may not have the hotel yet
+        async with AsyncSessionLocal() as db:
+            current = await get_hotel_locations(db, hotel_ids)
 
-            # State -> Country
-            state_reverse_key = f"reverse:state:{data.state}"
-            await pipe.set(state_reverse_key, data.country)
-            await pipe.expire(state_reverse_key, REDIS_TTL)
+        async with redis.pipeline(transaction=False) as pipe:
+            for id in hotel_ids:
+                if id not in current:
+                    pipe.zrem(keys.geo_key(keys.bucket_of(id)), id)
+                for index in indexes:
+                    location = keys.index_location(index)
+                    if id not in current or (
+                        location is not None
+                        and current[id][f"{location[0]}_id"] != location[1]
+                    ):
+                        pipe.zrem(keys.index_key(index, keys.bucket_of(id)), id)
+            await execute_pipeline(pipe, "remove_strays")
+    except Exception:
+        logger.exception("Failed to check index sets %s", indexes)
 
-        # Execute all Redis commands in the pipeline
-        await pipe.execute()
 
-    await redis.close()
+# <---------Function to Delete data from DB----------------->
+async def delete(id, db):
+    row = await delete_hotel(db, id)  # delete query function call
+    if row is None:
+        raise LookupError(f"Hotel with ID {id} does not exist")
 
+    deleted = {field: row[field] for field in codec.HOTEL_FIELDS + keys.LOCATION_FIELDS}
+    location_ids = [row[f"{field}_id"] for field in keys.LOCATION_FIELDS]
 
-# <-------------------Function for retriving structure of set  from reverse index of area ----------------------->
-async def reverse_lookup_area(area: str) -> Optional[str]:
+    # Committed, a Redis error is logged rather than failing the request
+    removed = []
+    try:
+        await cache_writer.flush_hotel(id)  # a queued copy has to reach redis first
+        # The row names every set the hotel is in, whether it is cached or not
+        removed = await remove_cached_hotel(
+            id, row["name"], location_ids, tombstone=True
+        )
+        await invalidate([deleted])
+    except Exception:
+        logger.exception("Failed to remove deleted hotel %s from Redis", id)
+
+    return {
+        "status": "success",
+        "message": f"Location with ID {id} deleted",
+        "deleted_data": deleted,
+        "removed_from_sets": removed,
+    }
+
+
+# <------------------Function to store data in redis----------------->
+async def store_location_data(hotels: Sequence[Mapping[str, Any]]):
     """
-    Get Country:State:City for a given area
+    Store location data in Redis with appropriate indexing
 
     Args:
-        area: The area to look up
-
-    Returns:
-        A string in the format "Country:State:City" or None if not found
+        hotels: Hotel rows or dictionaries, already in response shape
     """
 
-    result = await redis.get(f"reverse:area:{area}")
-    await redis.close()
-    return result
+    ids = [codec.location_ids(hotel) for hotel in hotels]
+    if None in ids:
+        # A location created by another worker, learn its id before packing
+        await refresh_location_cache()
+        ids = [codec.location_ids(hotel) for hotel in hotels]
+
+    # Flush in chunks so large loads never buffer millions of commands
+    for start in range(0, len(hotels), REDIS_PIPELINE_CHUNK):
+        end = start + REDIS_PIPELINE_CHUNK
+        try:
+            await scripts.execute_with_scripts(
+                redis,
+                partial(queue_store, hotels=hotels[start:end], ids=ids[start:end]),
+                "store",
+            )
+        except Exception:
+            # Loaded sets may now lack some of these hotels, so they are dropped
+            await drop_index_sets(hotels[start:end], ids[start:end])
+            raise
+
+
+async def drop_index_sets(
+    hotels: Sequence[Mapping[str, Any]], ids: List[Optional[tuple]]
+):
+    """Delete the index, GEO and autocomplete sets of the given hotels, best effort"""
+    sets = {
+        key
+        for hotel, location_ids in zip(hotels, ids)
+        if location_ids is not None
+        for key in keys.index_keys(hotel["id"], location_ids)
+        + [
+            keys.geo_key(keys.bucket_of(hotel["id"])),
+            keys.suggest_key(keys.bucket_of(hotel["id"])),
+            keys.SUGGEST_LOCATIONS_KEY,
+        ]
+    }
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in sets:
+                pipe.delete(key)
+            await execute_pipeline(pipe, "drop_index_sets")
+    except Exception:
+        logger.exception("Failed to drop %d index sets", len(sets))
+
+
+def jittered_ttl() -> int:
+    return REDIS_TTL - random.randint(0, REDIS_TTL_JITTER)
+
+
+def queue_store(pipe, hotels: Sequence[Mapping[str, Any]], ids: List[Optional[tuple]]):
+    # Commands are queued bucket by bucket, so a cluster pipeline sends each
+    # node one contiguous batch for the slots it owns
+    buckets = defaultdict(list)
+    for hotel, location_ids in zip(hotels, ids):
+        if location_ids is None:
+            continue  # still unknown, the next miss will store it
+        buckets[keys.bucket_of(hotel["id"])].append((hotel, location_ids))
+
+    for bucket in sorted(buckets):
+        for hotel, location_ids in buckets[bucket]:
+            # One packed value per hotel with its own TTL, added to the index
+            # sets of its locations that are loaded, and to the GEO set when it
+            # has coordinates
+            located = hotel["latitude"] is not None and hotel["longitude"] is not None
+            scripts.STORE_HOTEL.queue(
+                pipe,
+                [keys.hotel_key(hotel["id"]), keys.geo_key(bucket)]
+                + keys.index_keys(hotel["id"], location_ids),
+                [
+                    hotel["id"],
+                    codec.encode_hotel(hotel, location_ids),
+                    jittered_ttl(),
+                    hotel["longitude"] if located else "",
+                    hotel["latitude"] if located else "",
+                ],
+            )
+
+        # Hotel names for autocomplete, in the same slot as the hotels, added
+        # in a single call if the set is loaded
+        names = {
+            codec.suggest_member("hotel", hotel["id"], hotel["name"])
+            for hotel, _ in buckets[bucket]
+            if hotel["name"]
+        }
+        if names:
+            scripts.SUGGEST_STORE.queue(pipe, [keys.suggest_key(bucket)], list(names))
 
+    # Location names are few and never removed, one set holds all of them
+    locations = {
+        codec.suggest_member(field, id, hotel[field])
+        for bucket in buckets.values()
+        for hotel, location_ids in bucket
+        for field, id in zip(keys.LOCATION_FIELDS, location_ids)
+    }
+    if locations:
+        scripts.SUGGEST_STORE.queue(pipe, [keys.SUGGEST_LOCATIONS_KEY], list(locations))
 
-# <-------------------Function for retriving structure of set from reverse index of city ----------------------->
-async def reverse_lookup_city(city: str) -> Optional[str]:
-    """
-    Get Country:State for a given city
 
-    Args:
-        city: The city to look up
+async def refresh_location_cache():
+    """Reload the location names, at most once at a time in this worker"""
 
-    Returns:
-        A string in the format "Country:State" or None if not found
-    """
+    async def warm():
+        async with AsyncSessionLocal() as db:
+            await location_cache.warm(db)
 
-    result = await redis.get(f"reverse:city:{city}")
-    await redis.close()
-    return result
+    await location_refreshes.do("warm", warm)
 
 
-# <-------------------Function for retriving structure of set from reverse index of state ----------------------->
-async def reverse_lookup_state(state: str) -> Optional[str]:
+async def decode_hotels(blobs: List[bytes]) -> Optional[List[Dict[str, Any]]]:
     """
-    Get Country for a given state
+    Unpack cached hotels and put their location names back
 
     Args:
-        state: The state to look up
+        blobs: Packed hotels as stored by store_location_data
 
     Returns:
-        The country name or None if not found
+        The hotel dictionaries, or None (a miss) if a location id can not be
+        resolved even after reloading the location names
     """
-
-    result = await redis.get(f"reverse:state:{state}")
-    await redis.close()
-    return result
+    with span("decode"):
+        values = [codec.unpack_hotel(blob) for blob in blobs]
+        hotels = [codec.decode_hotel(hotel) for hotel in values]
+    if None in hotels:
+        await refresh_location_cache()
+        hotels = [codec.decode_hotel(hotel) for hotel in values]
+        if None in hotels:
+            return None
+    return hotels
 
 
 # <-------------------Function for get particular data using redis key and to get all data without using any input ----------------------->
-async def retrieve_location_data(key: Optional[str] = None) -> List[Dict[str, Any]]:
+async def retrieve_location_data(
+    indexes: Optional[List[str]] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    uncached: Optional[Set[int]] = None,
+) -> Optional[List[Dict[str, Any]]]:
     """
-    Retrieve location data based on the provided key
+    Retrieve the hotels in the intersection of the given indexes, reading the
+    page and every hotel in it in a single round trip per bucket. Without a
+    limit the hotels are read in pages of STREAM_BATCH_SIZE.
 
     Args:
-        key: The key to retrieve data for (e.g., "India", "India:Maharashtra", etc.)
+        indexes: The index names to intersect (e.g., ["state:1", "area:7"])
             If None, all data will be retrieved
+        cursor: Only return hotels with an id greater than this one
+        limit: Maximum number of hotels to return, None for all of them
+        uncached: Collects the ids of the page whose hotel is not cached
 
     Returns:
-        A list of location data dictionaries
+        A list of location data dictionaries ordered by id, or None when a set
+        is not loaded or a hotel of the page is not cached
     """
-
-    if key is None:
-        key = "ALL"
-
-    # Get all hash keys from the set
-    hash_keys = await redis.smembers(key)
-    if not hash_keys:
-        await redis.close()
-        return []
-
-    result = []
-
-    # Use pipeline for batched operations
-    async with redis.pipeline(transaction=False) as pipe:
-        # Queue up all the hgetall operations
-        for hash_key in hash_keys:
-            pipe.hgetall(hash_key)
-
-        # Execute and get all hash data
-        hash_data_list = await pipe.execute()
-
-        # Process the results
-        for hash_data in hash_data_list:
-            if hash_data:  # Skip empty results
-                result.append(hash_data)
-
-    await redis.close()
-    return result
-
-
-async def retrieve_with_area(area: str) -> List[Dict[str, Any]]:
+    indexes = indexes or [keys.ALL_INDEX]
+    if not limit:
+        # A script blocks Redis while it runs, an unbounded read is made of
+        # bounded pages, one script call per bucket each
+        hotels = []
+        while True:
+            page = await retrieve_location_data(
+                indexes, cursor=cursor, limit=STREAM_BATCH_SIZE, uncached=uncached
+            )
+            if page is None:
+                return None
+            hotels.extend(page)
+            if len(page) < STREAM_BATCH_SIZE:
+                return hotels
+            cursor = page[-1]["id"]
+
+    # Sets are scored by hotel id, so a page is a range read that costs the same
+    # whatever the cursor. Ids start at 1, the flag members are scored 0
+    min_score = f"({cursor or 0}"
+
+    # Each bucket lives in one slot, the buckets are read concurrently and
+    # every one of them returns at most a full page
+    pages = await asyncio.gather(
+        *(
+            scripts.RETRIEVE(
+                redis,
+                [keys.index_key(index, bucket) for index in indexes],
+                [keys.hotel_prefix(bucket), min_score, limit],
+            )
+            for bucket in keys.BUCKETS
+        )
+    )
+    if any(page is None for page in pages):
+        return None  # not loaded yet
+    missing = [int(id) for _, page_missing in pages for id in page_missing]
+    if missing:
+        if uncached is not None:
+            uncached.update(missing)
+        return None
+    if len(pages) == 1:
+        return await decode_hotels(pages[0][0])
+
+    hotels = await decode_hotels([blob for found, _ in pages for blob in found])
+    if hotels is None:
+        return None
+    by_bucket = defaultdict(list)
+    for hotel in hotels:
+        by_bucket[keys.bucket_of(hotel["id"])].append(hotel)
+    merged = heapq.merge(*by_bucket.values(), key=lambda hotel: hotel["id"])
+    return list(merged)[:limit]
+
+
+async def retrieve_with_filters(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    hotel_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    uncached: Optional[Set[int]] = None,
+) -> Optional[List[Dict[str, Any]]]:
     """
-    Retrieve location data for a given area using reverse indexing
+    Retrieve the hotels matching every given filter
 
     Args:
-        area: The area to retrieve data for
+        country, state, city, area: Location names, combined as a conjunction
+        hotel_id: Restrict the result to this hotel
+        cursor: Only return hotels with an id greater than this one
+        limit: Maximum number of hotels to return, None for all of them
+        uncached: See retrieve_location_data
 
     Returns:
-        A list of location data dictionaries
+        A list of location data dictionaries, None when it is not cached
     """
-    location_key = await reverse_lookup_area(area)
-    print("key:", location_key)
-    if not location_key:
-        return []
+    location = {"country": country, "state": state, "city": city, "area": area}
+
+    if hotel_id:
+        # A single hotel is read directly and checked against the other filters
+        if cursor is not None and hotel_id <= cursor:
+            return []
+        with span("redis.get"):
+            blob = await redis.get(keys.hotel_key(hotel_id))
+        if blob is None:
+            return None
+        # The tombstone of a hotel deleted a moment ago
+        hotels = await decode_hotels([blob]) if blob != codec.TOMBSTONE else []
+        if hotels is None:
+            return None
+        return [
+            hotel
+            for hotel in hotels
+            if all(
+                not value or hotel[field] == value for field, value in location.items()
+            )
+        ]
 
-    # Now use the location key to get the data
-    return await retrieve_location_data(f"{location_key}:{area}")
+    with span("resolve_locations"):
+        indexes = location_indexes(**location)
+    if indexes is None:
+        return None
+    return await retrieve_location_data(indexes, cursor, limit, uncached)
 
 
-async def retrieve_with_city(city: str) -> List[Dict[str, Any]]:
+# <-------------------Function for proximity search from redis, or DB on a miss ----------------------->
+async def get_nearby_hotels(
+    db,
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    limit: int,
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+) -> List[Dict[str, Any]]:
     """
-    Retrieve location data for a given city using reverse indexing
+    Hotels within radius_km of a point matching every location filter, nearest first
+
+    Answered from Redis only when the GEO set (loaded with the set of all
+    hotels) and the index sets of the filters are complete and every hotel
+    found is cached.
 
     Args:
-        city: The city to retrieve data for
+        db: Database session, used when Redis can not answer
+        latitude, longitude: The search center
+        radius_km: Search radius in kilometers
+        limit: Maximum number of hotels to return
+        country, state, city, area: Location filters, same as get_hotels
 
     Returns:
-        A list of location data dictionaries
+        Hotel dictionaries with an extra "distance_km"
     """
-    location_key = await reverse_lookup_city(city)
-    if not location_key:
-        return []
+    indexes = location_indexes(country=country, state=state, city=city, area=area)
+    hotels = None
+    if indexes is not None:
+        if keys.ALL_INDEX not in indexes:
+            indexes = [keys.ALL_INDEX] + indexes  # says whether the GEO set is complete
+
+        pages = await asyncio.gather(
+            *(
+                scripts.NEARBY(
+                    redis,
+                    [keys.geo_key(bucket)]
+                    + [keys.index_key(index, bucket) for index in indexes],
+                    [keys.hotel_prefix(bucket), longitude, latitude, radius_km, limit],
+                )
+                for bucket in keys.BUCKETS
+            )
+        )
+        if all(page is not None for page in pages):
+            found = [item for page in pages for item in page]
+            hotels = await decode_hotels(found[0::2])
+            for hotel, distance in zip(hotels or (), found[1::2]):
+                hotel["distance_km"] = round(float(distance), 3)
+            if hotels is not None:
+                hotels.sort(key=lambda hotel: (hotel["distance_km"], hotel["id"]))
+
+    if hotels is None:
+        # A set is not loaded yet or a hotel is not cached, the bounding box
+        # query answers while the sets are loaded
+        hotels = await get_nearby_hotel(
+            db, latitude, longitude, radius_km, limit, country, state, city, area
+        )
+        await cache_writer.enqueue(hotels)
+        schedule_index_loads(indexes)
 
-    # Now use the location key to get the data
-    return await retrieve_location_data(f"{location_key}:{city}")
+    return hotels[:limit]
 
 
-async def retrieve_with_state(state: str) -> List[Dict[str, Any]]:
+# <-------------------Function for name autocomplete from redis, or DB on a miss ----------------------->
+async def suggest(db, q: str, limit: int) -> List[Dict[str, Any]]:
     """
-    Retrieve location data for a given state using reverse indexing
+    Hotel and location names starting with a prefix, in name order
 
     Args:
-        state: The state to retrieve data for
+        db: Database session, used until the autocomplete sets are loaded
+        q: The typed prefix, matched case insensitively
+        limit: Maximum number of suggestions
 
     Returns:
-        A list of location data dictionaries
+        Suggestions as {"type", "id", "name"} dictionaries
     """
-    country = await reverse_lookup_state(state)
-    if not country:
+    if not codec.normalize_name(q):
         return []
 
-    # Now use the country and state to get the data
-    return await retrieve_location_data(f"{country}:{state}")
+    low, high = codec.suggest_range(q)
+    suggest_keys = [keys.suggest_key(bucket) for bucket in keys.BUCKETS] + [
+        keys.SUGGEST_LOCATIONS_KEY
+    ]
 
+    # Every set returns at most limit members, all in one round trip
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in suggest_keys:
+            pipe.zscore(key, codec.SUGGEST_FLAG + b"complete")
+            pipe.zrange(key, low, high, bylex=True, offset=0, num=limit)
+        results = await execute_pipeline(pipe, "suggest")
 
-async def update_simple_fields(
-    location_id: int, update_data: Dict[str, str]
-) -> Dict[str, Any]:
-    """
-    Update only the simple fields (name, description, streetaddress) for a location
+    # Only complete sets can answer, the others only hold the names written
+    # since they were loaded
+    if any(complete is None for complete in results[::2]):
+        run_in_background(suggest_loads.do("suggest", load_suggestions))
+        return await suggest_names(db, q, limit)
 
-    Args:
-        location_id: The unique ID of the location to update
-        update_data: Dictionary containing only the fields to update (name, description, streetaddress)
+    members = heapq.merge(*results[1::2])
+    return [codec.decode_suggestion(member) for member in members][:limit]
 
-    Returns:
-        The updated location data after changes
 
-    Raises:
-        ValueError: If the location ID doesn't exist in Redis or invalid fields are provided
+async def load_suggestions():
     """
-    # Validate input fields - only allow updates to these specific fields
-    allowed_fields = {"name", "description", "streetaddress"}
-
-    # Check if update_data contains only allowed fields
-    if not all(field in allowed_fields for field in update_data.keys()):
-        invalid_fields = [
-            field for field in update_data.keys() if field not in allowed_fields
-        ]
-        raise ValueError(
-            f"Cannot update fields: {invalid_fields}. Only name, description, and streetaddress can be updated."
-        )
-
-    # If dictionary is empty, return early
-    if not update_data:
-        raise ValueError("No valid fields provided for update")
-
-    hash_key = f"loc:{location_id}"
-
-    # Check if the hash key exists
-    exists = await redis.exists(hash_key)
-    if not exists:
-        await redis.close()
-        raise ValueError(f"Location with ID {location_id} does not exist in Redis")
-
+    Fill the autocomplete sets with every hotel and location name, like
+    load_index fills an index set. Errors are logged, a set left loading
+    expires and is loaded again by a later suggest.
+    """
+    sets = [keys.suggest_key(bucket) for bucket in keys.BUCKETS] + [
+        keys.SUGGEST_LOCATIONS_KEY
+    ]
     try:
-        # Update the hash with new values (only the provided fields)
-        await redis.hset(hash_key, mapping=update_data)
-        # Reset TTL to keep the data fresh
-        await redis.expire(hash_key, REDIS_TTL)
+        started = await asyncio.gather(
+            *(
+                scripts.INDEX_BEGIN(
+                    redis, [key], [INDEX_LOAD_SECONDS * 1000, codec.SUGGEST_FLAG]
+                )
+                for key in sets
+            )
+        )
+        loading = [key for key, begun in zip(sets, started) if begun]
+        if not loading:
+            return
+
+        async with AsyncSessionLocal() as db:
+            async for batch in abatched(
+                stream_names(db, INDEX_LOAD_CHUNK), INDEX_LOAD_CHUNK
+            ):
+                by_set = defaultdict(list)
+                for kind, id, name in batch:
+                    # Hotel names are checked against tombstones, location
+                    # names are never deleted
+                    if kind == "hotel":
+                        key = keys.suggest_key(keys.bucket_of(id))
+                        prefix = keys.hotel_prefix(keys.bucket_of(id))
+                    else:
+                        key, prefix = keys.SUGGEST_LOCATIONS_KEY, ""
+                    by_set[key, prefix].extend(
+                        [id, codec.suggest_member(kind, id, name)]
+                    )
+                for (key, prefix), args in by_set.items():
+                    if key not in loading:
+                        continue
+                    added = await scripts.SUGGEST_ADD(
+                        redis, [key], [codec.SUGGEST_FLAG, prefix, *args]
+                    )
+                    if not added:
+                        logger.warning("Loading autocomplete set %s expired", key)
+                        return
+
+        for key in loading:
+            await scripts.INDEX_COMPLETE(redis, [key], [REDIS_TTL, codec.SUGGEST_FLAG])
+    except Exception:
+        logger.exception("Failed to load the autocomplete sets")
+
+
+def hotel_suggest_member(values: List[Any]) -> bytes:
+    hotel = dict(zip(codec.HOTEL_FIELDS, values))
+    return codec.suggest_member("hotel", hotel["id"], hotel["name"] or "")
+
+
+async def replace_suggestion(hotel_id: int, old_member: bytes, new_member: bytes):
+    key = keys.suggest_key(keys.bucket_of(hotel_id))
+
+    def queue(pipe):
+        pipe.zrem(key, old_member)
+        scripts.SUGGEST_STORE.queue(pipe, [key], [new_member])
+
+    await scripts.execute_with_scripts(redis, queue, "replace_suggestion")
+
+
+async def update_cached_hotel(hotel: Mapping[str, Any]):
+    """
+    Replace the cached copy of a hotel with its updated row
 
-        # Retrieve and return the updated data
-        updated_data = await redis.hgetall(hash_key)
-        return updated_data
-
-    except Exception as e:
-        raise Exception(f"Error updating location data: {str(e)}")
-    finally:
-        await redis.close()
+    A hotel that is not cached is left alone, the next miss stores it.
 
+    Args:
+        hotel: The hotel as returned by the update
+    """
+    location_ids = codec.location_ids(hotel)
+    if location_ids is None:
+        await refresh_location_cache()
+        location_ids = codec.location_ids(hotel)
+
+    hotel_key = keys.hotel_key(hotel["id"])
+    if location_ids is None:
+        # Can not be packed, dropping the copy turns the next read into a miss
+        await redis.delete(hotel_key)
+        return
+
+    # XX, so a delete that raced this update is not undone. GET hands back the
+    # previous version in the same round trip, for its autocomplete entry
+    old_blob = await redis.set(
+        hotel_key,
+        codec.encode_hotel(hotel, location_ids),
+        ex=jittered_ttl(),
+        xx=True,
+        get=True,
+    )
+    if old_blob == codec.TOMBSTONE:
+        # Deleted while this update ran, the tombstone has to stay
+        await redis.set(hotel_key, codec.TOMBSTONE, px=INDEX_LOAD_SECONDS * 1000)
+    elif old_blob is not None:
+        old_member = hotel_suggest_member(codec.unpack_hotel(old_blob))
+        new_member = codec.suggest_member("hotel", hotel["id"], hotel["name"] or "")
+        if new_member != old_member:
+            await replace_suggestion(hotel["id"], old_member, new_member)
+
+
+async def remove_cached_hotel(
+    hotel_id: int,
+    name: Optional[str],
+    location_ids: Sequence[int],
+    tombstone: bool = False,
+) -> List[str]:
+    """
+    Drop a cached hotel and its entries in every set, returning the sets
 
-async def delete_location_data(location_id: int) -> Dict[str, Any]:
+    A deleted hotel leaves a tombstone, so an index load that read its id
+    before the delete does not add it back.
+    """
+    bucket = keys.bucket_of(hotel_id)
+    sets = keys.index_keys(hotel_id, location_ids) + [keys.geo_key(bucket)]
+    await scripts.DELETE(
+        redis,
+        [keys.hotel_key(hotel_id), keys.suggest_key(bucket)] + sets,
+        [
+            hotel_id,
+            codec.suggest_member("hotel", hotel_id, name or ""),
+            INDEX_LOAD_SECONDS * 1000 if tombstone else 0,
+        ],
+    )
+    return sets
+
+
+# <------------------Functions applying writes made outside the API, see queries/change_feed.py----------------->
+async def apply_database_changes(changes: Changes):
     """
-    Delete a location from Redis by its ID, removing it from all related sets
+    Bring Redis in line with rows changed by migrations, manual SQL or other
+    services, the read table was already synced by its triggers
 
     Args:
-        location_id: The unique ID of the location to delete
+        changes: Ids of the changed rows by table name, see ChangeFeed
+    """
+    locations = {
+        model: changes[model.__tablename__]
+        for model in LOCATION_MODELS
+        if changes.get(model.__tablename__)
+    }
+    if locations:
+        await apply_location_changes(locations)
+
+    hotels = changes.get(Hotel.__tablename__, {})
+    hotel_ids = sorted(hotels)
+    for start in range(0, len(hotel_ids), REDIS_PIPELINE_CHUNK):
+        chunk = hotel_ids[start : start + REDIS_PIPELINE_CHUNK]
+        await apply_hotel_changes({hotel_id: hotels[hotel_id] for hotel_id in chunk})
+
+
+async def apply_local_changes(changes: Changes):
+    """
+    The part of apply_database_changes the workers not applying it run
 
-    Returns:
-        A dictionary with deletion status and information about what was deleted
+    Their L1 entries of changed hotels are evicted by the invalidations the
+    applying worker publishes, only the location cache is reloaded here.
 
-    Raises:
-        ValueError: If the location ID doesn't exist in Redis
+    Args:
+        changes: Ids of the changed rows by table name
     """
+    if any(changes.get(model.__tablename__) for model in LOCATION_MODELS):
+        async with AsyncSessionLocal() as db:
+            await location_cache.warm(db)
+        l1.evict_all()
 
-    hash_key = f"loc:{location_id}"
 
-    # Check if the hash key exists
-    exists = await redis.exists(hash_key)
-    if not exists:
-        await redis.close()
-        raise ValueError(f"Location with ID {location_id} does not exist in Redis")
+async def apply_hotel_changes(old_locations: Dict[int, Set[Tuple[int, ...]]]):
+    """
+    Args:
+        old_locations: Changed hotel ids, each with the location ids it left
+    """
+    hotel_ids = list(old_locations)
+    async with AsyncSessionLocal() as db:
+        hotels = await get_hotels_by_ids(db, hotel_ids)
 
-    try:
-        # First, get the location data to find the sets it belongs to
-        location_data = await redis.hgetall(hash_key)
-
-        # Extract hierarchical values
-        country = location_data.get("country")
-        state = location_data.get("state")
-        city = location_data.get("city")
-        area = location_data.get("area")
-
-        # Create a list of sets to remove the hash_key from
-        sets_to_update = [
-            "ALL",  # Global set containing all locations
-            country,  # Country set
-            f"{country}:{state}",  # Country:State set
-            f"{country}:{state}:{city}",  # Country:State:City set
-            f"{country}:{state}:{city}:{area}",  # Country:State:City:Area set
+    # The cached copies name the sets the hotels were in before the change
+    async with redis.pipeline(transaction=False) as pipe:
+        for hotel_id in hotel_ids:
+            pipe.get(keys.hotel_key(hotel_id))
+        blobs = await execute_pipeline(pipe, "change_feed")
+        blobs = [blob for blob in blobs if blob]  # neither missing nor a tombstone
+
+    cached = {values[0]: values for values in map(codec.unpack_hotel, blobs)}
+    existing = {hotel["id"] for hotel in hotels}
+    for hotel_id in hotel_ids:
+        values = cached.get(hotel_id)
+        if values is not None or hotel_id not in existing:
+            # A deleted hotel that was not cached is still taken out of the
+            # sets every hotel is in
+            name = values[codec.HOTEL_FIELDS.index("name")] if values else None
+            await remove_cached_hotel(
+                hotel_id,
+                name,
+                codec.packed_location_ids(values) if values else (),
+                tombstone=hotel_id not in existing,
+            )
+    # Cached or not, a hotel leaves the sets of the locations it moved out of.
+    # Those of its current location get it back when it is stored below.
+    await remove_from_location_sets(old_locations)
+
+    # Stored again with their current values, deleted hotels are not. Listings
+    # of the locations the hotels left are outdated along with the new ones.
+    await store_location_data(hotels)
+    await invalidate(
+        [
+            *(await decode_hotels(blobs) or []),
+            *hotels,
+            *(
+                location_names(location)
+                for locations in old_locations.values()
+                for location in locations
+            ),
         ]
+    )
 
-        # Use pipeline for batched operations
-        async with redis.pipeline(transaction=False) as pipe:
-            # Remove the hash_key from all sets
-            for set_key in sets_to_update:
-                await pipe.srem(set_key, hash_key)
-
-            # Delete the hash itself
-            await pipe.delete(hash_key)
 
-            # Execute all operations
-            await pipe.execute()
-
-        return {
-            "status": "success",
-            "message": f"Location with ID {location_id} deleted",
-            "deleted_data": location_data,
-            "removed_from_sets": sets_to_update,
-        }
-
-    except Exception as e:
-        raise Exception(f"Error deleting location data: {str(e)}")
-    finally:
-        await redis.close()
+async def remove_from_location_sets(old_locations: Dict[int, Set[Tuple[int, ...]]]):
+    """ZREM every hotel from the index sets of the locations it left"""
+    async with redis.pipeline(transaction=False) as pipe:
+        for hotel_id, locations in old_locations.items():
+            for location_ids in locations:
+                # The first set is the one of all hotels, which it did not leave
+                for key in keys.index_keys(hotel_id, location_ids)[1:]:
+                    pipe.zrem(key, hotel_id)
+        if len(pipe):
+            await execute_pipeline(pipe, "change_feed")
+
+
+def location_names(location_ids: Sequence[int]) -> Dict[str, Optional[str]]:
+    """The {"country": ..., ...} names of (country, state, city, area) ids"""
+    return {
+        field: location_cache.name_of(model, location_id)
+        for (field, model), location_id in zip(codec.LOCATION_MODELS, location_ids)
+    }
+
+
+async def apply_location_changes(locations: Dict[Any, Set[int]]):
+    old_names = {
+        model: {id: location_cache.name_of(model, id) for id in ids}
+        for model, ids in locations.items()
+    }
+
+    # The other workers reload theirs in apply_local_changes
+    async with AsyncSessionLocal() as db:
+        await location_cache.warm(db)
+    l1.evict_all()
+
+    # Replace the autocomplete entries and outdate listings filtered on either name
+    removed, added, renamed = [], [], []
+    for model, names in old_names.items():
+        field = LOCATION_MODELS[model]
+        for id, old_name in names.items():
+            new_name = location_cache.name_of(model, id)
+            if old_name == new_name:
+                continue
+            if old_name is not None:
+                removed.append(codec.suggest_member(field, id, old_name))
+                renamed.append({field: old_name})
+            if new_name is not None:
+                added.append(codec.suggest_member(field, id, new_name))
+                renamed.append({field: new_name})
+
+    def queue(pipe):
+        if removed:
+            pipe.zrem(keys.SUGGEST_LOCATIONS_KEY, *removed)
+        if added:
+            scripts.SUGGEST_STORE.queue(pipe, [keys.SUGGEST_LOCATIONS_KEY], added)
+
+    if removed or added:
+        await scripts.execute_with_scripts(redis, queue, "change_feed")
+
+    if renamed:
+        await responses.bump_versions(redis, renamed)
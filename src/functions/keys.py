@@ -0,0 +1,110 @@
+import json
+from typing import List, Optional, Sequence, Tuple
+from configs.redis_pool import REDIS_BUCKETS
+
+# Redis key layout
+#
+#   hotel:{bucket}:{hotel_id}         packed hotel, see functions/codec.py
+#   idx:{bucket}:{field}:{location_id}
+#                                     sorted set of the bucket's hotel ids in one
+#                                     country, state, city or area, scored by id
+#   idx:{bucket}:all                  sorted set of all the bucket's hotel ids
+#   geo:{bucket}                      GEO set of all the bucket's hotels with coordinates
+#   suggest:{bucket}                  lexicographic set of the bucket's hotel names
+#   suggest:locations                 lexicographic set of the location names
+#   versions                          hash of write counters, one field per
+#                                     location ("city:Pune") plus "all", and
+#                                     a random "epoch"
+#   resp:[filters]                    hash holding a serialized /hotels response
+#                                     and the versions it was built from
+#   lock:fill:[filters]               lock of the worker loading a missed query
+#   fill:[filters]                    hash holding the JSON result of that load
+#                                     and the versions it was read at, for the
+#                                     workers waiting on the lock
+#
+# Index sets are keyed by location id rather than name, a name filter is
+# turned into an id with the in-process location cache before Redis is hit.
+#
+# An index set holds every hotel of its location or does not exist at all: it
+# is only created by a load reading all its ids from Postgres, and writes only
+# add to sets that exist. A load in progress is marked by the member "loading",
+# a finished one by "complete", both scored 0 below every hotel id. Reads trust
+# complete sets only. Hotel values are cached separately, as hotels are read,
+# so a set may name hotels whose value is not cached; reading one is a miss.
+# A deleted hotel's key holds an empty tombstone for a while, so a load that
+# read its id before the delete does not add it back. A GEO set is loaded along
+# with the set of all the bucket's hotels and is complete when that set is.
+# The autocomplete sets follow the same rules, with flag members prefixed by
+# codec.SUGGEST_FLAG so no name prefix ever matches them.
+#
+# Hotels are spread over REDIS_BUCKETS buckets by id and the {bucket} part is
+# a Redis Cluster hash tag: a hotel, and every index entry pointing at it, live
+# in the same slot. Scripts touching a hotel and its sets therefore never cross
+# slots, and a query runs once per bucket and merges the results by id. With a
+# single node there is one bucket and a query is a single script call.
+
+ALL_INDEX = "all"
+SUGGEST_LOCATIONS_KEY = "suggest:locations"
+VERSIONS_KEY = "versions"
+LOCATION_FIELDS = ("country", "state", "city", "area")
+BUCKETS = range(REDIS_BUCKETS)
+
+
+def bucket_of(hotel_id: int) -> int:
+    return int(hotel_id) % REDIS_BUCKETS
+
+
+def hotel_prefix(bucket: int) -> str:
+    # Renamed from loc: when coordinates were added to the packed layout, so
+    # values in the old layout are never read back
+    return f"hotel:{{{bucket}}}:"
+
+
+def hotel_key(hotel_id: int) -> str:
+    return f"{hotel_prefix(bucket_of(hotel_id))}{hotel_id}"
+
+
+def index_name(field: str, location_id: int) -> str:
+    """Bucket independent name of an index, e.g. "state:7" """
+    return f"{field}:{location_id}"
+
+
+def index_key(index: str, bucket: int) -> str:
+    return f"idx:{{{bucket}}}:{index}"
+
+
+def index_location(index: str) -> Optional[Tuple[str, int]]:
+    """The (field, location id) an index name stands for, None for "all" """
+    if index == ALL_INDEX:
+        return None
+    field, location_id = index.split(":")
+    return field, int(location_id)
+
+
+def index_keys(hotel_id: int, location_ids: Sequence[int]) -> List[str]:
+    """Every sorted set a hotel with these (country, state, city, area) ids is in"""
+    bucket = bucket_of(hotel_id)
+    return [index_key(ALL_INDEX, bucket)] + [
+        index_key(index_name(field, location_id), bucket)
+        for field, location_id in zip(LOCATION_FIELDS, location_ids)
+    ]
+
+
+def suggest_key(bucket: int) -> str:
+    return f"suggest:{{{bucket}}}"
+
+
+def geo_key(bucket: int) -> str:
+    return f"geo:{{{bucket}}}"
+
+
+def response_key(filters: Tuple) -> str:
+    return f"resp:{json.dumps(filters)}"
+
+
+def fill_lock_key(filters: Tuple) -> str:
+    return f"lock:fill:{json.dumps(filters)}"
+
+
+def fill_result_key(filters: Tuple) -> str:
+    return f"fill:{json.dumps(filters)}"
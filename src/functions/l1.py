@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Iterable, Optional, Tuple
+from utils.lru import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# The L1 cache is off unless a size is configured
+L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", "0"))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "5"))
+INVALIDATION_CHANNEL = "hotels:invalidate"
+
+l1_cache = TTLCache(maxsize=L1_CACHE_SIZE, ttl=L1_CACHE_TTL)
+
+# Bumped on every eviction, so a read that raced a write does not repopulate
+# the cache with what it read before the write
+generation = 0
+
+
+def enabled() -> bool:
+    return L1_CACHE_SIZE > 0
+
+
+# <---------------Function to build the L1 key for a hotel query---------------->
+def cache_key(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    hotel_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Tuple:
+    return (country, state, city, area, hotel_id, cursor, limit)
+
+
+def lookup(key: Tuple) -> Optional[Any]:
+    if not enabled():
+        return None
+    return l1_cache.get(key)
+
+
+def store(key: Tuple, value: Any, read_generation: int):
+    """Cache a result unless an invalidation arrived while it was being read"""
+    if enabled() and read_generation == generation:
+        l1_cache.set(key, value)
+
+
+# <---------------Function to drop the L1 entries a write can affect---------------->
+def evict_locations(locations: Iterable[Iterable[Optional[str]]]) -> int:
+    """
+    Evict every cached query whose filters match one of the written locations
+
+    Args:
+        locations: (country, state, city, area) tuples of the hotels written
+
+    Returns:
+        The number of evicted entries
+    """
+    global generation
+    generation += 1
+
+    locations = [tuple(location) for location in locations]
+
+    def affected(key: Tuple) -> bool:
+        filters = key[:4]
+        return any(
+            all(f is None or f == value for f, value in zip(filters, location))
+            for location in locations
+        )
+
+    return l1_cache.evict(affected)
+
+
+def evict_all():
+    global generation
+    generation += 1
+    l1_cache.clear()
+
+
+def location_of(hotel: dict) -> Tuple[Optional[str], ...]:
+    return (
+        hotel.get("country"),
+        hotel.get("state"),
+        hotel.get("city"),
+        hotel.get("area"),
+    )
+
+
+# <---------------Function to tell every worker which locations changed---------------->
+async def publish_invalidation(client, hotels: Iterable[dict]):
+    """
+    Evict locally, then broadcast the written locations to the other workers
+
+    Args:
+        client: Redis client used to publish
+        hotels: Hotel dictionaries that were inserted, updated or deleted
+    """
+    if not enabled():
+        return
+
+    locations = list({location_of(hotel) for hotel in hotels})
+    evict_locations(locations)
+    await client.publish(INVALIDATION_CHANNEL, json.dumps(locations))
+
+
+# <---------------Background task evicting on invalidations from any worker---------------->
+async def listen_for_invalidations(client, retry_delay: float = 1.0):
+    """
+    Subscribe to the invalidation channel and evict matching entries
+
+    Messages published while disconnected are lost, so the whole L1 cache is
+    dropped every time the subscription is (re)established.
+
+    Args:
+        client: Dedicated Redis client for the subscription
+        retry_delay: Seconds to wait before resubscribing after an error
+    """
+    while True:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                evict_all()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        evict_locations(json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("L1 invalidation listener failed, resubscribing")
+            evict_all()
+            await asyncio.sleep(retry_delay)
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import uuid
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
+import orjson
+from functions import keys
+from utils.metrics import execute_pipeline
+
+# Serialized /hotels responses are kept this many seconds, 0 turns the cache off
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+# Larger bodies, typically unpaginated exports, are never cached
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1 << 20)))
+
+ALL_VERSION = "all"
+# Random per versions hash, so counters restarting after Redis lost the hash
+# never reproduce a version handed out before
+EPOCH_FIELD = "epoch"
+
+# (body, next cursor) of a cached response
+Cached = Tuple[bytes, Optional[int]]
+
+
+def enabled() -> bool:
+    return RESPONSE_CACHE_TTL > 0
+
+
+def cacheable(body: bytes) -> bool:
+    return enabled() and len(body) <= RESPONSE_CACHE_MAX_BYTES
+
+
+def encode(data: Any) -> bytes:
+    # RowMappings from a Postgres read are not dicts, dict() makes them serialisable
+    return orjson.dumps(data, default=dict)
+
+
+# <---------------Functions to name the version counters a query depends on---------------->
+def version_fields(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+) -> List[str]:
+    """
+    Counters bumped by every write that can change the result of a query
+
+    A query filtering on several locations depends on each of them, one
+    without location filters (all hotels, or a single hotel_id) on "all".
+    """
+    fields = [
+        f"{field}:{value}"
+        for field, value in zip(keys.LOCATION_FIELDS, (country, state, city, area))
+        if value
+    ]
+    return [EPOCH_FIELD] + (fields or [ALL_VERSION])
+
+
+def hotel_version_fields(hotels: Iterable[Mapping[str, Any]]) -> List[str]:
+    """Every counter a write of these hotels has to bump"""
+    fields = {ALL_VERSION}
+    for hotel in hotels:
+        for field in keys.LOCATION_FIELDS:
+            if hotel.get(field):
+                fields.add(f"{field}:{hotel[field]}")
+    return sorted(fields)
+
+
+# <---------------Functions to turn the counters into ETags---------------->
+def version_token(counters: List[Optional[bytes]]) -> bytes:
+    return b".".join(counter or b"0" for counter in counters)
+
+
+def etag(version: bytes) -> str:
+    return f'"{hashlib.blake2b(version, digest_size=8).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """If-None-Match holds "*" or a list of tags, weak ones compare equal too"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return any(
+        candidate == "*" or candidate.removeprefix("W/") == tag
+        for candidate in candidates
+    )
+
+
+def queue_versions(pipe, fields: List[str]):
+    """
+    Queue a read of the counters, answered by two results: the HSETNX of the
+    epoch and the counters. The epoch is created on reads as well as writes,
+    or a token read after the hash was lost would restart at "0" and could
+    match a tag handed out before.
+    """
+    pipe.hsetnx(keys.VERSIONS_KEY, EPOCH_FIELD, uuid.uuid4().hex)
+    pipe.hmget(keys.VERSIONS_KEY, fields)
+
+
+async def current_version(client, fields: List[str]) -> bytes:
+    """Version token of a query, read in a single round trip"""
+    async with client.pipeline(transaction=False) as pipe:
+        queue_versions(pipe, fields)
+        _, counters = await execute_pipeline(pipe, "current_version")
+    return version_token(counters)
+
+
+# <---------------Function to read a cached response and the current versions---------------->
+async def lookup(
+    client, filters: Tuple, fields: List[str]
+) -> Tuple[Optional[Cached], bytes]:
+    """
+    Read a cached response together with the versions it has to match, in
+    one round trip
+
+    Args:
+        client: Redis client
+        filters: Normalized filter key of the query, see l1.cache_key
+        fields: Version counters the query depends on
+
+    Returns:
+        The cached (body, next cursor), or None when missing or built from
+        older versions, and the current version token
+    """
+    if not enabled():
+        return None, await current_version(client, fields)
+
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hmget(keys.response_key(filters), "version", "cursor", "body")
+        queue_versions(pipe, fields)
+        (version, cursor, body), _, counters = await execute_pipeline(
+            pipe, "response_lookup"
+        )
+
+    current = version_token(counters)
+    if body is None or version != current:
+        return None, current
+    return (body, int(cursor) if cursor else None), current
+
+
+async def store(
+    client, filters: Tuple, version: bytes, body: bytes, cursor: Optional[int]
+):
+    """Cache a response under the versions read before its data was"""
+    if not cacheable(body):
+        return
+
+    key = keys.response_key(filters)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hset(
+            key,
+            mapping={
+                "version": version,
+                "cursor": "" if cursor is None else cursor,
+                "body": body,
+            },
+        )
+        pipe.expire(key, RESPONSE_CACHE_TTL)
+        await execute_pipeline(pipe, "response_store")
+
+
+# <---------------Function to outdate every response a write can affect---------------->
+async def bump_versions(client, hotels: Iterable[Mapping[str, Any]]):
+    """
+    Increment the counters of the written hotels' locations
+
+    Cached responses are never deleted, the next lookup sees they were built
+    from older versions and they expire on their own.
+
+    Args:
+        client: Redis client
+        hotels: Hotel dictionaries that were inserted, updated or deleted
+    """
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hsetnx(keys.VERSIONS_KEY, EPOCH_FIELD, uuid.uuid4().hex)
+        for field in hotel_version_fields(hotels):
+            pipe.hincrby(keys.VERSIONS_KEY, field, 1)
+        await execute_pipeline(pipe, "bump_versions")
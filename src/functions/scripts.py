@@ -0,0 +1,397 @@
+import hashlib
+import time
+from typing import Any, Sequence
+from redis.exceptions import NoScriptError
+from utils.metrics import REDIS_SCRIPT_SECONDS, execute_pipeline
+from utils.timing import span
+
+
+class LuaScript:
+    """
+    A Lua script called by SHA through EVALSHA
+
+    The SHA is computed locally, loaded once at startup by load_scripts and
+    loaded again whenever Redis answers NOSCRIPT (restart, failover, SCRIPT
+    FLUSH).
+
+    Scripts get their keys in KEYS, and every key they touch shares one hash
+    tag, so a cluster routes the call to the node owning that slot.
+    """
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+        self._latency = REDIS_SCRIPT_SECONDS.labels(name)
+        self._span = f"redis.{name}"
+
+    async def load(self, client):
+        # A cluster loads the script on every primary
+        await client.script_load(self.source)
+
+    def queue(self, pipe, keys: Sequence[str], args: Sequence[Any] = ()):
+        """Queue a call on a pipeline, see execute_with_scripts"""
+        pipe.evalsha(self.sha, len(keys), *keys, *args)
+
+    async def __call__(
+        self, client, keys: Sequence[str], args: Sequence[Any] = ()
+    ) -> Any:
+        with span(self._span):
+            start = time.perf_counter()
+            try:
+                return await client.evalsha(self.sha, len(keys), *keys, *args)
+            except NoScriptError:
+                await self.load(client)
+                return await client.evalsha(self.sha, len(keys), *keys, *args)
+            finally:
+                self._latency.observe(time.perf_counter() - start)
+
+
+# <---------------Script reading a page of hotels from the intersection of index sets---------------->
+# KEYS: the index sets of one bucket. ARGV: hotel key prefix of that bucket,
+# min score (above 0, the flag members), limit (required, an unbounded read is
+# paged by the caller so no call walks a whole set). Returns the packed hotels
+# of the page and the ids in it whose hotel is not cached, or nil when
+# a set is not complete
+RETRIEVE = LuaScript(
+    "retrieve",
+    """
+local prefix, min_score, limit = ARGV[1], ARGV[2], tonumber(ARGV[3])
+
+-- Only a complete set can tell a hotel is not in it
+local sets = {}
+for i = 1, #KEYS do
+    if not redis.call('ZSCORE', KEYS[i], 'complete') then
+        return false
+    end
+    sets[#sets + 1] = {key = KEYS[i], size = redis.call('ZCARD', KEYS[i])}
+end
+
+-- Walk the smallest set in id order and keep the ids present in all others,
+-- so a page only costs the members scanned to fill it
+table.sort(sets, function(a, b) return a.size < b.size end)
+
+local members = {}
+local batch_size = math.max(limit, 100)
+while true do
+    local batch = redis.call(
+        'ZRANGEBYSCORE', sets[1].key, min_score, '+inf', 'LIMIT', 0, batch_size
+    )
+    for _, member in ipairs(batch) do
+        local in_all = true
+        for j = 2, #sets do
+            if not redis.call('ZSCORE', sets[j].key, member) then
+                in_all = false
+                break
+            end
+        end
+        if in_all then
+            members[#members + 1] = member
+            if #members >= limit then
+                break
+            end
+        end
+    end
+    if #batch < batch_size or #members >= limit then
+        break
+    end
+    min_score = '(' .. batch[#batch]
+end
+
+-- Hotels carry their own jittered TTL and are only cached once read, the page
+-- is a miss when one of them is not cached
+local found, missing = {}, {}
+for _, member in ipairs(members) do
+    local hotel = redis.call('GET', prefix .. member)
+    if hotel and hotel ~= '' then
+        found[#found + 1] = hotel
+    else
+        missing[#missing + 1] = member
+    end
+end
+return {found, missing}
+""",
+)
+
+# <---------------Scripts loading the complete membership of an index set---------------->
+# An index set only exists once it holds every hotel of its location, see
+# functions/keys.py. A load marks the set with the 'loading' member, adds the
+# ids read from Postgres and swaps the mark for 'complete'. Hotels written in
+# the meantime are added by STORE_HOTEL, which adds to any set that exists.
+# The GEO set of a bucket is loaded along with its set of all hotels, whose
+# flags it goes by, as flag members have no place among coordinates.
+
+# KEYS: index set, then sets loaded along with it. ARGV: milliseconds the load
+# may take, and optionally a prefix of the flag members (autocomplete sets, see
+# codec.SUGGEST_FLAG). Returns 1 when this load owns the set, 0 when it
+# already exists
+INDEX_BEGIN = LuaScript(
+    "index_begin",
+    """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], 0, (ARGV[2] or '') .. 'loading')
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+for i = 2, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+return 1
+""",
+)
+
+# KEYS: index set. ARGV: hotel key prefix, then the ids to add. Ids deleted
+# since Postgres was read are left out, their hotel key holds the tombstone.
+# Returns 0 when the load expired and has to be given up
+INDEX_ADD = LuaScript(
+    "index_add",
+    """
+if not redis.call('ZSCORE', KEYS[1], 'loading') then
+    return 0
+end
+for i = 2, #ARGV do
+    if redis.call('GET', ARGV[1] .. ARGV[i]) ~= '' then
+        redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i])
+    end
+end
+return 1
+""",
+)
+
+# KEYS: set of all hotels, GEO set. ARGV: hotel key prefix, then id, longitude
+# and latitude of every hotel (empty without coordinates). Same as INDEX_ADD
+# otherwise
+ALL_ADD = LuaScript(
+    "all_add",
+    """
+if not redis.call('ZSCORE', KEYS[1], 'loading') then
+    return 0
+end
+for i = 2, #ARGV, 3 do
+    local id = ARGV[i]
+    if redis.call('GET', ARGV[1] .. id) ~= '' then
+        redis.call('ZADD', KEYS[1], id, id)
+        if ARGV[i + 1] ~= '' then
+            redis.call('GEOADD', KEYS[2], ARGV[i + 1], ARGV[i + 2], id)
+        end
+    end
+end
+return 1
+""",
+)
+
+# KEYS: index set, then sets loaded along with it. ARGV: TTL in seconds, and
+# the flag prefix given to INDEX_BEGIN. Returns 0 when the load expired
+INDEX_COMPLETE = LuaScript(
+    "index_complete",
+    """
+local flag = ARGV[2] or ''
+if redis.call('ZREM', KEYS[1], flag .. 'loading') == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], 0, flag .. 'complete')
+for i = 1, #KEYS do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return 1
+""",
+)
+
+# KEYS: autocomplete set. ARGV: flag prefix, hotel key prefix (empty for the
+# location names), then the id and member of every name. Same as INDEX_ADD
+# otherwise, the names of hotels deleted since Postgres was read are left out
+SUGGEST_ADD = LuaScript(
+    "suggest_add",
+    """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1] .. 'loading') then
+    return 0
+end
+for i = 3, #ARGV, 2 do
+    if ARGV[2] == '' or redis.call('GET', ARGV[2] .. ARGV[i]) ~= '' then
+        redis.call('ZADD', KEYS[1], 0, ARGV[i + 1])
+    end
+end
+return 1
+""",
+)
+
+# <---------------Script adding names to an autocomplete set that is loaded---------------->
+# KEYS: autocomplete set. ARGV: members to add. A set that does not exist is
+# left alone, like the index sets in STORE_HOTEL, it is loaded whole when read
+SUGGEST_STORE = LuaScript(
+    "suggest_store",
+    """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV do
+    redis.call('ZADD', KEYS[1], 0, ARGV[i])
+end
+return 1
+""",
+)
+
+# <---------------Script caching a hotel and adding it to its loaded sets---------------->
+# KEYS: hotel key, GEO set, then its index sets starting with the set of all
+# hotels. ARGV: hotel id, packed hotel, TTL, longitude and latitude (empty
+# without coordinates). Sets that do not exist are left alone, they are loaded
+# whole when read. A hotel deleted since it was read (its key holds the
+# tombstone) is skipped
+STORE_HOTEL = LuaScript(
+    "store_hotel",
+    """
+if redis.call('GET', KEYS[1]) == '' then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+if ARGV[4] ~= '' and redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('GEOADD', KEYS[2], ARGV[4], ARGV[5], ARGV[1])
+end
+for i = 3, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('ZADD', KEYS[i], ARGV[1], ARGV[1])
+    end
+end
+return 1
+""",
+)
+
+# <---------------Script finding the hotels of one bucket within a radius---------------->
+# KEYS: GEO set of the bucket, its set of all hotels, then the index sets to
+# filter on. ARGV: hotel key prefix, longitude, latitude, radius in km, limit.
+# Returns packed hotels and their distances, alternating and nearest first, or
+# nil when a set is not complete or one of the hotels is not cached
+NEARBY = LuaScript(
+    "nearby",
+    """
+local prefix, limit = ARGV[1], tonumber(ARGV[5])
+
+-- The GEO set is complete when the set of all hotels is
+for i = 2, #KEYS do
+    if not redis.call('ZSCORE', KEYS[i], 'complete') then
+        return false
+    end
+end
+
+local found
+if #KEYS == 2 then
+    found = redis.call(
+        'GEOSEARCH', KEYS[1], 'FROMLONLAT', ARGV[2], ARGV[3],
+        'BYRADIUS', ARGV[4], 'km', 'ASC', 'COUNT', limit, 'WITHDIST'
+    )
+else
+    -- Filtered searches can not stop at limit, the radius bounds the scan
+    found = redis.call(
+        'GEOSEARCH', KEYS[1], 'FROMLONLAT', ARGV[2], ARGV[3],
+        'BYRADIUS', ARGV[4], 'km', 'ASC', 'WITHDIST'
+    )
+end
+
+local result = {}
+for _, item in ipairs(found) do
+    local member, distance = item[1], item[2]
+    local in_all = true
+    for j = 3, #KEYS do
+        if not redis.call('ZSCORE', KEYS[j], member) then
+            in_all = false
+            break
+        end
+    end
+    if in_all then
+        local hotel = redis.call('GET', prefix .. member)
+        if not hotel or hotel == '' then
+            return false
+        end
+        result[#result + 1] = hotel
+        result[#result + 1] = distance
+        if #result >= 2 * limit then
+            break
+        end
+    end
+end
+return result
+""",
+)
+
+# <---------------Script removing a hotel and its id from every index set---------------->
+# KEYS: hotel key, suggest key, then the index set keys. ARGV: hotel id, suggest
+# member, milliseconds to keep a tombstone (0 for none). Returns the packed
+# hotel, or nil if not cached. The sets are cleaned either way, they hold every
+# hotel whether its value is cached or not
+DELETE = LuaScript(
+    "delete",
+    """
+local hotel = redis.call('GET', KEYS[1])
+
+redis.call('ZREM', KEYS[2], ARGV[2])
+for i = 3, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+if tonumber(ARGV[3]) > 0 then
+    -- Keeps a load that read the hotel before it was deleted from adding it back
+    redis.call('SET', KEYS[1], '', 'PX', ARGV[3])
+else
+    redis.call('DEL', KEYS[1])
+end
+if hotel == '' then
+    return false
+end
+return hotel
+""",
+)
+
+# <---------------Script releasing a lock only if it is still held by the caller---------------->
+# KEYS: lock key. ARGV: token
+RELEASE_LOCK = LuaScript(
+    "release_lock",
+    """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""",
+)
+
+SCRIPTS = [
+    RETRIEVE,
+    INDEX_BEGIN,
+    INDEX_ADD,
+    ALL_ADD,
+    INDEX_COMPLETE,
+    SUGGEST_ADD,
+    SUGGEST_STORE,
+    STORE_HOTEL,
+    NEARBY,
+    DELETE,
+    RELEASE_LOCK,
+]
+
+
+async def load_scripts(client):
+    """Load every script into the Redis script cache"""
+    for script in SCRIPTS:
+        await script.load(client)
+
+
+async def execute_with_scripts(client, queue, operation: str) -> list:
+    """
+    Build and execute a pipeline of script calls (and other commands)
+
+    A pipeline can not load a script halfway, so after a NOSCRIPT the scripts
+    are loaded and the whole pipeline is sent again. Only pipelines whose
+    commands can safely run twice are meant to go through here.
+
+    Args:
+        client: Redis client
+        queue: Called with the pipeline to queue its commands
+        operation: Label of the pipeline in the metrics
+    """
+    for attempt in range(2):
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                queue(pipe)
+                return await execute_pipeline(pipe, operation)
+        except NoScriptError:
+            if attempt:
+                raise
+            await load_scripts(client)
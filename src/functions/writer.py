@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Flush = Callable[[List[Dict[str, Any]]], Awaitable[Any]]
+Callback = Callable[[], Awaitable[Any]]
+
+
+class CacheWriter:
+    """
+    Write-behind queue populating Redis off the request path
+
+    Hotels are queued by id and the latest version wins, so a hotel written
+    several times before the worker gets to it is only stored once. The worker
+    flushes whenever max_batch hotels are waiting or max_delay seconds passed
+    since the first one of the batch was queued.
+
+    Callbacks queued with enqueue run once every hotel queued before them has
+    been flushed, which lets callers release a lock only when Redis has the data.
+
+    A hotel is tracked from the moment it is queued until the batch holding it
+    has been stored, so flush_hotel can make an update or delete wait for a
+    write that would otherwise land after it.
+
+    While the worker is not running (scripts, tests without a lifespan) writes
+    are flushed inline, so nothing is ever left sitting in the queue.
+    """
+
+    def __init__(
+        self,
+        flush: Flush,
+        max_batch: int = 1000,
+        max_delay: float = 0.05,
+        maxsize: int = 100_000,
+    ):
+        self._flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "asyncio.Queue[Optional[tuple]]" = asyncio.Queue(maxsize)
+        self._pending: Dict[Hashable, Dict[str, Any]] = {}
+        # Ids of the hotels being stored, to the write storing them
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "depth": len(self._pending),
+            "queued": self._queue.qsize(),
+            "flushed": self.flushed,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    # <---------------Function to queue hotels for the background worker---------------->
+    async def enqueue(
+        self, hotels: Iterable[Dict[str, Any]], callback: Optional[Callback] = None
+    ):
+        """
+        Queue hotels to be stored, returning without waiting for Redis
+
+        Args:
+            hotels: Hotel dictionaries, identified by their "id"
+            callback: Awaited after these hotels have been flushed
+        """
+        if not self.running:
+            hotels = list(hotels)
+            try:
+                if hotels:
+                    await self._store(hotels)
+            finally:
+                if callback is not None:
+                    await callback()
+            return
+
+        for hotel in hotels:
+            if hotel["id"] in self._pending:
+                self.coalesced += 1
+            else:
+                # Blocks only when the queue is full, slowing writers down
+                # instead of growing without bound
+                await self._queue.put(("hotel", hotel["id"]))
+            self._pending[hotel["id"]] = hotel
+        if callback is not None:
+            await self._queue.put(("callback", callback))
+
+    async def flush_hotel(self, hotel_id: Hashable):
+        """
+        Get every queued version of a hotel into Redis before it is changed
+
+        Waits for the batch being stored with the hotel, if any, then stores a
+        version still waiting in the queue.
+        """
+        in_flight = self._in_flight.get(hotel_id)
+        if in_flight is not None:
+            await asyncio.shield(in_flight)
+        hotel = self._pending.pop(hotel_id, None)
+        if hotel is not None:
+            await self._store([hotel])
+            self.flushed += 1
+
+    async def _store(self, batch: List[Dict[str, Any]]):
+        # Registered before the first await, a hotel leaves _pending and enters
+        # _in_flight at once
+        done = asyncio.get_running_loop().create_future()
+        for hotel in batch:
+            self._in_flight[hotel["id"]] = done
+        try:
+            await self._flush(batch)
+        finally:
+            for hotel in batch:
+                if self._in_flight.get(hotel["id"]) is done:
+                    del self._in_flight[hotel["id"]]
+            done.set_result(None)
+
+    # <---------------Worker loop draining the queue in bounded batches---------------->
+    def start(self):
+        if not self.running:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Flush what is still queued, then stop the worker"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(self._worker, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Cache writer stopped with %d hotels queued", len(self))
+        self._worker = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            items = [item]
+            hotels = 1 if item[0] == "hotel" else 0
+            deadline = time.monotonic() + self.max_delay
+            while hotels < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                items.append(item)
+                hotels += item[0] == "hotel"
+
+            await self._write(items)
+
+    async def _write(self, items: List[tuple]):
+        batch, callbacks = [], []
+        for kind, value in items:
+            if kind == "callback":
+                callbacks.append(value)
+                continue
+            # Missing when already coalesced into an earlier batch or flushed inline
+            hotel = self._pending.pop(value, None)
+            if hotel is not None:
+                batch.append(hotel)
+
+        try:
+            if batch:
+                await self._store(batch)
+                self.flushed += len(batch)
+                self.batches += 1
+        except Exception:
+            # The cache is only a copy, the next miss stores these hotels again
+            self.errors += 1
+            logger.exception("Cache writer failed to store %d hotels", len(batch))
+
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception:
+                self.errors += 1
+                logger.exception("Cache writer callback failed")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
@@ -10,6 +10,8 @@ class HotelCreate(BaseModel):
     state: str
     city: str
     area: str
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
 
 
 class Hotel(BaseModel):
@@ -21,6 +23,8 @@ class Hotel(BaseModel):
     state: str
     city: str
     area: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
     class Config:
         orm_mode = True
@@ -1,18 +1,23 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from routes.root import router as root_router
 from models.hotel import Base
-from configs.connect import engine
-from fastapi.middleware.cors import CORSMiddleware
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-    allow_credentials=True,
+from configs.connect import APPLICATION_NAME, engine, AsyncSessionLocal, dispose_engines
+from configs.redis_pool import open_redis, close_redis
+from queries.location_cache import location_cache
+from queries.change_feed import CHANGE_FEED, install_change_triggers
+from queries.query import reconcile_hotel_read
+from queries.schema import install_read_triggers, upgrade_schema
+from functions import l1
+from functions.func import (
+    cache_writer,
+    change_feed,
+    load_redis_scripts,
+    run_invalidation_listener,
 )
+from fastapi.middleware.cors import CORSMiddleware
+from utils.timing import RequestTimingMiddleware
 
 
 async def init_db():
@@ -20,11 +25,76 @@ async def init_db():
         await conn.run_sync(
             Base.metadata.create_all
         )  # Use run_sync to execute synchronously
+        # Changes create_all does not make to tables that already exist
+        await upgrade_schema(conn)
+        await install_read_triggers(conn, APPLICATION_NAME)
+
+
+async def install_change_feed():
+    # Triggers notifying the listener of writes made outside the API
+    async with engine.begin() as conn:
+        await install_change_triggers(conn, APPLICATION_NAME)
+
 
+async def sync_hotel_read():
+    # Rows written before the read table or its triggers existed
+    async with AsyncSessionLocal() as db:
+        await reconcile_hotel_read(db)
 
-@app.on_event("startup")
-async def startup_event():
+
+async def warm_location_cache():
+    async with AsyncSessionLocal() as db:
+        await location_cache.warm(db)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     await init_db()
+    if CHANGE_FEED:
+        await install_change_feed()
+    await sync_hotel_read()
+    await open_redis()
+    await warm_location_cache()
+    await load_redis_scripts()
+
+    # Drains the write-behind queue filling Redis off the request path
+    cache_writer.start()
+
+    # Applies writes made by migrations, manual SQL or other services
+    if CHANGE_FEED:
+        change_feed.start()
+
+    # Only needed when the in-process L1 cache is turned on
+    listener = None
+    if l1.enabled():
+        listener = asyncio.create_task(run_invalidation_listener())
+
+    yield
+
+    if listener is not None:
+        listener.cancel()
+    await change_feed.stop()
+
+    # Flush what is still queued before the process exits
+    await cache_writer.stop()
+
+    # Close the pools last, the writer still needs Redis while it drains
+    await close_redis()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+    allow_credentials=True,
+)
+
+# Server-Timing for sampled requests and a log line for slow ones
+app.add_middleware(RequestTimingMiddleware)
 
 
 # Include the routers defined in your route files
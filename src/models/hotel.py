@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Float, Index, Integer, String, ForeignKey, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -12,6 +12,8 @@ class Hotel(Base):
     name = Column(String)
     description = Column(String)
     streetaddress = Column(String)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
 
     country_id = Column(Integer, ForeignKey("Country.id"), index=True)
     state_id = Column(Integer, ForeignKey("State.id"), index=True)
@@ -25,29 +27,69 @@ class Hotel(Base):
     area = relationship("Area")
 
 
+# Hotels with their location names inline, kept in sync with hotels on every
+# write, by the API itself or by the triggers of queries/schema.py. Reads are
+# served from here as single table index scans instead of a four way join.
+class HotelRead(Base):
+    __tablename__ = "hotel_read"
+
+    id = Column(Integer, ForeignKey("hotels.id", ondelete="CASCADE"), primary_key=True)
+    name = Column(String)
+    description = Column(String)
+    streetaddress = Column(String)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+
+    # Names are only returned, filters resolve them to ids and use the id columns
+    country = Column(String)
+    state = Column(String)
+    city = Column(String)
+    area = Column(String)
+
+    country_id = Column(Integer, index=True)
+    state_id = Column(Integer, index=True)
+    city_id = Column(Integer, index=True)
+    area_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        # Queries filtering on several locations at once are served by one
+        # composite index instead of intersecting the single column ones
+        Index("ix_hotel_read_location", "country_id", "state_id", "city_id", "area_id"),
+        # Prefix search for autocomplete, lower(name) LIKE 'abc%'
+        Index(
+            "ix_hotel_read_name_prefix",
+            func.lower(name).label("name_lower"),
+            postgresql_ops={"name_lower": "text_pattern_ops"},
+        ),
+        # Bounding box range scans for proximity search
+        Index("ix_hotel_read_lat_lon", "latitude", "longitude"),
+    )
+
+
 class Country(Base):
     __tablename__ = "Country"
 
     id = Column(Integer, primary_key=True, index=True)
-    country = Column(String, nullable=False)
+    country = Column(String, nullable=False, unique=True)
 
 
 class State(Base):
     __tablename__ = "State"
 
     id = Column(Integer, primary_key=True, index=True)
-    state = Column(String, nullable=False)
+    state = Column(String, nullable=False, unique=True)
 
 
 class City(Base):
     __tablename__ = "City"
 
     id = Column(Integer, primary_key=True, index=True)
-    city = Column(String, nullable=False)
+    city = Column(String, nullable=False, unique=True)
 
 
 class Area(Base):
     __tablename__ = "Area"
 
     id = Column(Integer, primary_key=True, index=True)
-    area = Column(String, nullable=False)  # fixed capitalization to match Python style
+    # fixed capitalization to match Python style
+    area = Column(String, nullable=False, unique=True)
@@ -0,0 +1,120 @@
+import os
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from models.hotel import Hotel, Country, State, City, Area
+from queries.schema import create_trigger
+
+# On by default, turning it off leaves external writes to the Redis TTL
+CHANGE_FEED = os.getenv("CHANGE_FEED", "1").lower() in ("1", "true", "yes")
+CHANGE_CHANNEL = "hotel_changes"
+NOTIFY_CHUNK = 500  # ids per notification, payloads are capped at 8000 bytes
+NOTIFY_OLD_CHUNK = 100  # hotels per notification of the locations they left
+
+# Hotels are synced on every write, locations only when renamed or removed,
+# new location names are picked up by the location cache on their own
+WATCHED_TABLES = {
+    Hotel.__tablename__: ("INSERT", "UPDATE", "DELETE"),
+    Country.__tablename__: ("UPDATE", "DELETE"),
+    State.__tablename__: ("UPDATE", "DELETE"),
+    City.__tablename__: ("UPDATE", "DELETE"),
+    Area.__tablename__: ("UPDATE", "DELETE"),
+}
+
+# Statement level, so a migration touching a million rows sends one
+# notification per NOTIFY_CHUNK ids rather than one per row. Notifications are
+# only delivered on commit and identical ones are folded by Postgres.
+#
+# Hotels that were deleted or moved to another location are also sent as
+# "old": [[id, country_id, state_id, city_id, area_id], ...], the location they
+# were in before. By the time the notification arrives hotel_read only knows
+# the new one, and the hotel has to leave the index sets of the old one.
+NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION notify_hotel_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids integer[];
+    old json[];
+BEGIN
+    -- The API keeps Redis in sync with its own writes
+    IF current_setting('application_name') = TG_ARGV[0] THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id ORDER BY id) INTO ids FROM old_rows;
+    ELSE
+        SELECT array_agg(id ORDER BY id) INTO ids FROM new_rows;
+    END IF;
+
+    FOR i IN 1 .. coalesce(array_length(ids, 1), 0) BY {NOTIFY_CHUNK} LOOP
+        PERFORM pg_notify(
+            '{CHANGE_CHANNEL}',
+            json_build_object(
+                'table', TG_TABLE_NAME,
+                'ids', ids[i : i + {NOTIFY_CHUNK - 1}]
+            )::text
+        );
+    END LOOP;
+
+    IF TG_TABLE_NAME = '{Hotel.__tablename__}' AND TG_OP <> 'INSERT' THEN
+        IF TG_OP = 'DELETE' THEN
+            SELECT array_agg(
+                json_build_array(o.id, o.country_id, o.state_id, o.city_id, o.area_id)
+                ORDER BY o.id
+            ) INTO old FROM old_rows o;
+        ELSE
+            SELECT array_agg(
+                json_build_array(o.id, o.country_id, o.state_id, o.city_id, o.area_id)
+                ORDER BY o.id
+            ) INTO old
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE (o.country_id, o.state_id, o.city_id, o.area_id)
+                IS DISTINCT FROM (n.country_id, n.state_id, n.city_id, n.area_id);
+        END IF;
+
+        FOR i IN 1 .. coalesce(array_length(old, 1), 0) BY {NOTIFY_OLD_CHUNK} LOOP
+            PERFORM pg_notify(
+                '{CHANGE_CHANNEL}',
+                json_build_object(
+                    'table', TG_TABLE_NAME,
+                    'ids', '[]'::json,
+                    'old', to_json(old[i : i + {NOTIFY_OLD_CHUNK - 1}])
+                )::text
+            );
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+# <---------------Function to (re)install the change feed triggers---------------->
+async def install_change_triggers(conn: AsyncConnection, application_name: str):
+    """
+    Create the triggers notifying CHANGE_CHANNEL of writes made outside the API
+
+    Idempotent, every worker runs it at startup.
+
+    Args:
+        conn: Connection with an open transaction
+        application_name: Sessions with this name do not notify
+    """
+    # Workers starting together would otherwise replace the function concurrently
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:channel))"),
+        {"channel": CHANGE_CHANNEL},
+    )
+    await conn.execute(text(NOTIFY_FUNCTION))
+
+    # A trigger with transition tables can only fire on one kind of event
+    argument = application_name.replace("'", "''")
+    for table, operations in WATCHED_TABLES.items():
+        for operation in operations:
+            await create_trigger(
+                conn,
+                f"{table.lower()}_notify_{operation.lower()}",
+                table,
+                operation,
+                f"notify_hotel_changes('{argument}')",
+            )
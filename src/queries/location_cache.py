@@ -0,0 +1,106 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+from models.hotel import Country, State, City, Area
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Location tables and the column holding their name
+LOCATION_MODELS = {
+    Country: "country",
+    State: "state",
+    City: "city",
+    Area: "area",
+}
+
+STAGED_KEY = "staged_locations"
+
+
+class LocationCache:
+    """
+    Process wide name <-> id maps for the Country/State/City/Area tables
+
+    The API never renames or deletes location rows, so an entry can only
+    become missing. A worker that has not seen a name yet falls back to the
+    database once and keeps the id from then on, which keeps workers coherent
+    without any cross process invalidation. Renames made outside the API
+    reload the cache through the change feed, see queries/change_feed.py.
+
+    Ids created inside a transaction are staged on the session and only
+    published once that transaction commits, so a rollback can not leave
+    dangling ids behind.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, Dict[str, int]] = {
+            model.__tablename__: {} for model in LOCATION_MODELS
+        }
+        self._names: Dict[str, Dict[int, str]] = {
+            model.__tablename__: {} for model in LOCATION_MODELS
+        }
+
+    async def warm(self, db: AsyncSession):
+        """Load every location table into the cache"""
+        for model, name_field in LOCATION_MODELS.items():
+            result = await db.execute(select(model.id, getattr(model, name_field)))
+            rows = result.all()
+            self._ids[model.__tablename__] = {name: id for id, name in rows}
+            self._names[model.__tablename__] = {id: name for id, name in rows}
+
+    def id_of(self, model, value: str) -> Optional[int]:
+        """Look a committed name up, without touching any session"""
+        return self._ids[model.__tablename__].get(value)
+
+    def name_of(self, model, id: int) -> Optional[str]:
+        """Look the name of a committed location id up"""
+        return self._names[model.__tablename__].get(id)
+
+    def get(self, db: AsyncSession, model, value: str) -> Optional[int]:
+        """Look a name up in the shared cache, then in the session's staged ids"""
+        id = self._ids[model.__tablename__].get(value)
+        if id is None:
+            id = db.info.get(STAGED_KEY, {}).get((model.__tablename__, value))
+        return id
+
+    def get_many(
+        self, db: AsyncSession, model, values: Iterable[str]
+    ) -> Tuple[Dict[str, int], List[str]]:
+        """Split names into the ones already known and the ones that are missing"""
+        ids, missing = {}, []
+        for value in values:
+            id = self.get(db, model, value)
+            if id is None:
+                missing.append(value)
+            else:
+                ids[value] = id
+        return ids, missing
+
+    def add(self, model, value: str, id: int):
+        """Publish an id for a row that is already committed"""
+        self._ids[model.__tablename__][value] = id
+        self._names[model.__tablename__][id] = value
+
+    def stage(self, db: AsyncSession, model, value: str, id: int):
+        """Remember an id created by the session's open transaction"""
+        db.info.setdefault(STAGED_KEY, {})[(model.__tablename__, value)] = id
+
+    def publish(self, staged: Dict[Tuple[str, str], int]):
+        for (table, value), id in staged.items():
+            self._ids[table][value] = id
+            self._names[table][id] = value
+
+
+location_cache = LocationCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_staged_locations(session):
+    staged = session.info.pop(STAGED_KEY, None)
+    if staged:
+        location_cache.publish(staged)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_staged_locations(session, previous_transaction):
+    session.info.pop(STAGED_KEY, None)
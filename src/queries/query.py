@@ -1,74 +1,341 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from models.hotel import Hotel, Country, State, City, Area
+from models.hotel import Hotel, HotelRead, Country, State, City, Area
+from queries.location_cache import LOCATION_MODELS, location_cache
+from utils.metrics import timed_query
 from interfaces.pydantic import HotelCreate, HotelUpdate
-from typing import Optional
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import math
+from sqlalchemy import (
+    RowMapping,
+    String,
+    delete,
+    func,
+    insert,
+    literal,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload
+
+
+LOCATION_ID_FIELDS = ("country_id", "state_id", "city_id", "area_id")
+
+# Reads are plain Core selects of these columns, each row is a RowMapping that
+# already has the response shape, without ORM objects or an identity map
+hotel_read = HotelRead.__table__
+HOTEL_COLUMNS = [
+    hotel_read.c[name]
+    for name in (
+        "id",
+        "name",
+        "description",
+        "streetaddress",
+        "latitude",
+        "longitude",
+        "country",
+        "state",
+        "city",
+        "area",
+    )
+]
+# Columns of hotel_read, in the order the insert paths fill them
+HOTEL_READ_FIELDS = [column.name for column in HOTEL_COLUMNS] + list(LOCATION_ID_FIELDS)
+EARTH_RADIUS_KM = 6372.797560856  # the radius Redis GEO commands use
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
 
 
 # <-----------Insert Query----------------------->
-async def insert_hotel(db: AsyncSession, hotel: HotelCreate) -> Hotel:
-    # Get or create location IDs
+@timed_query
+async def insert_hotel(db: AsyncSession, hotel: HotelCreate) -> RowMapping:
+    # Get or create location IDs, known names cost no round trip
     country_id = await get_or_create_location(db, Country, "country", hotel.country)
     state_id = await get_or_create_location(db, State, "state", hotel.state)
     city_id = await get_or_create_location(db, City, "city", hotel.city)
     area_id = await get_or_create_location(db, Area, "area", hotel.area)
 
-    new_hotel = Hotel(
-        name=hotel.name,
-        description=hotel.description,
-        streetaddress=hotel.streetaddress,
-        country_id=country_id,
-        state_id=state_id,
-        city_id=city_id,
-        area_id=area_id,
+    # One statement writes the hotel and its read row and returns the response
+    new_hotel = (
+        insert(Hotel)
+        .values(
+            name=hotel.name,
+            description=hotel.description,
+            streetaddress=hotel.streetaddress,
+            latitude=hotel.latitude,
+            longitude=hotel.longitude,
+            country_id=country_id,
+            state_id=state_id,
+            city_id=city_id,
+            area_id=area_id,
+        )
+        .returning(*Hotel.__table__.c)
+        .cte("new_hotel")
     )
 
-    db.add(new_hotel)
+    # The read row copies the new hotel, with the location names as given
+    names = {
+        field: literal(getattr(hotel, field), String)
+        for field in ("country", "state", "city", "area")
+    }
+    read_row = select(
+        *(
+            names[name] if name in names else new_hotel.c[name]
+            for name in HOTEL_READ_FIELDS
+        )
+    )
+    result = await db.execute(
+        insert(hotel_read)
+        .from_select(HOTEL_READ_FIELDS, read_row)
+        .returning(*HOTEL_COLUMNS)
+        .add_cte(new_hotel)
+    )
+    data = result.mappings().one()
     await db.commit()
-    await db.refresh(new_hotel)
 
+    return data
+
+
+# <------------------Function to check if country,state,city,area already in db, if not create it ------------------->
+async def get_or_create_location(db: AsyncSession, model, name_field: str, value: str):
+    # Known names are served from the in-process cache without a round trip
+    id = location_cache.get(db, model, value)
+    if id is not None:
+        return id
+
+    # Not cached, insert it and let the unique index settle concurrent creators
+    column = getattr(model, name_field)
+    result = await db.execute(
+        pg_insert(model)
+        .values({name_field: value})
+        .on_conflict_do_nothing(index_elements=[column])
+        .returning(model.id)
+    )
+    id = result.scalar_one_or_none()
+    if id is not None:
+        location_cache.stage(db, model, value, id)
+        return id
+
+    # Someone else created it first, read back the committed row
+    result = await db.execute(select(model.id).where(column == value))
+    id = result.scalar_one()
+    location_cache.add(model, value, id)
+    return id
+
+
+# <-----------Bulk Insert Query----------------------->
+@timed_query
+async def bulk_insert_hotels(db: AsyncSession, hotels: List[HotelCreate]) -> List[dict]:
+    # Runs in the caller's transaction, a request inserting many batches commits
+    # them all at once
+    # Resolve every distinct location name with one set based statement per table
+    country_ids = await get_or_create_locations(
+        db, Country, "country", {hotel.country for hotel in hotels}
+    )
+    state_ids = await get_or_create_locations(
+        db, State, "state", {hotel.state for hotel in hotels}
+    )
+    city_ids = await get_or_create_locations(
+        db, City, "city", {hotel.city for hotel in hotels}
+    )
+    area_ids = await get_or_create_locations(
+        db, Area, "area", {hotel.area for hotel in hotels}
+    )
+
+    rows = [
+        {
+            "name": hotel.name,
+            "description": hotel.description,
+            "streetaddress": hotel.streetaddress,
+            "latitude": hotel.latitude,
+            "longitude": hotel.longitude,
+            "country_id": country_ids[hotel.country],
+            "state_id": state_ids[hotel.state],
+            "city_id": city_ids[hotel.city],
+            "area_id": area_ids[hotel.area],
+        }
+        for hotel in hotels
+    ]
+
+    # Multi-row INSERT ... RETURNING, ids come back in the order of the input rows
     result = await db.execute(
-        select(Hotel)
-        .where(Hotel.id == new_hotel.id)
-        .options(
-            joinedload(Hotel.country),
-            joinedload(Hotel.state),
-            joinedload(Hotel.city),
-            joinedload(Hotel.area),
+        insert(Hotel).returning(Hotel.id, sort_by_parameter_order=True), rows
+    )
+    ids = result.scalars().all()
+
+    # The names are already known, so the read rows and the response are built
+    # without a reselect
+    data = [
+        {
+            "id": hotel_id,
+            "name": hotel.name,
+            "description": hotel.description,
+            "streetaddress": hotel.streetaddress,
+            "latitude": hotel.latitude,
+            "longitude": hotel.longitude,
+            "country": hotel.country,
+            "state": hotel.state,
+            "city": hotel.city,
+            "area": hotel.area,
+        }
+        for hotel_id, hotel in zip(ids, hotels)
+    ]
+    await db.execute(
+        insert(HotelRead),
+        [
+            {**hotel, **{field: row[field] for field in LOCATION_ID_FIELDS}}
+            for hotel, row in zip(data, rows)
+        ],
+    )
+
+    return data
+
+
+# <------------------Function to resolve many location names at once, creating the missing ones ------------------->
+async def get_or_create_locations(
+    db: AsyncSession, model, name_field: str, values: Iterable[str]
+) -> Dict[str, int]:
+    ids, missing = location_cache.get_many(db, model, values)
+    if not missing:
+        return ids
+
+    # One multi-row upsert for every name the cache does not know yet
+    column = getattr(model, name_field)
+    result = await db.execute(
+        pg_insert(model)
+        .values([{name_field: value} for value in missing])
+        .on_conflict_do_nothing(index_elements=[column])
+        .returning(model.id, column)
+    )
+    for id, name in result.all():
+        location_cache.stage(db, model, name, id)
+        ids[name] = id
+
+    # Rows that conflicted were created by someone else, read them back in one go
+    conflicted = [value for value in missing if value not in ids]
+    if conflicted:
+        result = await db.execute(
+            select(model.id, column).where(column.in_(conflicted))
+        )
+        for id, name in result.all():
+            location_cache.add(model, name, id)
+            ids[name] = id
+
+    return ids
+
+
+def hotel_read_source():
+    """Hotels joined to their location names, in HOTEL_READ_FIELDS order"""
+    return (
+        select(
+            Hotel.id,
+            Hotel.name,
+            Hotel.description,
+            Hotel.streetaddress,
+            Hotel.latitude,
+            Hotel.longitude,
+            Country.country,
+            State.state,
+            City.city,
+            Area.area,
+            Hotel.country_id,
+            Hotel.state_id,
+            Hotel.city_id,
+            Hotel.area_id,
         )
+        .join(Country, Hotel.country_id == Country.id)
+        .join(State, Hotel.state_id == State.id)
+        .join(City, Hotel.city_id == City.id)
+        .join(Area, Hotel.area_id == Area.id)
     )
-    hotel = result.scalar_one_or_none()
 
-    return {
-        "id": hotel.id,
-        "name": hotel.name,
-        "description": hotel.description,
-        "streetaddress": hotel.streetaddress,
-        "country": hotel.country.country,  # Fetching the name from the related Country table
-        "state": hotel.state.state,  # Fetching the name from the related State table
-        "city": hotel.city.city,  # Fetching the name from the related City table
-        "area": hotel.area.area,  # Fetching the name from the related Area table
-    }
+
+# <-------------------Function to bring the read table in line with hotels---------------------------->
+@timed_query
+async def reconcile_hotel_read(db: AsyncSession) -> int:
+    """
+    Copy hotels whose read row is missing or differs, e.g. written before
+    hotel_read or its triggers existed, a no-op once it is in sync
+
+    Returns:
+        The number of read rows written
+    """
+    read_fields = [HotelRead.__table__.c[field] for field in HOTEL_READ_FIELDS]
+    rows = hotel_read_source().outerjoin(HotelRead, HotelRead.id == Hotel.id)
+    rows = rows.where(
+        tuple_(*rows.selected_columns).is_distinct_from(tuple_(*read_fields))
+    )
+    upsert = pg_insert(HotelRead).from_select(HOTEL_READ_FIELDS, rows)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[HotelRead.id],
+        set_={field: upsert.excluded[field] for field in HOTEL_READ_FIELDS[1:]},
+    )
+    result = await db.execute(upsert)
+    await db.commit()
+    return result.rowcount
 
 
-# <------------------Function to check if country,state,city,area already in db, if not create it ------------------->
-async def get_or_create_location(db: AsyncSession, model, name_field: str, value: str):
-    stmt = select(model).where(getattr(model, name_field) == value)
-    result = await db.execute(stmt)
-    instance = result.scalar_one_or_none()
+# <-------------------Query to read hotels by id from the read table---------------------------->
+@timed_query
+async def get_hotels_by_ids(
+    db: AsyncSession, hotel_ids: Iterable[int]
+) -> List[RowMapping]:
+    """The given hotels that exist, in response shape"""
+    query = select(*HOTEL_COLUMNS).where(hotel_read.c.id.in_(list(hotel_ids)))
+    result = await db.execute(query)
+    return result.mappings().all()
 
-    if instance:
-        return instance.id
 
-    # Not found, create new entry
-    new_instance = model(**{name_field: value})
-    db.add(new_instance)
-    await db.flush()  # Gets the ID without commit
-    return new_instance.id
+# <-------------------Function to resolve location names to ids---------------------------->
+@timed_query
+async def resolve_location_ids(
+    db: AsyncSession,
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+) -> Optional[Dict[str, int]]:
+    """
+    Turn the location filters into id filters, from the cache when possible
+
+    Returns:
+        {"country_id": ..., ...} for the given names, or None when one of them
+        does not exist, in which case nothing can match
+    """
+    ids = {}
+    for field, model, value in (
+        ("country", Country, country),
+        ("state", State, state),
+        ("city", City, city),
+        ("area", Area, area),
+    ):
+        if not value:
+            continue
+        id = location_cache.get(db, model, value)
+        if id is None:
+            # Possibly created by another worker, one unique index lookup
+            column = getattr(model, field)
+            result = await db.execute(select(model.id).where(column == value))
+            id = result.scalar_one_or_none()
+            if id is None:
+                return None
+            location_cache.add(model, value, id)
+        ids[f"{field}_id"] = id
+    return ids
+
+
+# <-------------------Function to apply the location filters to a hotel query---------------------------->
+def filter_hotels(query, location_ids: Dict[str, int], hotel_id: Optional[int] = None):
+    # Every given filter narrows the result, they are combined with AND and
+    # compared on the indexed id columns
+    if hotel_id:
+        query = query.where(hotel_read.c.id == hotel_id)
+    for field, id in location_ids.items():
+        query = query.where(hotel_read.c[field] == id)
+    return query
 
 
 # <-------------------Query to retrive hotel from filters---------------------------->
+@timed_query
 async def get_hotel(
     db: AsyncSession,
     country: Optional[str] = None,
@@ -76,130 +343,310 @@ async def get_hotel(
     city: Optional[str] = None,
     area: Optional[str] = None,
     hotel_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
 ):
-    if hotel_id:
-        # If hotel_id is provided, return specific hotel
+    location_ids = await resolve_location_ids(db, country, state, city, area)
+    if location_ids is None:
+        return []  # an unknown location name matches nothing
+
+    query = filter_hotels(select(*HOTEL_COLUMNS), location_ids, hotel_id)
+
+    # Keyset pagination on the primary key, deep pages cost the same as the first
+    query = query.order_by(hotel_read.c.id)
+    if cursor is not None:
+        query = query.where(hotel_read.c.id > cursor)
+    if limit is not None:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return result.mappings().all()
+
+
+# <-------------------Query to find hotel and location names by prefix---------------------------->
+@timed_query
+async def suggest_names(db: AsyncSession, prefix: str, limit: int) -> List[dict]:
+    prefix = " ".join(prefix.lower().split())
+    suggestions = []
+
+    # lower(name) LIKE 'prefix%' uses ix_hotel_read_name_prefix, the location
+    # tables are small enough to scan
+    for kind, model, column in (
+        ("hotel", HotelRead, HotelRead.name),
+        ("country", Country, Country.country),
+        ("state", State, State.state),
+        ("city", City, City.city),
+        ("area", Area, Area.area),
+    ):
         result = await db.execute(
-            select(Hotel)
-            .where(Hotel.id == hotel_id)
-            .options(
-                joinedload(Hotel.country),
-                joinedload(Hotel.state),
-                joinedload(Hotel.city),
-                joinedload(Hotel.area),
-            )
+            select(model.id, column)
+            .where(func.lower(column).startswith(prefix, autoescape=True))
+            .order_by(func.lower(column))
+            .limit(limit)
         )
-        hotel = result.scalar_one_or_none()
-        if hotel:
-            # Return the hotel with names for country, state, city, area
-            return {
-                "id": hotel.id,
-                "name": hotel.name,
-                "description": hotel.description,
-                "streetaddress": hotel.streetaddress,
-                "country": hotel.country.country,  # Fetching the name from the related Country table
-                "state": hotel.state.state,  # Fetching the name from the related State table
-                "city": hotel.city.city,  # Fetching the name from the related City table
-                "area": hotel.area.area,  # Fetching the name from the related Area table
-            }
-        return None
-
-    else:
-        # If no hotel_id is provided, apply filters
-        query = select(Hotel).options(
-            joinedload(Hotel.country),
-            joinedload(Hotel.state),
-            joinedload(Hotel.city),
-            joinedload(Hotel.area),
-        )
-
-        if country:
-            query = query.where(Hotel.country.has(Country.country == country))
-        if state:
-            query = query.where(Hotel.state.has(State.state == state))
-        if city:
-            query = query.where(Hotel.city.has(City.city == city))
-        if area:
-            query = query.where(Hotel.area.has(Area.area == area))
-
-        result = await db.execute(query)
-        all_hotels = result.scalars().all()
-
-        hotels_with_names = []
-        for hotel in all_hotels:
-            hotels_with_names.append(
-                {
-                    "id": hotel.id,
-                    "name": hotel.name,
-                    "description": hotel.description,
-                    "streetaddress": hotel.streetaddress,
-                    "country": hotel.country.country,  # Fetching the name from the related Country table
-                    "state": hotel.state.state,  # Fetching the name from the related State table
-                    "city": hotel.city.city,  # Fetching the name from the related City table
-                    "area": hotel.area.area,  # Fetching the name from the related Area table
-                }
-            )
+        suggestions += [
+            {"type": kind, "id": id, "name": name} for id, name in result.all()
+        ]
+
+    suggestions.sort(key=lambda suggestion: suggestion["name"].lower())
+    return suggestions[:limit]
+
+
+# <-------------------Functions for the geometry of a radius search---------------------------->
+def bounding_box(
+    latitude: float, longitude: float, radius_km: float
+) -> Tuple[Tuple[float, float], Optional[Tuple[float, float]]]:
+    """
+    The (min, max) latitudes and longitudes of a box around a search circle
+
+    Returns:
+        The latitude range, and the longitude range or None when the box
+        wraps around the antimeridian or covers a pole, every longitude is
+        then kept
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    latitudes = (latitude - lat_delta, latitude + lat_delta)
+    if latitudes[0] <= -90 or latitudes[1] >= 90:
+        return latitudes, None  # the circle covers a pole
+
+    # Widest where the circle touches a meridian, asin(sin(r) / cos(lat)) away
+    # rather than r / cos(lat), which falls short at high latitudes
+    angle = radius_km / EARTH_RADIUS_KM
+    lon_delta = math.degrees(
+        math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude))))
+    )
+    if longitude - lon_delta < -180 or longitude + lon_delta > 180:
+        return latitudes, None
+    return latitudes, (longitude - lon_delta, longitude + lon_delta)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great circle distance, the same formula get_nearby_hotel runs in SQL"""
+    a = (
+        math.sin(math.radians(lat2 - lat1) / 2) ** 2
+        + math.cos(math.radians(lat1))
+        * math.cos(math.radians(lat2))
+        * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
 
-        return hotels_with_names
 
+# <-------------------Query to find hotels within a radius, nearest first---------------------------->
+@timed_query
+async def get_nearby_hotel(
+    db: AsyncSession,
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    limit: int,
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+) -> List[dict]:
+    location_ids = await resolve_location_ids(db, country, state, city, area)
+    if location_ids is None:
+        return []
+
+    # The bounding box is a range scan on ix_hotel_read_lat_lon, the exact great
+    # circle distance is only computed for the rows inside it
+    latitudes, longitudes = bounding_box(latitude, longitude, radius_km)
+    query = select(*HOTEL_COLUMNS).where(hotel_read.c.latitude.between(*latitudes))
+    if longitudes is not None:
+        query = query.where(hotel_read.c.longitude.between(*longitudes))
+    query = query.where(hotel_read.c.longitude.is_not(None))
+    cos_lat = math.cos(math.radians(latitude))
+
+    # Haversine, clamped so rounding can not push asin out of its domain
+    distance = (
+        2
+        * EARTH_RADIUS_KM
+        * func.asin(
+            func.least(
+                1.0,
+                func.sqrt(
+                    func.power(
+                        func.sin(func.radians(hotel_read.c.latitude - latitude) / 2), 2
+                    )
+                    + cos_lat
+                    * func.cos(func.radians(hotel_read.c.latitude))
+                    * func.power(
+                        func.sin(func.radians(hotel_read.c.longitude - longitude) / 2),
+                        2,
+                    )
+                ),
+            )
+        )
+    ).label("distance_km")
 
-# <---------------- query to update data ----------------------------------->
-async def update_hotels(db: AsyncSession, hotel_data: HotelUpdate) -> Optional[dict]:
-    result = await db.execute(select(Hotel).where(Hotel.id == hotel_data.id))
-    hotel = result.scalar_one_or_none()
+    query = (
+        filter_hotels(query.add_columns(distance), location_ids)
+        .where(distance <= radius_km)
+        .order_by(distance, hotel_read.c.id)
+        .limit(limit)
+    )
 
-    if not hotel:
-        return None
+    result = await db.execute(query)
+    return [
+        {**hotel, "distance_km": round(hotel["distance_km"], 3)}
+        for hotel in result.mappings()
+    ]
 
-    update_data = hotel_data.model_dump(exclude_unset=True)
-    update_data.pop("id", None)  # We don't want to update the ID
 
-    # Mapping for foreign key fields (name -> model -> field name)
-    fk_mappings = {
-        "country": (Country, "country"),
-        "state": (State, "state"),
-        "city": (City, "city"),
-        "area": (Area, "area"),
+# <-------------------Query to stream hotels from filters through a server side cursor---------------------------->
+async def stream_hotel(
+    db: AsyncSession,
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    cursor: Optional[int] = None,
+    batch_size: int = 1000,
+    until: Optional[int] = None,
+    hotel_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[RowMapping]:
+    location_ids = await resolve_location_ids(db, country, state, city, area)
+    if location_ids is None:
+        return
+
+    query = filter_hotels(select(*HOTEL_COLUMNS), location_ids, hotel_id)
+    query = query.order_by(hotel_read.c.id)
+    if cursor is not None:
+        query = query.where(hotel_read.c.id > cursor)
+    if until is not None:
+        query = query.where(hotel_read.c.id <= until)
+    if limit is not None:
+        query = query.limit(limit)
+
+    # yield_per keeps only one batch of rows in memory at a time
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for hotel in result.mappings():
+        yield hotel
+
+
+# <-------------------Query to stream the ids of hotels in one location---------------------------->
+async def stream_hotel_ids(
+    db: AsyncSession, location_ids: Dict[str, int], batch_size: int = 1000
+) -> AsyncIterator[int]:
+    """
+    Ids of every hotel matching the location id filters (all hotels when
+    empty), read from the location's index without touching the rows
+    """
+    query = filter_hotels(select(hotel_read.c.id), location_ids)
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for id in result.scalars():
+        yield id
+
+
+# <-------------------Query to stream the coordinates of every hotel---------------------------->
+async def stream_hotel_coordinates(
+    db: AsyncSession, batch_size: int = 1000
+) -> AsyncIterator[RowMapping]:
+    """Id, longitude and latitude of every hotel, None when it has no coordinates"""
+    query = select(hotel_read.c.id, hotel_read.c.longitude, hotel_read.c.latitude)
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for row in result.mappings():
+        yield row
+
+
+# <-------------------Query to stream every hotel and location name---------------------------->
+async def stream_names(
+    db: AsyncSession, batch_size: int = 1000
+) -> AsyncIterator[Tuple[str, int, str]]:
+    """(kind, id, name) of every named hotel, then of every location"""
+    query = select(hotel_read.c.id, hotel_read.c.name).where(
+        hotel_read.c.name.is_not(None)
+    )
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for id, name in result:
+        yield "hotel", id, name
+
+    # The location tables are small, read whole
+    for model, name_field in LOCATION_MODELS.items():
+        result = await db.execute(select(model.id, getattr(model, name_field)))
+        for id, name in result.all():
+            yield name_field, id, name
+
+
+# <-------------------Query to read the location ids of hotels---------------------------->
+@timed_query
+async def get_hotel_locations(
+    db: AsyncSession, hotel_ids: Iterable[int]
+) -> Dict[int, Dict[str, int]]:
+    """The {"country_id": ..., ...} of every given hotel that exists, by id"""
+    query = select(
+        hotel_read.c.id, *(hotel_read.c[field] for field in LOCATION_ID_FIELDS)
+    )
+    result = await db.execute(query.where(hotel_read.c.id.in_(list(hotel_ids))))
+    return {
+        row["id"]: {field: row[field] for field in LOCATION_ID_FIELDS}
+        for row in result.mappings()
     }
 
-    for field, (model, field_name) in fk_mappings.items():
-        if field in update_data:
-            value = update_data[field]
-            if value:
-                # Get the existing object if it exists, or create it
-                result = await db.execute(
-                    select(model).where(getattr(model, field_name) == value)
-                )
-                obj = result.scalar_one_or_none()
-
-                if not obj:
-                    obj = model(**{field_name: value})
-                    db.add(obj)
-                    await db.flush()  # Get the ID without committing
-
-                update_data[field] = obj.id
-            else:
-                # If value is None, remove the field from update_data
-                update_data.pop(field)
-
-    # Apply remaining non-foreign-key updates
-    for field, value in update_data.items():
-        setattr(hotel, field, value)
 
+# <---------------- query to update data ----------------------------------->
+@timed_query
+async def update_hotels(
+    db: AsyncSession, hotel_data: HotelUpdate
+) -> Optional[RowMapping]:
+    """
+    Update the simple fields of a hotel and its read row in one statement
+
+    Returns:
+        The updated hotel, or None if it does not exist
+
+    Raises:
+        ValueError: If no field to update is given
+    """
+    update_data = hotel_data.model_dump(exclude_unset=True)
+    update_data.pop("id", None)  # We don't want to update the ID
+    if not update_data:
+        raise ValueError("No valid fields provided for update")
+
+    updated = (
+        update(Hotel)
+        .where(Hotel.id == hotel_data.id)
+        .values(update_data)
+        .returning(Hotel.id)
+        .cte("updated_hotel")
+    )
+    result = await db.execute(
+        update(hotel_read)
+        .where(hotel_read.c.id == updated.c.id)
+        .values(update_data)
+        .returning(*HOTEL_COLUMNS)
+        .add_cte(updated)
+    )
+    data = result.mappings().one_or_none()
     await db.commit()
-    await db.refresh(hotel)
 
-    return hotel.id, update_data
+    return data
 
 
 # <-----------------------query to delete hotel --------------->
-async def delete_hotel(db: AsyncSession, hotel_id: int) -> bool:
-    result = await db.execute(select(Hotel).where(Hotel.id == hotel_id))
-    hotel = result.scalar_one_or_none()
-
-    if hotel is None:
-        return False  # Hotel not found
-
-    await db.delete(hotel)
+@timed_query
+async def delete_hotel(db: AsyncSession, hotel_id: int) -> Optional[RowMapping]:
+    """
+    Delete a hotel and its read row in one statement
+
+    Returns:
+        The deleted hotel with its location ids, or None if it did not exist
+    """
+    # The read row is removed by the same statement, ON DELETE CASCADE is only
+    # a safety net for hotels deleted elsewhere
+    deleted = (
+        delete(Hotel)
+        .where(Hotel.id == hotel_id)
+        .returning(Hotel.id)
+        .cte("deleted_hotel")
+    )
+    result = await db.execute(
+        delete(hotel_read)
+        .where(hotel_read.c.id == deleted.c.id)
+        .returning(*HOTEL_COLUMNS, *(hotel_read.c[f] for f in LOCATION_ID_FIELDS))
+        .add_cte(deleted)
+    )
+    data = result.mappings().one_or_none()
     await db.commit()
-    return True
+    return data
@@ -0,0 +1,252 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from models.hotel import Base, Hotel, HotelRead
+from queries.location_cache import LOCATION_MODELS
+from queries.query import HOTEL_READ_FIELDS
+
+# create_all only creates missing tables, it never changes existing ones. The
+# statements below bring a database created by an older version up to date,
+# each of them is a no-op once applied.
+
+
+# <---------------Function to upgrade an existing database in place---------------->
+async def upgrade_schema(conn: AsyncConnection):
+    """
+    Apply the schema changes create_all can not make to existing tables
+
+    Idempotent, every worker runs it at startup right after create_all.
+
+    Args:
+        conn: Connection with an open transaction
+    """
+    # Workers starting together would otherwise run the same DDL concurrently
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('upgrade_schema'))"))
+
+    await add_missing_columns(conn)
+    await conn.run_sync(create_missing_indexes)
+    for model, name_field in LOCATION_MODELS.items():
+        await add_unique_location_index(conn, model, name_field)
+
+
+# <---------------Function to add the columns of newer versions---------------->
+async def add_missing_columns(conn: AsyncConnection):
+    """
+    ALTER TABLE ... ADD COLUMN IF NOT EXISTS for every model column an existing
+    table lacks, e.g. the latitude and longitude of hotels and hotel_read
+
+    Only nullable columns without a foreign key can be added this way, which
+    is what every column added so far is. Tables already up to date are not
+    altered, so no lock is taken on them.
+    """
+    result = await conn.execute(
+        text(
+            """
+            SELECT table_name, column_name FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            """
+        )
+    )
+    existing = set(result.all())
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if (table.name, column.name) in existing:
+                continue
+            if not column.nullable or column.foreign_keys:
+                raise RuntimeError(
+                    f"Column {table.name}.{column.name} can not be added in place"
+                )
+            column_type = column.type.compile(dialect=conn.dialect)
+            await conn.execute(
+                text(
+                    f'ALTER TABLE "{table.name}" '
+                    f'ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                )
+            )
+
+
+def create_missing_indexes(conn):
+    # Indexes of the models that an older version did not create, checkfirst
+    # skips the ones that exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# <---------------Function to make location names unique---------------->
+async def add_unique_location_index(conn: AsyncConnection, model, name_field: str):
+    """
+    Merge duplicate location rows and add the unique index the ON CONFLICT
+    upserts of get_or_create_location(s) rely on
+
+    Hotels pointing at a duplicate are moved to the row with the lowest id
+    before the other rows are deleted.
+    """
+    table = model.__tablename__
+    exists = await conn.execute(
+        text(
+            """
+            SELECT 1 FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indrelid = CAST(:table AS regclass)
+              AND i.indisunique AND i.indnatts = 1 AND a.attname = :column
+            """
+        ),
+        {"table": f'"{table}"', "column": name_field},
+    )
+    if exists.first() is not None:
+        return
+
+    duplicates = f"""
+        SELECT id, min(id) OVER (PARTITION BY {name_field}) AS keep FROM "{table}"
+    """
+    for hotels in (Hotel.__tablename__, HotelRead.__tablename__):
+        await conn.execute(
+            text(
+                f"""
+                UPDATE {hotels} h SET {name_field}_id = d.keep
+                FROM ({duplicates}) d
+                WHERE h.{name_field}_id = d.id AND d.id <> d.keep
+                """
+            )
+        )
+    await conn.execute(
+        text(
+            f"""
+            DELETE FROM "{table}" l USING ({duplicates}) d
+            WHERE l.id = d.id AND d.id <> d.keep
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            f'CREATE UNIQUE INDEX "{table}_{name_field}_key" ON "{table}" ({name_field})'
+        )
+    )
+
+
+# <---------------Triggers keeping hotel_read in sync with writes made outside the API---------------->
+# The API writes hotel_read in the same statements as hotels. Migrations,
+# manual SQL and other services do not know about it, so hotels and location
+# renames are copied over by these triggers in the writing transaction,
+# whether the change feed is on or not. Statement level, like the feed.
+SYNC_HOTELS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION sync_hotel_read() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('application_name') = TG_ARGV[0] THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO {HotelRead.__tablename__} ({", ".join(HOTEL_READ_FIELDS)})
+    SELECT h.id, h.name, h.description, h.streetaddress, h.latitude, h.longitude,
+           c.country, s.state, ci.city, a.area,
+           h.country_id, h.state_id, h.city_id, h.area_id
+    FROM new_rows h
+    JOIN "Country" c ON c.id = h.country_id
+    JOIN "State" s ON s.id = h.state_id
+    JOIN "City" ci ON ci.id = h.city_id
+    JOIN "Area" a ON a.id = h.area_id
+    ON CONFLICT (id) DO UPDATE SET
+        {", ".join(f"{field} = excluded.{field}" for field in HOTEL_READ_FIELDS[1:])};
+    RETURN NULL;
+END
+$$
+"""
+
+
+def sync_location_function(name_field: str) -> str:
+    # The read rows store location names inline, a rename rewrites them
+    return f"""
+    CREATE OR REPLACE FUNCTION sync_hotel_read_{name_field}() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF current_setting('application_name') = TG_ARGV[0] THEN
+            RETURN NULL;
+        END IF;
+
+        UPDATE {HotelRead.__tablename__} h SET {name_field} = l.{name_field}
+        FROM new_rows l
+        WHERE h.{name_field}_id = l.id AND h.{name_field} IS DISTINCT FROM l.{name_field};
+        RETURN NULL;
+    END
+    $$
+    """
+
+
+async def install_read_triggers(conn: AsyncConnection, application_name: str):
+    """
+    Create the triggers copying writes made outside the API to hotel_read
+
+    Idempotent, every worker runs it at startup. Deletes need no trigger,
+    hotel_read rows go with their hotel through ON DELETE CASCADE.
+
+    Args:
+        conn: Connection with an open transaction
+        application_name: Sessions with this name maintain hotel_read themselves
+    """
+    # Workers starting together would otherwise replace the functions concurrently
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('read_triggers'))"))
+
+    argument = application_name.replace("'", "''")
+    await conn.execute(text(SYNC_HOTELS_FUNCTION))
+    for operation in ("INSERT", "UPDATE"):
+        await create_trigger(
+            conn,
+            f"hotels_sync_hotel_read_{operation.lower()}",
+            Hotel.__tablename__,
+            operation,
+            f"sync_hotel_read('{argument}')",
+        )
+    for model, name_field in LOCATION_MODELS.items():
+        await conn.execute(text(sync_location_function(name_field)))
+        await create_trigger(
+            conn,
+            f"{name_field}_sync_hotel_read_{name_field}_update",
+            model.__tablename__,
+            "UPDATE",
+            f"sync_hotel_read_{name_field}('{argument}')",
+        )
+
+
+TRANSITION_TABLES = {
+    "INSERT": "NEW TABLE AS new_rows",
+    "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "OLD TABLE AS old_rows",
+}
+
+
+async def create_trigger(
+    conn: AsyncConnection, name: str, table: str, operation: str, call: str
+):
+    """
+    Create a statement level trigger executing call, unless it exists
+
+    Existing triggers are left alone, dropping and creating one at every start
+    would lock its table against every read and write. Trigger functions are
+    replaced instead, the trigger picks up the new body.
+
+    Args:
+        conn: Connection with an open transaction
+        name: Trigger name, unique per table
+        table: Table to watch
+        operation: INSERT, UPDATE or DELETE, the transition tables allow one
+        call: Function and its arguments, e.g. "notify_hotel_changes('api')"
+    """
+    exists = await conn.execute(
+        text(
+            """
+            SELECT 1 FROM pg_trigger
+            WHERE tgrelid = CAST(:table AS regclass) AND tgname = :name
+            """
+        ),
+        {"table": f'"{table}"', "name": name},
+    )
+    if exists.first() is not None:
+        return
+    await conn.execute(
+        text(
+            f'CREATE TRIGGER {name} AFTER {operation} ON "{table}" '
+            f"REFERENCING {TRANSITION_TABLES[operation]} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {call}"
+        )
+    )
@@ -1,42 +1,186 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
-from configs.connect import get_db
+from configs.connect import db_pool_stats, get_db, get_read_db
+from configs.redis_pool import pool_stats, redis
 from interfaces.pydantic import HotelCreate, HotelUpdate
-from functions.func import add_hotel, get_hotels, update_hotel, delete
-from typing import Optional
+from functions.func import (
+    cache_writer,
+    change_feed,
+    add_hotel,
+    add_hotels_bulk,
+    get_hotels_etag,
+    get_hotels_json,
+    get_nearby_hotels,
+    stream_hotels,
+    suggest,
+    update_hotel,
+    delete,
+)
+from functions.responses import etag_matches
+from utils import metrics
+from utils.stream import iter_ndjson, to_ndjson
+from typing import List, Optional
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 1000
+MAX_SUGGESTIONS = 50
+MAX_RADIUS_KM = 500
+
 
 @router.get("/")
 def root():
     return {"message": "Hello, world!"}
 
 
+@router.get("/health")
+async def health():
+    # Queue depth shows whether the background cache writer keeps up, pool
+    # waits whether Redis connections are the bottleneck
+    await redis.ping()
+    return {
+        "status": "ok",
+        "cache_writer": cache_writer.stats(),
+        "change_feed": change_feed.stats(),
+        "redis_pool": pool_stats(),
+        "db_pool": db_pool_stats(),
+    }
+
+
+# Pools and background queues are read when scraped, not on every request
+metrics.stats_collector.register("db_pool", db_pool_stats)
+metrics.stats_collector.register("redis_pool", lambda: {"default": pool_stats()})
+metrics.stats_collector.register(
+    "cache_writer", lambda: {"default": cache_writer.stats()}
+)
+metrics.stats_collector.register(
+    "change_feed", lambda: {"default": change_feed.stats()}
+)
+
+
+@router.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @router.post("/hotels")
 async def create_hotel(hotel: HotelCreate, db: AsyncSession = Depends(get_db)):
     return await add_hotel(hotel, db)
 
 
+@router.post("/hotels/bulk")
+async def create_hotels_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    # Accept either a JSON array or an application/x-ndjson stream of HotelCreate.
+    # All or nothing, a bad line rolls back every hotel of the request.
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            hotels = iter_ndjson(request.stream(), HotelCreate)
+            return await add_hotels_bulk(hotels, db)
+
+        hotels = TypeAdapter(List[HotelCreate]).validate_json(await request.body())
+        return await add_hotels_bulk(hotels, db)
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=422, detail=f"{e}, no hotel of the request was inserted"
+        )
+
+
+@router.get("/hotels/nearby")
+async def nearby_hotels(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(5, gt=0, le=MAX_RADIUS_KM),  # kilometers
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    return await get_nearby_hotels(
+        db, lat, lon, radius, limit, country=country, state=state, city=city, area=area
+    )
+
+
+@router.get("/hotels/suggest")
+async def suggest_hotels(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+    db: AsyncSession = Depends(get_read_db),
+):
+    # Hotel and location names starting with q, for the search box
+    return await suggest(db, q, limit)
+
+
 @router.put("/hotels")
 async def change_hotel(hotel: HotelUpdate, db: AsyncSession = Depends(get_db)):
-    return await update_hotel(hotel, db)
+    try:
+        return await update_hotel(hotel, db)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 
 @router.get("/hotels")
 async def fetch_hotels(
+    request: Request,
     country: Optional[str] = None,
     state: Optional[str] = None,
     city: Optional[str] = None,
     area: Optional[str] = None,
     hotel_id: Optional[int] = None,
-    db: AsyncSession = Depends(get_db),
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return await get_hotels(
-        db, country=country, state=state, city=city, area=area, hotel_id=hotel_id
+    # Export mode, rows are written out as they are read instead of as one list
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        rows = stream_hotels(
+            country=country,
+            state=state,
+            city=city,
+            area=area,
+            hotel_id=hotel_id,
+            cursor=cursor,
+            limit=limit,
+            bind=db.bind,
+        )
+        return StreamingResponse(to_ndjson(rows), media_type="application/x-ndjson")
+
+    # Polling clients send back the ETag they have, unchanged listings are
+    # answered from the version counters alone
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = await get_hotels_etag(country=country, state=state, city=city, area=area)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    # Already serialized, sent as is without going through jsonable_encoder
+    body, next_cursor, etag = await get_hotels_json(
+        db,
+        country=country,
+        state=state,
+        city=city,
+        area=area,
+        hotel_id=hotel_id,
+        cursor=cursor,
+        limit=limit,
     )
 
+    response = Response(body, media_type="application/json", headers={"ETag": etag})
+    # A full page means there may be more, hand out the last id as the next cursor
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response
+
 
 @router.delete("/hotel")
 async def remove_hotels(id: int, db: AsyncSession = Depends(get_db)):
-    return await delete(id, db)
+    try:
+        return await delete(id, db)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
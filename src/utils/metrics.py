@@ -0,0 +1,154 @@
+import functools
+import time
+from typing import Any, Callable, Dict, Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from utils.timing import span
+
+# Every observation is a perf_counter pair plus a labelled child lookup, about
+# a microsecond. Each worker exposes its own series, scrape them all.
+
+LATENCY_BUCKETS = (
+    0.0002, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)  # fmt: skip
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+CACHE_LOOKUPS = Counter(
+    "hotel_cache_lookups_total",
+    "GET /hotels lookups by filter type and the layer that answered them",
+    ["filter", "source"],
+)
+RESULT_SIZE = Histogram(
+    "hotel_result_size",
+    "Hotels returned by one lookup, by the layer that answered it",
+    ["source"],
+    buckets=SIZE_BUCKETS,
+)
+REDIS_SCRIPT_SECONDS = Histogram(
+    "redis_script_seconds",
+    "Latency of one Lua script call",
+    ["script"],
+    buckets=LATENCY_BUCKETS,
+)
+REDIS_PIPELINE_SECONDS = Histogram(
+    "redis_pipeline_seconds",
+    "Latency of one pipeline round trip",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+REDIS_PIPELINE_COMMANDS = Histogram(
+    "redis_pipeline_commands",
+    "Commands sent in one pipeline round trip",
+    ["operation"],
+    buckets=SIZE_BUCKETS,
+)
+SQL_QUERY_SECONDS = Histogram(
+    "sql_query_seconds",
+    "Latency of one query function, commit included",
+    ["query"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def filter_type(
+    country: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    area: Optional[str] = None,
+    hotel_id: Optional[int] = None,
+) -> str:
+    """The most specific filter of a query, keeps the label set small"""
+    if hotel_id:
+        return "hotel_id"
+    for name, value in (("area", area), ("city", city), ("state", state)):
+        if value:
+            return name
+    return "country" if country else "all"
+
+
+def cache_lookup(filter: str, source: str, size: int):
+    CACHE_LOOKUPS.labels(filter, source).inc()
+    RESULT_SIZE.labels(source).observe(size)
+
+
+# <---------------Functions timing Redis round trips---------------->
+async def execute_pipeline(pipe, operation: str) -> list:
+    """Execute a pipeline, recording its latency and number of commands"""
+    commands = len(pipe)
+    with span(f"redis.{operation}"):
+        start = time.perf_counter()
+        try:
+            return await pipe.execute()
+        finally:
+            elapsed = time.perf_counter() - start
+            REDIS_PIPELINE_SECONDS.labels(operation).observe(elapsed)
+            REDIS_PIPELINE_COMMANDS.labels(operation).observe(commands)
+
+
+def timed_query(function: Callable) -> Callable:
+    """Decorator recording the latency of an async query function"""
+    histogram = SQL_QUERY_SECONDS.labels(function.__name__)
+    name = f"sql.{function.__name__}"
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        with span(name):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+# <---------------Gauges read from the stats() of pools and background tasks---------------->
+class StatsCollector:
+    """
+    Turns stats dictionaries into gauges at scrape time, so the pools and
+    queues pay nothing between scrapes
+
+    Numbers and booleans become one gauge per key, named <prefix>_<key>.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict[str, Dict[str, Any]]]] = {}
+
+    def register(self, prefix: str, stats: Callable[[], Dict[str, Dict[str, Any]]]):
+        """
+        Args:
+            prefix: Metric name prefix, e.g. "redis_pool"
+            stats: Returns the stats of every instance by its "instance" label
+        """
+        self._sources[prefix] = stats
+
+    def collect(self):
+        for prefix, stats in self._sources.items():
+            gauges = {}
+            for instance, values in stats().items():
+                for key, value in values.items():
+                    if not isinstance(value, (int, float)):
+                        continue
+                    if key not in gauges:
+                        gauges[key] = GaugeMetricFamily(
+                            f"{prefix}_{key}", f"{prefix} {key}", labels=["instance"]
+                        )
+                    gauges[key].add_metric([instance], float(value))
+            yield from gauges.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,90 @@
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, List, Type, Union
+
+from pydantic import BaseModel
+
+
+# <---------------Function to parse an NDJSON byte stream into pydantic models---------------->
+async def iter_ndjson(
+    chunks: AsyncIterable[bytes], model: Type[BaseModel]
+) -> AsyncIterator[BaseModel]:
+    """
+    Parse a newline delimited JSON stream without buffering the whole body
+
+    Args:
+        chunks: Raw body chunks as received from the client
+        model: Pydantic model every line is validated against
+
+    Yields:
+        One validated model instance per non-empty line
+
+    Raises:
+        ValueError: For a line that is not valid JSON or fails validation, with
+            its line number
+    """
+
+    def parse(line: bytes, number: int) -> BaseModel:
+        try:
+            return model.model_validate(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from e
+
+    buffer, number = b"", 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield parse(line, number)
+
+    if buffer.strip():
+        yield parse(buffer, number + 1)
+
+
+# <---------------Function to group a sync or async iterable into fixed size lists---------------->
+async def abatched(
+    items: Union[Iterable[Any], AsyncIterable[Any]], size: int
+) -> AsyncIterator[List[Any]]:
+    """
+    Group items into lists of at most `size` elements
+
+    Args:
+        items: A list, iterator or async iterator
+        size: Maximum number of items per batch
+
+    Yields:
+        Lists of items, the last one possibly shorter
+    """
+    batch = []
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    else:
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+
+    if batch:
+        yield batch
+
+
+# <---------------Function to encode rows as an NDJSON byte stream---------------->
+async def to_ndjson(rows: AsyncIterable[Any]) -> AsyncIterator[bytes]:
+    """
+    Encode each row as one JSON line as soon as it is produced
+
+    Args:
+        rows: Async iterable of dicts or RowMappings
+
+    Yields:
+        One encoded line per row
+    """
+    async for row in rows:
+        # RowMappings are not dicts, dict() makes them serialisable
+        yield json.dumps(row, default=dict).encode() + b"\n"
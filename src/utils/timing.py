@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this are logged, 0 turns the log off
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# Share of requests answered with a Server-Timing header, off by default. While
+# the slow log is on the spans of every request are recorded, a few objects
+# per request, and dropped unless it turns out slow.
+TIMING_SAMPLE_RATE = float(os.getenv("TIMING_SAMPLE_RATE", "0"))
+
+
+class Span:
+    __slots__ = ("name", "start", "duration", "children")
+
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.start = start
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def walk(self):
+        for child in self.children:
+            yield child
+            yield from child.walk()
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        """The span and its children, times in ms from origin"""
+        span = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            # None when it outlived the request, e.g. a shared cache fill
+            "duration_ms": None
+            if self.duration is None
+            else round(self.duration * 1000, 3),
+        }
+        if self.children:
+            span["children"] = [child.to_dict(origin) for child in self.children]
+        return span
+
+
+# The innermost open span of the current request, None when it is not timed.
+# Tasks copy the context they are created in, so spans of concurrent work end
+# up under the span that started it.
+_current: ContextVar[Optional[Span]] = ContextVar("timing_span", default=None)
+
+
+class _Timer:
+    __slots__ = ("_span", "_token")
+
+    def __init__(self, parent: Span, name: str):
+        self._span = Span(name, 0.0)
+        parent.children.append(self._span)
+
+    def __enter__(self):
+        self._token = _current.set(self._span)
+        self._span.start = time.perf_counter()
+        return self._span
+
+    def __exit__(self, *exc):
+        self._span.duration = time.perf_counter() - self._span.start
+        _current.reset(self._token)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+# <---------------Functions to record spans---------------->
+def span(name: str):
+    """
+    Context manager timing a step of the current request
+
+    A single ContextVar lookup when the request is not timed.
+    """
+    parent = _current.get()
+    if parent is None:
+        return _NO_TIMER
+    return _Timer(parent, name)
+
+
+def server_timing(root: Span, now: float) -> str:
+    """Server-Timing header value, spans sharing a name are summed"""
+    totals: Dict[str, float] = defaultdict(float)
+    for child in root.walk():
+        if child.duration is not None:
+            totals[child.name] += child.duration
+    metrics = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items()]
+    metrics.append(f"total;dur={(now - root.start) * 1000:.3f}")
+    return ", ".join(metrics)
+
+
+# <---------------Middleware timing every HTTP request---------------->
+class RequestTimingMiddleware:
+    """
+    Records the spans of requests, answers sampled ones with a Server-Timing
+    header and logs every request slower than slow_ms with its spans as one
+    JSON line
+
+    The header is built when the response starts, spans of a streamed body
+    only show in the log.
+    """
+
+    def __init__(
+        self,
+        app,
+        slow_ms: float = SLOW_REQUEST_MS,
+        sample_rate: float = TIMING_SAMPLE_RATE,
+    ):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        root = Span("request", time.perf_counter())
+        # Whether a request is slow is only known at its end, so its spans are
+        # recorded whenever the slow log could need them
+        timed = sampled or self.slow_ms > 0
+        token = _current.set(root) if timed else None
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if sampled:
+                    value = server_timing(root, time.perf_counter())
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", value.encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            root.duration = time.perf_counter() - root.start
+            if token is not None:
+                _current.reset(token)
+            if self.slow_ms and root.duration * 1000 >= self.slow_ms:
+                log_slow_request(scope, status, root)
+
+
+def log_slow_request(scope, status: Optional[int], root: Span):
+    record = {
+        "method": scope["method"],
+        "path": scope["path"],
+        "query": scope["query_string"].decode("latin-1"),
+        "status": status,  # None when the app failed before answering
+        "duration_ms": round(root.duration * 1000, 3),
+        "spans": [child.to_dict(root.start) for child in root.children],
+    }
+    logger.warning("Slow request %s", json.dumps(record))
@@ -0,0 +1,45 @@
+import json
+from functions.change_feed import ChangeFeed
+
+
+def make_feed():
+    async def handle(changes):
+        pass
+
+    return ChangeFeed(None, handle, channel="hotel_changes")
+
+
+def notify(feed, **event):
+    feed._on_notify(None, 0, feed.channel, json.dumps(event))
+
+
+def test_notifications_are_coalesced_per_table():
+    feed = make_feed()
+    notify(feed, table="hotels", ids=[1, 2])
+    notify(feed, table="hotels", ids=[2, 3])
+    notify(feed, table="City", ids=[7])
+    assert feed._pending == {
+        "hotels": {1: set(), 2: set(), 3: set()},
+        "City": {7: set()},
+    }
+    assert feed.received == 3
+    assert feed.stats()["pending"] == 4
+
+
+def test_every_location_a_hotel_left_is_kept():
+    feed = make_feed()
+    notify(feed, table="hotels", ids=[1])
+    notify(feed, table="hotels", ids=[], old=[[1, 1, 1, 1, 1]])
+    notify(feed, table="hotels", ids=[], old=[[1, 1, 1, 2, 2], [4, 1, 1, 1, 1]])
+    assert feed._pending["hotels"] == {
+        1: {(1, 1, 1, 1), (1, 1, 2, 2)},
+        4: {(1, 1, 1, 1)},
+    }
+
+
+def test_malformed_notifications_are_ignored():
+    feed = make_feed()
+    feed._on_notify(None, 0, feed.channel, "not json")
+    notify(feed, ids=[1])
+    assert feed._pending == {}
+    assert feed.received == 0
@@ -0,0 +1,84 @@
+import pytest
+from functions import codec
+from models.hotel import Area, City, Country, State
+from queries.location_cache import location_cache
+
+HOTEL = {
+    "id": 7,
+    "name": "Taj Lands End",
+    "description": "Sea view",
+    "streetaddress": "Bandstand",
+    "latitude": 19.04,
+    "longitude": 72.82,
+    "country": "India",
+    "state": "Maharashtra",
+    "city": "Mumbai",
+    "area": "Bandra",
+}
+IDS = (1, 2, 3, 4)
+
+
+@pytest.fixture
+def locations(monkeypatch):
+    monkeypatch.setattr(location_cache, "_ids", {})
+    monkeypatch.setattr(location_cache, "_names", {})
+    for model in (Country, State, City, Area):
+        location_cache._ids[model.__tablename__] = {}
+        location_cache._names[model.__tablename__] = {}
+    for (field, model), id in zip(codec.LOCATION_MODELS, IDS):
+        location_cache.add(model, HOTEL[field], id)
+
+
+def test_hotel_round_trip(locations):
+    assert codec.location_ids(HOTEL) == IDS
+    values = codec.unpack_hotel(codec.encode_hotel(HOTEL, IDS))
+    assert codec.packed_location_ids(values) == IDS
+    assert codec.decode_hotel(values) == HOTEL
+
+
+def test_hotel_round_trip_without_coordinates(locations):
+    hotel = {**HOTEL, "latitude": None, "longitude": None}
+    values = codec.unpack_hotel(codec.encode_hotel(hotel, IDS))
+    assert codec.decode_hotel(values) == hotel
+
+
+def test_unknown_location_is_not_decoded(locations):
+    assert codec.location_ids({**HOTEL, "city": "Pune"}) is None
+    values = codec.unpack_hotel(codec.encode_hotel(HOTEL, (1, 2, 99, 4)))
+    assert codec.decode_hotel(values) is None
+
+
+def test_normalize_name_folds_case_and_whitespace():
+    assert codec.normalize_name("  Taj \t LANDS  end ") == "taj lands end"
+    assert codec.normalize_name("Straße") == "strasse"
+
+
+def test_suggestion_round_trip():
+    member = codec.suggest_member("hotel", 7, "Taj  Lands End")
+    assert member.startswith(b"taj lands end\x00")
+    assert codec.decode_suggestion(member) == {
+        "type": "hotel",
+        "id": 7,
+        "name": "Taj  Lands End",
+    }
+
+
+def in_range(member: bytes, bounds) -> bool:
+    # BYLEX bounds, "[" marks an inclusive one
+    low, high = bounds
+    return low[1:] <= member <= high[1:]
+
+
+def test_suggest_range_holds_every_name_with_the_prefix():
+    bounds = codec.suggest_range(" TAJ  l")
+    for name in ("Taj L", "Taj Lands End", "taj lé", "TAJ L\U0001f3e8"):
+        assert in_range(codec.suggest_member("hotel", 1, name), bounds)
+    for name in ("Taj", "Taj Mahal", "Tajl", "Trident"):
+        assert not in_range(codec.suggest_member("hotel", 1, name), bounds)
+
+
+def test_suggest_range_leaves_out_the_flag_members():
+    for prefix in ("a", "lo", "comp", "ÿ", "\U0010ffff"):
+        bounds = codec.suggest_range(prefix)
+        for flag in (b"loading", b"complete"):
+            assert not in_range(codec.SUGGEST_FLAG + flag, bounds)
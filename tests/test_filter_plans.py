@@ -0,0 +1,141 @@
+"""
+The hotel filters must never be answered by a sequential scan of a large table
+
+Needs the PostgreSQL database configured in .env, so it is deselected by
+default. Run it with
+
+    uv run pytest -m postgres
+
+Locations and hotels are generated in a scratch schema that is dropped at the
+end, the tables of the database itself are not touched. EXPLAIN_COUNT sets the
+number of hotels (200000 by default), the expected plans assume about as many.
+"""
+
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from models.hotel import Base, HotelRead
+from queries.query import HOTEL_COLUMNS, filter_hotels, reconcile_hotel_read
+
+pytestmark = pytest.mark.postgres
+
+SCHEMA = "test_filter_plans"
+COUNT = int(os.getenv("EXPLAIN_COUNT", "200000"))
+PAGE_SIZE = 100
+
+# Rows per location table, every level has ten times more rows than the last
+LOCATIONS = (
+    ("Country", "country", 20),
+    ("State", "state", 200),
+    ("City", "city", 2000),
+    ("Area", "area", 20000),
+)
+
+# Location filters of every case. Which index answers a case is up to the
+# planner (countries and states hold so many hotels that walking the primary
+# key in id order fills a page sooner), only a sequential scan fails it.
+CASES = {
+    "country": {"country_id": 1},
+    "state": {"state_id": 1},
+    "city": {"city_id": 1},
+    "area": {"area_id": 1},
+    "state_city": {"state_id": 1, "city_id": 1},
+    "all_locations": {"country_id": 1, "state_id": 1, "city_id": 1, "area_id": 1},
+}
+
+
+async def generate(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.run_sync(Base.metadata.create_all)
+
+        for table, column, rows in LOCATIONS:
+            await conn.execute(
+                text(
+                    f'INSERT INTO "{table}" ({column}) '
+                    f"SELECT '{column} ' || i FROM generate_series(1, {rows}) i"
+                )
+            )
+
+        # Areas nest inside cities, cities inside states and states inside
+        # countries, like real addresses do. Spread without random() so every
+        # run plans the same data.
+        await conn.execute(
+            text(
+                "INSERT INTO hotels (name, description, streetaddress, latitude, "
+                "longitude, country_id, state_id, city_id, area_id) "
+                "SELECT 'Hotel ' || i, 'description', i || ' Main Road', "
+                "i % 180 - 90, i % 360 - 180, "
+                "area % 20 + 1, area % 200 + 1, area % 2000 + 1, area + 1 "
+                f"FROM (SELECT i, i * 7919 % 20000 AS area "
+                f"FROM generate_series(1, {COUNT}) i) s"
+            )
+        )
+
+    async with AsyncSession(engine) as db:
+        await reconcile_hotel_read(db)
+
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE"))
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+async def explain(engine, query) -> list:
+    sql = query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    async with engine.connect() as conn:
+        result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+        return list(plan_nodes(result.scalar()[0]["Plan"]))
+
+
+async def explain_cases() -> dict:
+    # Imported here, building the engines needs the settings of .env
+    from configs.connect import DATABASE_URL
+
+    engine = create_async_engine(
+        DATABASE_URL, connect_args={"server_settings": {"search_path": SCHEMA}}
+    )
+    try:
+        await generate(engine)
+        plans = {}
+        for name, location_ids in CASES.items():
+            query = filter_hotels(select(*HOTEL_COLUMNS), location_ids)
+            query = query.order_by(HotelRead.id).limit(PAGE_SIZE)
+            plans[name] = await explain(engine, query)
+
+        query = filter_hotels(
+            select(*HOTEL_COLUMNS), {"state_id": 1}, hotel_id=COUNT // 2
+        )
+        plans["hotel_id"] = await explain(engine, query)
+        return plans
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def plans():
+    return asyncio.run(explain_cases())
+
+
+@pytest.mark.parametrize("case", list(CASES) + ["hotel_id"])
+def test_filter_avoids_seq_scan(plans, case):
+    nodes = plans[case]
+    assert not [
+        node
+        for node in nodes
+        if node["Node Type"] == "Seq Scan"
+        and node.get("Relation Name") == HotelRead.__tablename__
+    ]
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+from queries.query import EARTH_RADIUS_KM, bounding_box, haversine_km
+
+
+def test_haversine_of_a_point_to_itself_is_zero():
+    assert haversine_km(18.52, 73.85, 18.52, 73.85) == 0
+
+
+def test_haversine_of_one_degree_along_a_meridian():
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(math.pi * EARTH_RADIUS_KM / 180)
+
+
+def test_haversine_of_antipodes_is_half_the_circumference():
+    assert haversine_km(0, 0, 0, 180) == pytest.approx(math.pi * EARTH_RADIUS_KM)
+
+
+def test_haversine_is_symmetric():
+    pune, mumbai = (18.52, 73.85), (19.07, 72.88)
+    assert haversine_km(*pune, *mumbai) == haversine_km(*mumbai, *pune)
+    assert haversine_km(*pune, *mumbai) == pytest.approx(119, abs=1)
+
+
+def circle(latitude, longitude, radius_km, points=360):
+    """Points on the circle, walked along great circles from the center"""
+    angle = radius_km / EARTH_RADIUS_KM
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    for i in range(points):
+        bearing = 2 * math.pi * i / points
+        lat2 = math.asin(
+            math.sin(lat) * math.cos(angle)
+            + math.cos(lat) * math.sin(angle) * math.cos(bearing)
+        )
+        lon2 = lon + math.atan2(
+            math.sin(bearing) * math.sin(angle) * math.cos(lat),
+            math.cos(angle) - math.sin(lat) * math.sin(lat2),
+        )
+        yield math.degrees(lat2), math.degrees(lon2)
+
+
+@pytest.mark.parametrize(
+    "latitude, longitude, radius_km",
+    [(18.52, 73.85, 5), (0, 0, 500), (-33.9, 18.4, 50), (70, 20, 500), (84, 0, 500)],
+)
+def test_bounding_box_holds_the_whole_circle(latitude, longitude, radius_km):
+    latitudes, longitudes = bounding_box(latitude, longitude, radius_km)
+    assert longitudes is not None
+    for lat, lon in circle(latitude, longitude, radius_km):
+        assert haversine_km(latitude, longitude, lat, lon) == pytest.approx(radius_km)
+        assert latitudes[0] - 1e-9 <= lat <= latitudes[1] + 1e-9
+        assert longitudes[0] - 1e-9 <= lon <= longitudes[1] + 1e-9
+
+
+def test_bounding_box_is_tight_on_the_equator():
+    latitudes, longitudes = bounding_box(0, 0, 111.2)
+    assert latitudes == pytest.approx((-1, 1), abs=0.01)
+    assert longitudes == pytest.approx((-1, 1), abs=0.01)
+
+
+def test_bounding_box_keeps_every_longitude_across_the_antimeridian():
+    _, longitudes = bounding_box(0, 179.9, 50)
+    assert longitudes is None
+    _, longitudes = bounding_box(0, -179.9, 50)
+    assert longitudes is None
+
+
+def test_bounding_box_keeps_every_longitude_around_a_pole():
+    latitudes, longitudes = bounding_box(89.9, 0, 20)
+    assert latitudes[1] > 90
+    assert longitudes is None
@@ -0,0 +1,58 @@
+import pytest
+from functions import l1
+from utils.lru import TTLCache
+
+PUNE = ("India", "MH", "Pune", "Baner")
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TTLCache(maxsize=100, ttl=60)
+    monkeypatch.setattr(l1, "l1_cache", cache)
+    monkeypatch.setattr(l1, "generation", 0)
+    return cache
+
+
+def store(cache, **filters):
+    key = l1.cache_key(**filters)
+    cache.set(key, [])
+    return key
+
+
+def test_evicts_queries_the_location_matches(cache):
+    evicted = [
+        store(cache),
+        store(cache, country="India"),
+        store(cache, city="Pune", limit=10),
+        store(cache, country="India", area="Baner", cursor=5),
+        store(cache, hotel_id=3),
+    ]
+    kept = [
+        store(cache, city="Mumbai"),
+        store(cache, country="India", area="Kothrud"),
+    ]
+    assert l1.evict_locations([PUNE]) == len(evicted)
+    assert all(cache.get(key) is None for key in evicted)
+    assert all(cache.get(key) is not None for key in kept)
+
+
+def test_evicts_for_every_location_given(cache):
+    pune, mumbai = store(cache, city="Pune"), store(cache, city="Mumbai")
+    delhi = store(cache, city="Delhi")
+    l1.evict_locations([PUNE, ("India", "MH", "Mumbai", "Bandra")])
+    assert cache.get(pune) is None and cache.get(mumbai) is None
+    assert cache.get(delhi) is not None
+
+
+def test_eviction_bumps_the_generation(cache, monkeypatch):
+    monkeypatch.setattr(l1, "L1_CACHE_SIZE", 100)
+    read_generation = l1.generation
+    assert l1.evict_locations([]) == 0
+    assert l1.generation == read_generation + 1
+
+    # A read that started before the eviction does not repopulate the cache
+    key = l1.cache_key(city="Pune")
+    l1.store(key, [], read_generation)
+    assert cache.get(key) is None
+    l1.store(key, [], l1.generation)
+    assert cache.get(key) == []
@@ -0,0 +1,57 @@
+import pytest
+from utils import lru
+from utils.lru import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lru.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_get_returns_stored_value(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", [1])
+    assert cache.get("a") == [1]
+    assert cache.get("b") is None
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    clock[0] += 10
+    assert cache.get("a") == 1
+    clock[0] += 0.001
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_dropped(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # b is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_set_again_renews_ttl(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    clock[0] += 8
+    cache.set("a", 2)
+    clock[0] += 8
+    assert cache.get("a") == 2
+
+
+def test_evict_drops_matching_keys(clock):
+    cache = TTLCache(maxsize=10, ttl=10)
+    for key in ("city:1", "city:2", "area:1"):
+        cache.set(key, 0)
+    assert cache.evict(lambda key: key.startswith("city:")) == 2
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
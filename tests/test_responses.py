@@ -0,0 +1,60 @@
+from functions import responses
+from functions.responses import etag_matches, version_fields
+
+TAG = responses.etag(b"abc.1.2")
+
+
+def test_etag_is_quoted_and_stable():
+    assert TAG.startswith('"') and TAG.endswith('"')
+    assert TAG == responses.etag(b"abc.1.2")
+    assert TAG != responses.etag(b"abc.1.3")
+
+
+def test_etag_matches_exact_tag():
+    assert etag_matches(TAG, TAG)
+    assert not etag_matches('"other"', TAG)
+
+
+def test_etag_matches_any_tag_of_a_list():
+    assert etag_matches(f'"other", {TAG}', TAG)
+    assert etag_matches(f'"other",{TAG}', TAG)
+    assert not etag_matches('"one", "two"', TAG)
+
+
+def test_etag_matches_weak_tag_and_wildcard():
+    assert etag_matches(f"W/{TAG}", TAG)
+    assert etag_matches("*", TAG)
+
+
+def test_etag_does_not_match_without_header():
+    assert not etag_matches(None, TAG)
+    assert not etag_matches("", TAG)
+
+
+def test_version_fields_without_location_depend_on_all():
+    assert version_fields() == [responses.EPOCH_FIELD, responses.ALL_VERSION]
+
+
+def test_version_fields_name_every_location_filter():
+    assert version_fields(country="India", city="Pune") == [
+        responses.EPOCH_FIELD,
+        "country:India",
+        "city:Pune",
+    ]
+    assert version_fields("India", "MH", "Pune", "Baner") == [
+        responses.EPOCH_FIELD,
+        "country:India",
+        "state:MH",
+        "city:Pune",
+        "area:Baner",
+    ]
+
+
+def test_hotel_version_fields_cover_the_queries_of_a_hotel():
+    hotel = {"country": "India", "state": "MH", "city": "Pune", "area": "Baner"}
+    fields = responses.hotel_version_fields([hotel])
+    assert responses.ALL_VERSION in fields
+    # A write bumps every counter a listing that can show the hotel reads
+    for query in ({}, {"city": "Pune"}, {"country": "India", "area": "Baner"}):
+        for field in version_fields(**query)[1:]:
+            assert field in fields
@@ -0,0 +1,95 @@
+import asyncio
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return calls
+
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(flight) == 1
+        release.set()
+        assert await asyncio.gather(*callers) == [1] * 5
+        assert len(flight) == 0
+
+        # Done calls are not remembered, the next one runs the work again
+        assert await flight.do("key", work) == 2
+
+    asyncio.run(main())
+
+
+def test_different_keys_run_separately():
+    async def main():
+        flight = SingleFlight()
+
+        async def work(value):
+            await asyncio.sleep(0)
+            return value
+
+        assert await asyncio.gather(
+            flight.do("a", lambda: work(1)), flight.do("b", lambda: work(2))
+        ) == [1, 2]
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == "done"
+        assert first.cancelled()
+
+    asyncio.run(main())
+
+
+def test_error_reaches_every_caller():
+    async def main():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0)
+            raise LookupError("missing")
+
+        results = await asyncio.gather(
+            flight.do("key", work), flight.do("key", work), return_exceptions=True
+        )
+        assert [type(result) for result in results] == [LookupError, LookupError]
+        assert len(flight) == 0
+
+    asyncio.run(main())
+
+
+def test_work_is_not_started_twice_while_running():
+    async def main():
+        flight = SingleFlight()
+        started = []
+
+        async def work():
+            started.append(1)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        assert started == [1]
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from interfaces.pydantic import HotelCreate
+from utils.stream import abatched, iter_ndjson, to_ndjson
+
+LINE = (
+    b'{"name": "h", "description": "d", "streetaddress": "s", '
+    b'"country": "India", "state": "MH", "city": "Pune", "area": "a"}'
+)
+
+
+async def chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+def parse(body: bytes, size: int = 7) -> list:
+    async def main():
+        return [hotel async for hotel in iter_ndjson(chunked(body, size), HotelCreate)]
+
+    return asyncio.run(main())
+
+
+def test_lines_split_across_chunks():
+    body = LINE + b"\n" + LINE.replace(b'"h"', b'"h2"') + b"\n"
+    for size in (1, 7, len(body)):
+        hotels = parse(body, size)
+        assert [hotel.name for hotel in hotels] == ["h", "h2"]
+
+
+def test_last_line_without_newline():
+    assert len(parse(LINE + b"\n" + LINE)) == 2
+
+
+def test_blank_lines_are_skipped():
+    assert len(parse(b"\n" + LINE + b"\n  \n\r\n" + LINE + b"\n\n")) == 2
+
+
+def test_invalid_json_names_its_line():
+    with pytest.raises(ValueError, match="line 3"):
+        parse(LINE + b"\n\n{not json}\n" + LINE)
+
+
+def test_invalid_hotel_names_its_line():
+    with pytest.raises(ValueError, match="line 2"):
+        parse(LINE + b'\n{"name": "h"}')
+
+
+def test_abatched_groups_sync_and_async_items():
+    async def items():
+        for item in range(5):
+            yield item
+
+    async def main():
+        return (
+            [batch async for batch in abatched(range(5), 2)],
+            [batch async for batch in abatched(items(), 2)],
+            [batch async for batch in abatched([], 2)],
+        )
+
+    sync, asynchronous, empty = asyncio.run(main())
+    assert sync == asynchronous == [[0, 1], [2, 3], [4]]
+    assert empty == []
+
+
+def test_to_ndjson_writes_one_line_per_row():
+    async def rows():
+        yield {"id": 1}
+        yield {"id": 2, "name": "h"}
+
+    async def main():
+        return b"".join([line async for line in to_ndjson(rows())])
+
+    assert asyncio.run(main()) == b'{"id": 1}\n{"id": 2, "name": "h"}\n'
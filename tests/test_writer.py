@@ -0,0 +1,127 @@
+import asyncio
+from functions.writer import CacheWriter
+
+
+class Recorder:
+    """Flush function recording every batch, optionally held until released"""
+
+    def __init__(self):
+        self.batches = []
+        self.events = []
+        self.hold = None
+
+    async def __call__(self, batch):
+        if self.hold is not None:
+            await self.hold.wait()
+        self.batches.append([dict(hotel) for hotel in batch])
+        self.events.append(("flush", [hotel["id"] for hotel in batch]))
+
+
+def test_writes_inline_while_not_running():
+    async def main():
+        flush = Recorder()
+        writer = CacheWriter(flush)
+        called = []
+
+        async def callback():
+            called.append(len(flush.batches))
+
+        await writer.enqueue([{"id": 1}], callback=callback)
+        assert flush.batches == [[{"id": 1}]]
+        assert called == [1]
+
+    asyncio.run(main())
+
+
+def test_latest_queued_version_wins():
+    async def main():
+        flush = Recorder()
+        writer = CacheWriter(flush, max_delay=0.01)
+        writer.start()
+        await writer.enqueue([{"id": 1, "v": 1}, {"id": 2, "v": 1}])
+        await writer.enqueue([{"id": 1, "v": 2}])
+        await writer.stop()
+
+        assert flush.batches == [[{"id": 1, "v": 2}, {"id": 2, "v": 1}]]
+        assert writer.coalesced == 1
+        assert writer.stats()["flushed"] == 2
+
+    asyncio.run(main())
+
+
+def test_callback_runs_after_the_hotels_queued_before_it():
+    async def main():
+        flush = Recorder()
+        writer = CacheWriter(flush, max_batch=1, max_delay=0.01)
+
+        async def callback():
+            flush.events.append(("callback", None))
+
+        writer.start()
+        await writer.enqueue([{"id": 1}, {"id": 2}], callback=callback)
+        await writer.enqueue([{"id": 3}])
+        await writer.stop()
+
+        # It may wait for hotels queued after it too, never run before its own
+        called = flush.events.index(("callback", None))
+        assert flush.events[:2] == [("flush", [1]), ("flush", [2])]
+        assert called >= 2
+        assert ("flush", [3]) in flush.events
+
+    asyncio.run(main())
+
+
+def test_flush_hotel_stores_a_queued_version_now():
+    async def main():
+        flush = Recorder()
+        writer = CacheWriter(flush, max_delay=10)
+        writer.start()
+        await writer.enqueue([{"id": 1}])
+        await writer.flush_hotel(1)
+        assert flush.batches == [[{"id": 1}]]
+        assert len(writer) == 0
+        await writer.stop()
+        assert flush.batches == [[{"id": 1}]]  # not written a second time
+
+    asyncio.run(main())
+
+
+def test_flush_hotel_waits_for_the_batch_being_stored():
+    async def main():
+        flush = Recorder()
+        flush.hold = asyncio.Event()
+        writer = CacheWriter(flush, max_delay=0.01)
+        writer.start()
+        await writer.enqueue([{"id": 1, "v": "old"}])
+        while not writer._in_flight:
+            await asyncio.sleep(0.005)  # the worker took the batch
+
+        # An update of hotel 1 must not run before the old version is stored,
+        # or that version would overwrite the update
+        update = asyncio.create_task(writer.flush_hotel(1))
+        await asyncio.sleep(0.02)
+        assert not update.done()
+
+        flush.hold.set()
+        await update
+        assert flush.batches == [[{"id": 1, "v": "old"}]]
+        assert not writer._in_flight
+        await writer.stop()
+
+    asyncio.run(main())
+
+
+def test_failed_flush_is_counted_and_releases_waiters():
+    async def main():
+        async def failing(batch):
+            raise ConnectionError("redis is down")
+
+        writer = CacheWriter(failing, max_delay=0.01)
+        writer.start()
+        await writer.enqueue([{"id": 1}])
+        await writer.stop()
+        assert writer.errors == 1
+        assert not writer._in_flight
+        await writer.flush_hotel(1)  # nothing left to wait for
+
+    asyncio.run(main())